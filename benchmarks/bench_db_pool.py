@@ -0,0 +1,58 @@
+"""Per-call latency: a new aiosqlite connection per call vs the pooled Database.
+
+    python benchmarks/bench_db_pool.py
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=2000)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ["DATABASE_PATH"] = os.path.join(tmp, "bench.db")
+
+    import aiosqlite
+
+    from tg_bot.db.database import Database
+
+    db = Database()
+    await db.init_db()
+    await db.get_or_create_user(user_id=1, username="bench", first_name="Bench")
+
+    async def connect_per_call() -> None:
+        # What every Database method did before the pool existed.
+        async with aiosqlite.connect(db.db_path) as conn:
+            cursor = await conn.execute("SELECT rubies FROM users WHERE user_id = ?", (1,))
+            await cursor.fetchone()
+
+    async def pooled() -> None:
+        await db.get_user_rubies(1)
+
+    print(f"{'mode':>18} {'mean µs':>10} {'p50 µs':>10} {'p99 µs':>10}")
+    for name, call in (("connect per call", connect_per_call), ("pooled", pooled)):
+        samples = []
+        for _ in range(args.calls):
+            started = time.perf_counter()
+            await call()
+            samples.append((time.perf_counter() - started) * 1e6)
+        samples.sort()
+        p99 = samples[int(len(samples) * 0.99) - 1]
+        print(f"{name:>18} {statistics.mean(samples):>10.0f} {statistics.median(samples):>10.0f} {p99:>10.0f}")
+
+    await db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,85 @@
+"""Wait time per user class at the model gate under skewed load: FIFO vs fair share.
+
+One heavy user submits a burst of generations while light users (some of them
+paying) submit a few each. The upstream is simulated by a fixed service time.
+
+    python benchmarks/bench_fair_scheduling.py
+"""
+
+import argparse
+import asyncio
+import random
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+class FixedLimits:
+    def __init__(self, max_in_flight: int, max_queue: int):
+        self.limits = (max_in_flight, max_queue)
+
+    def get_admission_limits(self, name):
+        return self.limits
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+async def simulate(args, fair: bool):
+    from tg_bot.services.admission import AdmissionController
+
+    admission = AdmissionController(
+        FixedLimits(args.in_flight, 10_000), queue_timeout=3600, fair=fair, quantum=args.quantum
+    )
+    rng = random.Random(args.seed)
+    loop = asyncio.get_running_loop()
+    waits = {"heavy": [], "light": [], "paying": []}
+
+    async def call(user, kind, weight, delay):
+        await asyncio.sleep(delay)
+        submitted = loop.time()
+        async with admission.slot("model", user=user, cost=args.price, weight=weight):
+            waits[kind].append((loop.time() - submitted) * 1000)
+            await asyncio.sleep(args.service_ms / 1000)
+
+    calls = [call("heavy", "heavy", 1.0, 0) for _ in range(args.heavy_jobs)]
+    for i in range(args.light_users):
+        kind, weight = ("paying", args.paying_weight) if i < args.paying_users else ("light", 1.0)
+        for _ in range(args.light_jobs):
+            # Light users arrive while the heavy burst is still queued.
+            calls.append(call(f"user{i}", kind, weight, rng.uniform(0.001, args.spread_ms / 1000)))
+    await asyncio.gather(*calls)
+    return waits
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--heavy-jobs", type=int, default=60)
+    parser.add_argument("--light-users", type=int, default=12)
+    parser.add_argument("--light-jobs", type=int, default=3)
+    parser.add_argument("--paying-users", type=int, default=4)
+    parser.add_argument("--paying-weight", type=float, default=2.0)
+    parser.add_argument("--in-flight", type=int, default=4)
+    parser.add_argument("--service-ms", type=float, default=20.0)
+    parser.add_argument("--spread-ms", type=float, default=100.0)
+    parser.add_argument("--price", type=float, default=5.0)
+    parser.add_argument("--quantum", type=float, default=5.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"{'mode':>6} {'class':>8} {'jobs':>6} {'p50 ms':>10} {'p99 ms':>10}")
+    for name, fair in (("fifo", False), ("fair", True)):
+        waits = await simulate(args, fair)
+        for kind, samples in waits.items():
+            if not samples:
+                continue
+            p50 = percentile(samples, 0.5)
+            p99 = percentile(samples, 0.99)
+            print(f"{name:>6} {kind:>8} {len(samples):>6} {p50:>10.1f} {p99:>10.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
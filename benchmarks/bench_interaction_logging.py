@@ -0,0 +1,96 @@
+"""Per-log-call overhead on the event loop thread: sync file handler vs queued events.
+
+    python benchmarks/bench_interaction_logging.py
+"""
+
+import argparse
+import logging
+import os
+import queue
+import sys
+import tempfile
+import time
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from tg_bot.logging_setup import (  # noqa: E402
+    BatchingLogListener,
+    InteractionLogger,
+    InteractionTextFormatter,
+    _EventQueueHandler,
+)
+
+USER = SimpleNamespace(id=1303908054, username="someone", first_name="Someone")
+PROMPT = "Футуристический город на закате, неоновые огни, дождь, отражения в лужах " * 3
+
+
+def _measure(call, n: int) -> float:
+    started = time.perf_counter()
+    for _ in range(n):
+        call()
+    return (time.perf_counter() - started) / n * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--calls", type=int, default=50000)
+    args = parser.parse_args()
+    tmp = tempfile.mkdtemp()
+
+    # Before: RotatingFileHandler on the caller thread + an eagerly built f-string.
+    sync_logger = logging.getLogger("bench_sync")
+    sync_logger.propagate = False
+    sync_handler = RotatingFileHandler(os.path.join(tmp, "sync.log"), maxBytes=10 * 1024 * 1024, backupCount=5)
+    sync_handler.setFormatter(logging.Formatter("%(asctime)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S"))
+    sync_logger.addHandler(sync_handler)
+    sync_logger.setLevel(logging.INFO)
+
+    def before():
+        sync_logger.info(
+            f"USER: @{USER.username or 'не указан'} (ID: {USER.id}) | ACTION: generate_image | PROMPT: {PROMPT[:100]}..."
+        )
+
+    # After: structured event, formatting/writing/rotation on the listener thread.
+    handler = RotatingFileHandler(os.path.join(tmp, "queued.log"), maxBytes=10 * 1024 * 1024, backupCount=5)
+    handler.setFormatter(InteractionTextFormatter())
+    log_queue = queue.SimpleQueue()
+    listener = BatchingLogListener(log_queue, handler)
+    listener.start()
+    queued_logger = logging.getLogger("bench_queued")
+    queued_logger.propagate = False
+    queued_logger.addHandler(_EventQueueHandler(log_queue, listener))
+    queued_logger.setLevel(logging.INFO)
+    interactions = InteractionLogger(queued_logger, listener)
+
+    def after():
+        interactions.event(USER, "generate_image", model="google/gemini-2.5-flash-image", prompt=PROMPT)
+
+    filtered_logger = logging.getLogger("bench_filtered")
+    filtered_logger.setLevel(logging.WARNING)
+    filtered = InteractionLogger(filtered_logger)
+
+    def filtered_out():
+        filtered.event(USER, "generate_image", model="google/gemini-2.5-flash-image", prompt=PROMPT)
+
+    def guarded():
+        if filtered.enabled:
+            filtered.event(USER, "generate_image", model="google/gemini-2.5-flash-image", prompt=PROMPT)
+
+    print(f"{'mode':>28} {'µs / call':>10}")
+    for name, call in (
+        ("sync RotatingFileHandler", before),
+        ("queued structured event", after),
+        ("filtered-out event", filtered_out),
+        ("filtered-out, guarded", guarded),
+    ):
+        print(f"{name:>28} {_measure(call, args.calls):>10.2f}")
+
+    interactions.close()
+    sync_handler.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Throughput of update processing vs number of simulated users.
+
+Compares PTB's default sequential processing with PerUserUpdateProcessor.
+Each handler simulates an I/O-bound update (await asyncio.sleep).
+
+    python benchmarks/bench_update_processor.py
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from telegram.ext import SimpleUpdateProcessor  # noqa: E402
+
+from tg_bot.update_processor import PerUserUpdateProcessor  # noqa: E402
+
+
+async def _run(processor, users: int, per_user: int, handler_ms: float) -> float:
+    async def handler():
+        await asyncio.sleep(handler_ms / 1000)
+
+    def update(user_id: int):
+        return SimpleNamespace(effective_user=SimpleNamespace(id=user_id), effective_chat=None)
+
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(processor.process_update(update(uid), handler()) for _ in range(per_user) for uid in range(users))
+    )
+    elapsed = time.perf_counter() - started
+    return users * per_user / elapsed
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 4, 16, 64, 256])
+    parser.add_argument("--per-user", type=int, default=5)
+    parser.add_argument("--handler-ms", type=float, default=50.0)
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+
+    print(f"{'users':>6} {'sequential upd/s':>18} {'per-user upd/s':>16} {'speedup':>8}")
+    for users in args.users:
+        sequential = await _run(SimpleUpdateProcessor(1), users, args.per_user, args.handler_ms)
+        concurrent = await _run(
+            PerUserUpdateProcessor(args.concurrency), users, args.per_user, args.handler_ms
+        )
+        print(f"{users:>6} {sequential:>18.1f} {concurrent:>16.1f} {concurrent / sequential:>7.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
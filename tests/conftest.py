@@ -42,6 +42,19 @@ def reload_module():
     return _reload
 
 
+@pytest.fixture
+async def database(tmp_paths, reload_module):
+    """Initialized Database on an isolated file; always closed (pool threads are not daemonic)."""
+    reload_module("tg_bot.core.config")
+    db_mod = reload_module("tg_bot.db.database")
+    db = db_mod.Database()
+    await db.init_db()
+    try:
+        yield db
+    finally:
+        await db.close()
+
+
 def _env_truthy(name: str) -> bool:
     return os.getenv(name, "").strip().lower() in {"1", "true", "yes", "y", "on"}
 
@@ -5,7 +5,8 @@ import pytest
 
 @pytest.mark.integration
 @pytest.mark.expensive
-def test_yookassa_create_payment_real():
+@pytest.mark.asyncio
+async def test_yookassa_create_payment_real():
     """
     Real API test for YooKassa.
     WARNING: creates a payment (no charge unless you actually pay it).
@@ -18,9 +19,14 @@ def test_yookassa_create_payment_real():
     from tg_bot.payments.yookassa_payment import YooKassaPayment
 
     y = YooKassaPayment()
-    p = y.create_payment(amount=1.00, user_id=123, rubies=1, description="Integration test payment")
+    try:
+        p = await y.create_payment(amount=1.00, user_id=123, rubies=1, description="Integration test payment")
+        status = await y.check_payment_status(p["payment_id"])
+    finally:
+        await y.aclose()
 
     assert "payment_id" in p and p["payment_id"]
     assert "confirmation_url" in p and p["confirmation_url"]
     assert "status" in p and p["status"]
+    assert status is not None and status["status"] == p["status"]
 
@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+
+from tg_bot.services.admission import AdmissionController, AdmissionRejected
+
+
+class FakeModels:
+    def __init__(self, max_in_flight, max_queue):
+        self.limits = (max_in_flight, max_queue)
+
+    def get_admission_limits(self, name):
+        return self.limits
+
+
+@pytest.mark.asyncio
+async def test_burst_is_limited_queued_in_order_and_overflow_rejected_fast():
+    admission = AdmissionController(FakeModels(max_in_flight=2, max_queue=3), queue_timeout=5)
+    release = asyncio.Event()
+    running = 0
+    peak = 0
+    order = []
+
+    async def call(i):
+        nonlocal running, peak
+        async with admission.slot("m"):
+            order.append(i)
+            running += 1
+            peak = max(peak, running)
+            await release.wait()
+            running -= 1
+
+    loop = asyncio.get_running_loop()
+    tasks = [asyncio.create_task(call(i)) for i in range(8)]
+    started = loop.time()
+    await asyncio.sleep(0.01)
+
+    stats = admission.stats()["m"]
+    assert stats["in_flight"] == 2 and stats["queued"] == 3
+    # Overflow is rejected immediately, without waiting for the timeout.
+    rejected = [t for t in tasks if t.done()]
+    assert len(rejected) == 3 and loop.time() - started < 0.5
+    assert all(isinstance(t.exception(), AdmissionRejected) for t in rejected)
+    assert rejected[0].exception().reason == "queue_full"
+
+    release.set()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    assert peak == 2
+    assert order == [0, 1, 2, 3, 4]
+    stats = admission.stats()["m"]
+    assert stats["in_flight"] == 0 and stats["queued"] == 0
+    assert stats["admitted"] == 5 and stats["rejected_queue_full"] == 3
+    assert stats["avg_wait_ms"] > 0
+
+
+@pytest.mark.asyncio
+async def test_wait_times_out_and_cancelled_waiters_do_not_leak_slots():
+    admission = AdmissionController(FakeModels(max_in_flight=1, max_queue=5), queue_timeout=0.05)
+    hold = asyncio.Event()
+
+    async def holder():
+        async with admission.slot("m"):
+            await hold.wait()
+
+    holding = asyncio.create_task(holder())
+    await asyncio.sleep(0)
+    with pytest.raises(AdmissionRejected) as exc:
+        async with admission.slot("m"):
+            pass
+    assert exc.value.reason == "timeout"
+
+    admission.queue_timeout = 5
+    waiter = asyncio.create_task(holder())
+    await asyncio.sleep(0.01)
+    waiter.cancel()
+    hold.set()
+    await asyncio.gather(holding, waiter, return_exceptions=True)
+
+    stats = admission.stats()["m"]
+    assert stats["in_flight"] == 0 and stats["queued"] == 0 and stats["timed_out"] == 1
+    async with admission.slot("m"):
+        assert admission.stats()["m"]["in_flight"] == 1
+
+
+def test_fair_queue_round_robins_users_by_cost_and_weight():
+    from tg_bot.services.admission import FairQueue
+
+    queue = FairQueue(quantum=2)
+    for i in range(6):
+        queue.push("heavy", f"h{i}", cost=2)
+    queue.push("light", "l0", cost=2)
+    queue.push("cheap", "c0", cost=1)
+    queue.push("cheap", "c1", cost=1)
+    # The heavy user's backlog does not hold back the others.
+    assert [queue.pop() for _ in range(4)] == ["h0", "l0", "c0", "c1"]
+    assert queue.users == 1
+
+    queue = FairQueue(quantum=1)
+    for i in range(4):
+        queue.push("paying", f"p{i}", weight=2)
+        queue.push("free", f"f{i}")
+    order = [queue.pop() for _ in range(6)]
+    assert order == ["p0", "p1", "f0", "p2", "p3", "f1"]
+    assert len(queue) == 2 and queue.pop() == "f2"
+
+
+@pytest.mark.asyncio
+async def test_heavy_user_does_not_starve_light_user():
+    admission = AdmissionController(FakeModels(max_in_flight=1, max_queue=50), queue_timeout=5, fair=True, quantum=1)
+    order = []
+
+    async def call(user, i):
+        async with admission.slot("m", user=user, cost=1):
+            order.append((user, i))
+            await asyncio.sleep(0.001)
+
+    tasks = [asyncio.create_task(call("heavy", i)) for i in range(10)]
+    await asyncio.sleep(0)
+    tasks += [asyncio.create_task(call("light", i)) for i in range(2)]
+    await asyncio.gather(*tasks)
+
+    light_positions = [n for n, (user, _) in enumerate(order) if user == "light"]
+    assert light_positions[-1] < 5
+    assert [i for user, i in order if user == "heavy"] == list(range(10))
@@ -0,0 +1,129 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from tg_bot.services.albums import AlbumAggregator
+
+
+def _update(user_id: int):
+    return SimpleNamespace(effective_user=SimpleNamespace(id=user_id))
+
+
+class Recorder:
+    def __init__(self):
+        self.albums = []
+        self.done = asyncio.Event()
+        self.expected = 0
+
+    async def __call__(self, update, context, photos, caption):
+        self.albums.append((update.effective_user.id, photos, caption))
+        if len(self.albums) >= self.expected:
+            self.done.set()
+
+
+def _download(payload: bytes, delay: float = 0.01, fail: bool = False):
+    async def download():
+        await asyncio.sleep(delay)
+        if fail:
+            raise RuntimeError("network")
+        return payload
+
+    return download
+
+
+async def _send_album(aggregator, recorder, user_id, group_id, count, gap=0.01, caption=None):
+    for i in range(count):
+        aggregator.add(
+            group_id,
+            _update(user_id),
+            None,
+            _download(f"{group_id}-{i}".encode(), delay=0.05 - i * 0.004),
+            recorder,
+            caption=caption if i == 0 else None,
+        )
+        await asyncio.sleep(gap)
+
+
+@pytest.mark.asyncio
+async def test_burst_of_albums_completes_each_once_and_early():
+    aggregator = AlbumAggregator(max_photos=10, min_debounce=0.05, max_debounce=1.0, max_wait=5)
+    recorder = Recorder()
+    recorder.expected = 20
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+
+    await asyncio.gather(
+        *(
+            _send_album(aggregator, recorder, user_id=i, group_id=f"g{i}", count=2 + i % 8, caption=f"c{i}")
+            for i in range(20)
+        )
+    )
+    await asyncio.wait_for(recorder.done.wait(), 2)
+
+    # Adaptive quiet period (~3x the 10 ms gaps), far below max_debounce.
+    assert loop.time() - started < 0.6
+    assert len(recorder.albums) == 20
+    for user_id, photos, caption in recorder.albums:
+        count = 2 + user_id % 8
+        # Concurrent downloads finish out of order, but the album keeps arrival order.
+        assert photos == [f"g{user_id}-{i}".encode() for i in range(count)]
+        assert caption == f"c{user_id}"
+    stats = aggregator.stats()
+    assert stats["completed"] == 20
+    assert stats["collecting"] == 0
+
+
+@pytest.mark.asyncio
+async def test_album_closes_as_soon_as_cap_is_reached():
+    aggregator = AlbumAggregator(max_photos=3, min_debounce=1.0, max_debounce=5.0, max_wait=10)
+    recorder = Recorder()
+    recorder.expected = 1
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+
+    await _send_album(aggregator, recorder, user_id=1, group_id="g", count=5, gap=0)
+    await asyncio.wait_for(recorder.done.wait(), 1)
+
+    assert loop.time() - started < 0.5
+    assert len(recorder.albums[0][1]) == 3
+    assert aggregator.stats()["dropped_over_cap"] == 2
+    assert aggregator.stats()["completed_by_count"] == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_downloads_are_skipped_and_errors_do_not_leak_groups():
+    aggregator = AlbumAggregator(max_photos=10, min_debounce=0.02, max_debounce=0.1, max_wait=1)
+    received = []
+
+    async def on_complete(update, context, photos, caption):
+        received.append(photos)
+        raise RuntimeError("handler failed")
+
+    aggregator.add("g", _update(1), None, _download(b"ok"), on_complete)
+    aggregator.add("g", _update(1), None, _download(b"", fail=True), on_complete)
+    await asyncio.sleep(0.3)
+
+    assert received == [[b"ok"]]
+    assert not aggregator.is_known("g")
+    assert aggregator.stats()["failed_downloads"] == 1
+
+
+@pytest.mark.asyncio
+async def test_rejected_and_stale_groups_are_evicted():
+    aggregator = AlbumAggregator(max_photos=10, min_debounce=5, max_debounce=5, max_wait=10, stale_after=0.05)
+    recorder = Recorder()
+
+    aggregator.reject("rejected", 1)
+    aggregator.add("rejected", _update(1), None, _download(b"x"), recorder)
+    aggregator.add("stuck", _update(2), None, _download(b"y", delay=10), recorder)
+    assert aggregator.is_known("rejected") and aggregator.is_known("stuck")
+
+    # No further albums arrive: the groups still expire on their own.
+    await asyncio.sleep(0.1)
+
+    assert not aggregator.is_known("rejected")
+    assert not aggregator.is_known("stuck")
+    assert aggregator.stats()["evicted"] == 1
+    await aggregator.close()
+    assert recorder.albums == []
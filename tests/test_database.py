@@ -2,14 +2,8 @@ import pytest
 
 
 @pytest.mark.asyncio
-async def test_new_user_starts_with_20_rubies(tmp_paths, reload_module):
-    # reload config+db after env vars set by fixture
-    reload_module("tg_bot.core.config")
-    db_mod = reload_module("tg_bot.db.database")
-    Database = db_mod.Database
-
-    db = Database()
-    await db.init_db()
+async def test_new_user_starts_with_20_rubies(database):
+    db = database
 
     user = await db.get_or_create_user(user_id=1, username="u1", first_name="User")
     assert user["rubies"] == 20
@@ -17,13 +11,8 @@ async def test_new_user_starts_with_20_rubies(tmp_paths, reload_module):
 
 
 @pytest.mark.asyncio
-async def test_get_or_create_user_does_not_reset_existing_balance(tmp_paths, reload_module):
-    reload_module("tg_bot.core.config")
-    db_mod = reload_module("tg_bot.db.database")
-    Database = db_mod.Database
-
-    db = Database()
-    await db.init_db()
+async def test_get_or_create_user_does_not_reset_existing_balance(database):
+    db = database
 
     await db.get_or_create_user(user_id=1, username="u1", first_name="User")
     await db.add_rubies(1, 5)
@@ -34,19 +23,133 @@ async def test_get_or_create_user_does_not_reset_existing_balance(tmp_paths, rel
 
 
 @pytest.mark.asyncio
-async def test_transfer_rubies_updates_balances(tmp_paths, reload_module):
+async def test_transfer_rubies_updates_balances(database):
+    db = database
+
+    await db.get_or_create_user(user_id=1, username="from", first_name="From")
+    await db.get_or_create_user(user_id=2, username="to", first_name="To")
+
+    ok = await db.transfer_rubies(1, 2, 7)
+    assert ok is True
+    assert await db.get_user_rubies(1) == 13
+    assert await db.get_user_rubies(2) == 27
+
+
+@pytest.mark.asyncio
+async def test_connections_are_pooled_and_use_wal(tmp_paths, reload_module):
     reload_module("tg_bot.core.config")
     db_mod = reload_module("tg_bot.db.database")
-    Database = db_mod.Database
 
-    db = Database()
+    db = db_mod.Database(pool_size=2)
     await db.init_db()
+    await db.get_or_create_user(user_id=1, username="u1", first_name="User")
+    for _ in range(20):
+        await db.get_user_rubies(1)
+
+    assert len(db._connections) == 2
+    async with db._connection() as conn:
+        cursor = await conn.execute("PRAGMA journal_mode")
+        assert (await cursor.fetchone())[0] == "wal"
+    await db.close()
+
+
+@pytest.mark.asyncio
+async def test_retry_on_busy_retries_locked_errors(reload_module, monkeypatch):
+    import sqlite3
+
+    db_mod = reload_module("tg_bot.db.database")
+    monkeypatch.setattr(db_mod, "BUSY_RETRY_DELAY", 0)
+    calls = 0
+
+    @db_mod.retry_on_busy
+    async def flaky():
+        nonlocal calls
+        calls += 1
+        if calls < 3:
+            raise sqlite3.OperationalError("database is locked")
+        return "ok"
+
+    assert await flaky() == "ok"
+    assert calls == 3
+
+
+@pytest.mark.asyncio
+async def test_parallel_deductions_cannot_overspend(database):
+    import asyncio
+
+    db = database
+    await db.get_or_create_user(user_id=1, username="u1", first_name="User")
+
+    results = await asyncio.gather(*(db.deduct_rubies(1, 5) for _ in range(10)))
+    assert sum(results) == 4
+    assert await db.get_user_rubies(1) == 0
+    assert await db.deduct_rubies(1, 1) is False
 
+
+@pytest.mark.asyncio
+async def test_user_cache_serves_known_users_and_stays_consistent(database):
+    db = database
     await db.get_or_create_user(user_id=1, username="from", first_name="From")
     await db.get_or_create_user(user_id=2, username="to", first_name="To")
 
-    ok = await db.transfer_rubies(1, 2, 7)
-    assert ok is True
-    assert await db.get_user_rubies(1) == 13
+    misses = db.users.misses
+    await db.get_or_create_user(user_id=1, username="from", first_name="From")
+    assert db.users.misses == misses
+    assert db.users.hits >= 1
+
+    await db.add_rubies(1, 10)
+    await db.deduct_rubies(1, 5)
+    await db.transfer_rubies(1, 2, 7)
+    assert await db.get_user_rubies(1) == 18
     assert await db.get_user_rubies(2) == 27
 
+    # cached values match what is actually stored
+    db.users.clear()
+    assert await db.get_user_rubies(1) == 18
+    assert await db.get_user_rubies(2) == 27
+
+
+def test_user_cache_evicts_least_recently_used():
+    from tg_bot.db.cache import UserCache
+
+    cache = UserCache(max_size=2)
+    for user_id in (1, 2):
+        cache.put({"user_id": user_id, "rubies": 0})
+    cache.get(1)
+    cache.put({"user_id": 3, "rubies": 0})
+
+    assert cache.get(2) is None
+    assert cache.get(1) is not None
+    assert cache.stats()["evictions"] == 1
+
+
+@pytest.mark.asyncio
+async def test_batch_writer_group_commits_history_rows(database):
+    db = database
+    await db.get_or_create_user(user_id=1, username="u1", first_name="User")
+    batches_before = db.writer.batches
+
+    for i in range(50):
+        await db.log_generation(1, f"prompt {i}", 1)
+    await db.writer.flush()
+
+    assert db.writer.batches - batches_before < 50
+    async with db._connection() as conn:
+        rows = await conn.execute_fetchall("SELECT COUNT(*) FROM generations")
+    assert rows[0][0] == 50
+
+
+@pytest.mark.asyncio
+async def test_batch_writer_flushes_queue_on_close(tmp_paths, reload_module):
+    import sqlite3
+
+    reload_module("tg_bot.core.config")
+    db_mod = reload_module("tg_bot.db.database")
+    db = db_mod.Database()
+    await db.init_db()
+    for i in range(10):
+        await db.log_generation(1, f"prompt {i}", 1)
+    await db.close()
+
+    with sqlite3.connect(tmp_paths["db_path"]) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM generations").fetchone()[0] == 10
@@ -0,0 +1,74 @@
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from tg_bot.clients.downloader import ImageDownloader
+
+IMAGE = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 64
+
+
+async def _image(request):
+    return web.Response(body=IMAGE, content_type="image/png")
+
+
+async def _streamed(request):
+    # No Content-Length: the limit has to be enforced while streaming.
+    resp = web.StreamResponse()
+    resp.enable_chunked_encoding()
+    await resp.prepare(request)
+    for _ in range(64):
+        await resp.write(b"\x00" * 1024)
+    return resp
+
+
+@pytest.fixture
+async def server():
+    app = web.Application()
+    app.router.add_get("/image.png", _image)
+    app.router.add_get("/stream", _streamed)
+    test_server = TestServer(app)
+    await test_server.start_server()
+    try:
+        yield test_server
+    finally:
+        await test_server.close()
+
+
+@pytest.fixture
+async def downloader():
+    d = ImageDownloader(max_bytes=32 * 1024, spool_bytes=4 * 1024)
+    try:
+        yield d
+    finally:
+        await d.aclose()
+
+
+@pytest.mark.asyncio
+async def test_downloads_share_one_session(server, downloader):
+    first = await downloader.fetch(str(server.make_url("/image.png")))
+    session = downloader._session
+    second = await downloader.fetch(str(server.make_url("/image.png")))
+
+    assert first.read() == IMAGE
+    assert second.read() == IMAGE
+    assert downloader._session is session
+    stats = downloader.stats()
+    assert stats["downloads"] == 2
+    assert stats["bytes"] == 2 * len(IMAGE)
+
+
+@pytest.mark.asyncio
+async def test_body_size_is_capped(server):
+    small = ImageDownloader(max_bytes=1024)
+    try:
+        assert await small.fetch(str(server.make_url("/image.png"))) is None
+        assert await small.fetch(str(server.make_url("/stream"))) is None
+        assert small.stats()["too_large"] == 2
+    finally:
+        await small.aclose()
+
+
+@pytest.mark.asyncio
+async def test_http_errors_return_none(server, downloader):
+    assert await downloader.fetch(str(server.make_url("/missing"))) is None
+    assert downloader.stats()["errors"] == 1
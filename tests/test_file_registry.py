@@ -0,0 +1,71 @@
+import io
+import os
+from types import SimpleNamespace
+
+import pytest
+from telegram.error import BadRequest
+
+from tg_bot.file_registry import FileRegistry, file_digest
+
+
+class FakeBot:
+    def __init__(self, reject_file_ids=False):
+        self.sent = []
+        self.reject_file_ids = reject_file_ids
+
+    async def send_photo(self, chat_id, photo, **kwargs):
+        if isinstance(photo, str):
+            if self.reject_file_ids:
+                raise BadRequest("Wrong file identifier/http url specified")
+            self.sent.append(photo)
+        else:
+            self.sent.append(photo.read())
+        n = len(self.sent)
+        sizes = [SimpleNamespace(file_id=f"thumb-{n}", file_unique_id=f"t-{n}"), SimpleNamespace(file_id=f"id-{n}", file_unique_id=f"u-{n}")]
+        return SimpleNamespace(photo=sizes)
+
+
+@pytest.mark.asyncio
+async def test_same_result_is_uploaded_once_and_file_id_survives_restart(database):
+    image = os.urandom(64 * 1024)
+    registry = FileRegistry(database)
+    bot = FakeBot()
+
+    await registry.send_photo(bot, 1, io.BytesIO(image), caption="1")
+    await registry.send_photo(bot, 1, io.BytesIO(image), caption="2")
+    assert bot.sent == [image, "id-1"]
+    assert registry.stats()["uploads"] == 1 and registry.stats()["reused"] == 1
+
+    # A fresh process finds the file_id in SQLite.
+    await database.writer.flush()
+    restarted = FileRegistry(database)
+    await restarted.send_photo(bot, 1, io.BytesIO(image))
+    assert bot.sent[-1] == "id-1"
+
+
+@pytest.mark.asyncio
+async def test_rejected_file_id_falls_back_to_upload(database):
+    image = os.urandom(1024)
+    registry = FileRegistry(database)
+    await registry.send_photo(FakeBot(), 1, io.BytesIO(image))
+
+    bot = FakeBot(reject_file_ids=True)
+    await registry.send_photo(bot, 1, io.BytesIO(image))
+    assert bot.sent == [image]
+    assert registry.stats()["stale"] == 1
+    # The new upload's file_id replaced the rejected one.
+    assert await registry.file_id_for(file_digest(io.BytesIO(image))) == "id-1"
+
+
+def test_input_cache_is_bounded_lru():
+    registry = FileRegistry(db=None, input_budget=100)
+    registry.put_input("a", 1024, b"x" * 40)
+    registry.put_input("b", 1024, b"y" * 40)
+    assert registry.get_input("a", 1024) == b"x" * 40
+    registry.put_input("c", 1024, b"z" * 40)
+
+    assert registry.get_input("b", 1024) is None
+    assert registry.get_input("a", 2048) is None
+    assert registry.get_input("c", 1024) == b"z" * 40
+    registry.put_input("huge", 1024, b"h" * 200)
+    assert registry.stats()["input_bytes"] == 80
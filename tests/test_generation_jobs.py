@@ -0,0 +1,172 @@
+import asyncio
+
+import pytest
+
+from tg_bot.services.jobs import GenerationWorkerPool
+
+
+async def _wait_for(predicate, timeout=2.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not predicate():
+        assert loop.time() < deadline, "condition not reached"
+        await asyncio.sleep(0.01)
+
+
+@pytest.fixture
+async def jobs_db(database):
+    await database.get_or_create_user(user_id=1, username="u1", first_name="User")
+    return database
+
+
+async def _enqueue(db, cost=5):
+    return await db.enqueue_generation_job(1, 1, "image", "test/model", "cat", cost, [b"input"])
+
+
+@pytest.mark.asyncio
+async def test_enqueue_reserves_atomically_and_respects_balance(jobs_db):
+    job_id = await _enqueue(jobs_db, cost=15)
+    assert job_id is not None
+    assert await jobs_db.get_user_rubies(1) == 5
+    assert await _enqueue(jobs_db, cost=15) is None
+    assert await jobs_db.count_generation_jobs() == {"queued": 1, "running": 0}
+
+
+@pytest.mark.asyncio
+async def test_job_of_crashed_worker_is_resumed_after_lease_expires(jobs_db):
+    job_id = await _enqueue(jobs_db)
+    # A worker claims the job and dies without finishing it.
+    crashed = await jobs_db.claim_generation_job("crashed", 0.05, 2)
+    assert crashed["id"] == job_id and crashed["inputs"] == [b"input"]
+
+    done = []
+
+    async def process(job):
+        # The balance after the charge comes back from the completing UPDATE itself.
+        assert await jobs_db.complete_generation_job(job["id"], job["lease_owner"], job["prompt"]) == 15
+        done.append(job)
+
+    pool = GenerationWorkerPool(jobs_db, workers=2, lease_seconds=5, max_attempts=2, poll_interval=0.02)
+    pool.start(process)
+    try:
+        await _wait_for(lambda: done)
+    finally:
+        await pool.stop()
+
+    assert done[0]["id"] == job_id and done[0]["attempts"] == 2
+    assert pool.stats()["resumed"] == 1
+    # The crashed worker's lease is gone: it can no longer complete the job.
+    assert await jobs_db.complete_generation_job(job_id, "crashed", "cat") is None
+    assert await jobs_db.get_user_rubies(1) == 15
+
+
+@pytest.mark.asyncio
+async def test_job_out_of_attempts_is_refunded_once(jobs_db):
+    job_id = await _enqueue(jobs_db)
+    await jobs_db.claim_generation_job("crashed", 0.01, 1)
+    await asyncio.sleep(0.05)
+
+    refunds = []
+
+    async def on_refund(refund):
+        refunds.append(refund)
+
+    async def never_called(job):
+        raise AssertionError("job out of attempts must not run")
+
+    # Recovery runs on start.
+    pool = GenerationWorkerPool(jobs_db, workers=1, lease_seconds=5, max_attempts=1, poll_interval=0.02)
+    pool.start(never_called, on_refund)
+    try:
+        await _wait_for(lambda: refunds)
+        assert await pool.recover() == 0
+    finally:
+        await pool.stop()
+
+    assert [r["id"] for r in refunds] == [job_id]
+    assert refunds[0]["balance"] == 20
+    assert await jobs_db.get_user_rubies(1) == 20
+    assert await jobs_db.claim_generation_job("late", 5, 5) is None
+
+
+@pytest.mark.asyncio
+async def test_stop_requeues_running_jobs_and_crashes_are_refunded(jobs_db):
+    started = asyncio.Event()
+
+    async def hang(job):
+        started.set()
+        await asyncio.Event().wait()
+
+    await _enqueue(jobs_db)
+    pool = GenerationWorkerPool(jobs_db, workers=1, lease_seconds=5, poll_interval=0.02)
+    pool.start(hang)
+    await asyncio.wait_for(started.wait(), 2)
+    await pool.stop()
+
+    assert pool.stats()["requeued_on_stop"] == 1
+    assert await jobs_db.count_generation_jobs() == {"queued": 1, "running": 0}
+    assert await jobs_db.get_user_rubies(1) == 15
+
+    async def crash(job):
+        raise RuntimeError("boom")
+
+    restarted = GenerationWorkerPool(jobs_db, workers=1, lease_seconds=5, poll_interval=0.02)
+    restarted.start(crash)
+    try:
+        await _wait_for(lambda: restarted.stats()["crashed"] == 1)
+    finally:
+        await restarted.stop()
+    # Requeueing did not burn an attempt; the crash refunded the reservation.
+    assert restarted.stats()["resumed"] == 0
+    assert await jobs_db.get_user_rubies(1) == 20
+
+
+@pytest.mark.asyncio
+async def test_claim_caps_running_jobs_per_user_and_prefers_idle_users(jobs_db):
+    await jobs_db.get_or_create_user(user_id=2, username="u2", first_name="User")
+    heavy = [await _enqueue(jobs_db, cost=1) for _ in range(3)]
+    light = await jobs_db.enqueue_generation_job(2, 2, "text", "test/model", "dog", 1, [])
+
+    first = await jobs_db.claim_generation_job("w", 60, 2, max_per_user=2)
+    # User 1 already has a running job, so the idle user 2 goes next despite the later id.
+    second = await jobs_db.claim_generation_job("w", 60, 2, max_per_user=2)
+    third = await jobs_db.claim_generation_job("w", 60, 2, max_per_user=2)
+    assert [first["id"], second["id"], third["id"]] == [heavy[0], light, heavy[1]]
+    assert await jobs_db.claim_generation_job("w", 60, 2, max_per_user=2) is None
+
+    assert await jobs_db.complete_generation_job(first["id"], "w", "cat") is not None
+    fourth = await jobs_db.claim_generation_job("w", 60, 2, max_per_user=2)
+    assert fourth["id"] == heavy[2]
+
+
+@pytest.mark.asyncio
+async def test_recent_payment_is_detected(jobs_db):
+    assert not await jobs_db.has_recent_payment(1, 86400)
+    await jobs_db.create_payment("p1", 1, 100.0, 50)
+    assert not await jobs_db.has_recent_payment(1, 86400)
+    await jobs_db.credit_payment("p1")
+
+    # Served from the cached user row: the payments table is not queried.
+    async with jobs_db._connection() as conn:
+        await conn.execute("DELETE FROM payments")
+        await conn.commit()
+    assert await jobs_db.has_recent_payment(1, 86400)
+    assert not await jobs_db.has_recent_payment(2, 86400)
+
+    jobs_db.users.clear()
+    assert await jobs_db.has_recent_payment(1, 86400)
+
+
+@pytest.mark.asyncio
+async def test_completed_jobs_write_history_through_the_batch_writer(jobs_db):
+    written = jobs_db.writer.rows_written
+    for _ in range(3):
+        await _enqueue(jobs_db, cost=1)
+    while (job := await jobs_db.claim_generation_job("w", 60, 2)) is not None:
+        await jobs_db.complete_generation_job(job["id"], "w", "[Image-to-Image] cat")
+    await jobs_db.writer.flush()
+
+    assert jobs_db.writer.rows_written - written == 3
+    async with jobs_db._connection() as conn:
+        rows = await conn.execute_fetchall("SELECT prompt, cost FROM generations WHERE user_id = 1")
+    assert rows == [("[Image-to-Image] cat", 1)] * 3
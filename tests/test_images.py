@@ -0,0 +1,69 @@
+import io
+from types import SimpleNamespace
+
+import pytest
+
+from tg_bot.images import ImagePreprocessor, pick_photo_size, preprocess_image, sniff_mime
+
+PIL = pytest.importorskip("PIL")
+from PIL import Image  # noqa: E402
+
+
+def _encode(image, fmt, **kwargs) -> bytes:
+    out = io.BytesIO()
+    image.save(out, format=fmt, **kwargs)
+    return out.getvalue()
+
+
+def test_sniff_mime():
+    assert sniff_mime(_encode(Image.new("RGB", (4, 4)), "PNG")) == "image/png"
+    assert sniff_mime(bytearray(_encode(Image.new("RGB", (4, 4)), "JPEG"))) == "image/jpeg"
+    assert sniff_mime(_encode(Image.new("RGB", (4, 4)), "WEBP")) == "image/webp"
+    assert sniff_mime(b"unknown") == "image/jpeg"
+
+
+def test_pick_photo_size_prefers_smallest_adequate():
+    sizes = [SimpleNamespace(width=w, height=h) for w, h in [(90, 60), (320, 213), (800, 533), (1280, 853), (2560, 1706)]]
+    assert pick_photo_size(sizes, 1024) is sizes[3]
+    assert pick_photo_size(sizes, 4096) is sizes[-1]
+    assert pick_photo_size(sizes, 100) is sizes[1]
+
+
+def test_preprocess_downscales_and_strips_metadata():
+    exif = Image.Exif()
+    exif[0x010F] = "CameraMaker"
+    source = _encode(Image.effect_noise((3000, 2000), 64).convert("RGB"), "JPEG", quality=95, exif=exif)
+
+    result = preprocess_image(source, max_side=1024, quality=85)
+
+    assert len(result) < len(source)
+    with Image.open(io.BytesIO(result)) as image:
+        assert image.format == "JPEG"
+        assert max(image.size) == 1024
+        assert not image.getexif()
+
+
+def test_preprocess_keeps_alpha_as_png_and_never_grows_small_images():
+    transparent = _encode(Image.new("RGBA", (2000, 1000), (255, 0, 0, 128)), "PNG")
+    with Image.open(io.BytesIO(preprocess_image(transparent, max_side=500))) as image:
+        assert image.format == "PNG"
+        assert image.size == (500, 250)
+
+    # Re-encoding a small image never makes the request body bigger.
+    small = _encode(Image.effect_noise((64, 64), 64).convert("RGB"), "JPEG", quality=50)
+    assert preprocess_image(small, max_side=1024) == small
+
+
+@pytest.mark.asyncio
+async def test_preprocessor_runs_in_process_pool():
+    preprocessor = ImagePreprocessor(workers=1)
+    try:
+        source = bytearray(_encode(Image.new("RGB", (1600, 1200), (10, 20, 30)), "PNG"))
+        result = await preprocessor.prepare(source, max_side=800)
+    finally:
+        preprocessor.close()
+
+    assert sniff_mime(result) == "image/jpeg"
+    with Image.open(io.BytesIO(result)) as image:
+        assert image.size == (800, 600)
+    assert preprocessor.stats()["processed"] == 1
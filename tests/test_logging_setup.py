@@ -0,0 +1,91 @@
+import json
+import logging
+import queue
+import threading
+from logging.handlers import QueueHandler, RotatingFileHandler
+from types import SimpleNamespace
+
+from tg_bot.logging_setup import (
+    BatchingLogListener,
+    InteractionJsonFormatter,
+    InteractionLogger,
+    InteractionTextFormatter,
+    setup_logging,
+)
+
+USER = SimpleNamespace(id=42, username="alice")
+
+
+def _make_logger(tmp_path, formatter, name, max_bytes=0):
+    handler = RotatingFileHandler(tmp_path / "interactions.log", maxBytes=max_bytes, backupCount=2, encoding="utf-8")
+    handler.setFormatter(formatter)
+    log_queue = queue.SimpleQueue()
+    listener = BatchingLogListener(log_queue, handler)
+    listener.start()
+    logger = logging.getLogger(name)
+    logger.handlers = [QueueHandler(log_queue)]
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    return InteractionLogger(logger, listener)
+
+
+def test_text_format_keeps_legacy_line_shape(tmp_path):
+    log = _make_logger(tmp_path, InteractionTextFormatter(), "test_interactions_text")
+    log.event(USER, "image_generated", model="m", cost=5, prompt="x" * 300)
+    log.close()
+
+    line = (tmp_path / "interactions.log").read_text(encoding="utf-8").strip()
+    assert "USER: @alice (ID: 42) | ACTION: image_generated | MODEL: m | COST: 5 | PROMPT: " in line
+    assert line.endswith("x" * 100 + "...")
+
+
+def test_json_lines_output(tmp_path):
+    log = _make_logger(tmp_path, InteractionJsonFormatter(), "test_interactions_json")
+    for i in range(3):
+        log.event(USER, "command", command=f"/c{i}", latency_ms=i)
+    log.close()
+
+    rows = [json.loads(line) for line in (tmp_path / "interactions.log").read_text(encoding="utf-8").splitlines()]
+    assert [r["command"] for r in rows] == ["/c0", "/c1", "/c2"]
+    assert rows[0]["user_id"] == 42 and rows[0]["action"] == "command"
+
+
+def test_listener_rotates_files(tmp_path):
+    log = _make_logger(tmp_path, InteractionTextFormatter(), "test_interactions_rotate", max_bytes=2000)
+    for i in range(200):
+        log.event(USER, "command", command=f"/c{i}")
+    log.close()
+
+    assert (tmp_path / "interactions.log.1").exists()
+
+
+def test_filtered_out_events_are_not_queued(tmp_path):
+    log = _make_logger(tmp_path, InteractionTextFormatter(), "test_interactions_filtered")
+    log.logger.setLevel(logging.WARNING)
+    log.event(USER, "command", command="/start")
+    log.close()
+
+    assert (tmp_path / "interactions.log").read_text(encoding="utf-8") == ""
+
+
+def test_filtered_out_logger_reports_disabled(tmp_path):
+    log = _make_logger(tmp_path, InteractionTextFormatter(), "test_interactions_enabled")
+    assert log.enabled
+    log.logger.setLevel(logging.WARNING)
+    assert not log.enabled
+    log.close()
+
+
+def test_repeated_setup_stops_the_previous_writer(tmp_path, monkeypatch):
+    monkeypatch.setattr("tg_bot.logging_setup.INTERACTION_LOG_PATH", str(tmp_path / "interactions.log"))
+    first = setup_logging()
+    second = setup_logging()
+    try:
+        writers = [t for t in threading.enumerate() if t.name == "interaction-log-writer"]
+        assert len(writers) == 1
+        second.event(USER, "command", command="/start")
+    finally:
+        second.close()
+        first.close()
+
+    assert "/start" in (tmp_path / "interactions.log").read_text(encoding="utf-8")
@@ -0,0 +1,78 @@
+import pytest
+
+
+async def _plan(conn, sql, params) -> str:
+    rows = await conn.execute_fetchall("EXPLAIN QUERY PLAN " + sql, params)
+    return " | ".join(row[3] for row in rows)
+
+
+@pytest.fixture
+def db(database):
+    return database
+
+
+@pytest.mark.asyncio
+async def test_migrations_are_recorded_and_idempotent(db):
+    from tg_bot.db.migrations import LATEST_VERSION, apply_migrations, get_schema_version
+
+    await db.init_db()
+    async with db._connection() as conn:
+        assert await get_schema_version(conn) == LATEST_VERSION
+        assert await apply_migrations(conn) == LATEST_VERSION
+        rows = await conn.execute_fetchall("SELECT COUNT(*) FROM schema_version")
+    assert rows[0][0] == LATEST_VERSION
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "sql, params, expected_indexes",
+    [
+        (
+            # Database.get_transfer_history
+            """
+            SELECT t.id, t.from_user_id, t.to_user_id, t.amount, t.created_at,
+                   u1.username, u1.first_name, u2.username, u2.first_name
+            FROM transfers t
+            LEFT JOIN users u1 ON t.from_user_id = u1.user_id
+            LEFT JOIN users u2 ON t.to_user_id = u2.user_id
+            WHERE t.from_user_id = ? OR t.to_user_id = ?
+            ORDER BY t.created_at DESC
+            LIMIT ?
+            """,
+            (1, 1, 10),
+            ["idx_transfers_from_user", "idx_transfers_to_user"],
+        ),
+        (
+            # Database.get_user_by_username
+            "SELECT user_id, username, first_name, rubies FROM users WHERE username = ? COLLATE NOCASE",
+            ("Someone",),
+            ["idx_users_username_nocase"],
+        ),
+        (
+            "SELECT payment_id FROM payments WHERE user_id = ? AND status = ?",
+            (1, "pending"),
+            ["idx_payments_user_status"],
+        ),
+        (
+            # Database.get_pending_payments
+            """
+            SELECT payment_id, user_id, rubies, created_at FROM payments
+            WHERE status = 'pending' AND created_at <= datetime('now', ?) AND (created_at, payment_id) > (?, ?)
+            ORDER BY created_at, payment_id LIMIT ?
+            """,
+            ("-120 seconds", "", "", 100),
+            ["idx_payments_status_created"],
+        ),
+        (
+            "SELECT prompt, cost FROM generations WHERE user_id = ? ORDER BY created_at DESC LIMIT 10",
+            (1,),
+            ["idx_generations_user"],
+        ),
+    ],
+)
+async def test_hot_queries_use_indexes(db, sql, params, expected_indexes):
+    async with db._connection() as conn:
+        plan = await _plan(conn, sql, params)
+    for index in expected_indexes:
+        assert index in plan, plan
+    assert "SCAN" not in plan, plan
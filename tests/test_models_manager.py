@@ -14,3 +14,48 @@ def test_models_manager_enabled_models_nonempty():
     assert isinstance(enabled, list)
     assert len(enabled) >= 1
 
+
+def test_latency_sketch_p95_is_close():
+    from tg_bot.models.health import LatencySketch
+
+    sketch = LatencySketch(decay_every=10_000)
+    for i in range(1, 1001):
+        sketch.add(i / 100)
+    assert abs(sketch.quantile(0.95) - 9.5) / 9.5 < 0.06
+    assert abs(sketch.quantile(0.5) - 5.0) / 5.0 < 0.06
+
+    # Decay: after a shift, recent latency dominates.
+    sketch = LatencySketch(decay_every=100)
+    for _ in range(1000):
+        sketch.add(1.0)
+    for _ in range(400):
+        sketch.add(20.0)
+    assert sketch.quantile(0.5) > 15
+
+
+def test_auto_routes_to_fastest_healthy_model_within_price():
+    mm = ModelsManager()
+    auto = mm.get_model_by_name("auto")
+    assert auto["auto"] and mm.get_default_model() is not auto
+    assert auto not in mm.get_routable_models()
+
+    cheap = [m["openrouter_name"] for m in mm.get_routable_models() if m["price_rubies"] <= auto["price_rubies"]]
+    expensive = [m["openrouter_name"] for m in mm.get_routable_models() if m["price_rubies"] > auto["price_rubies"]]
+    assert len(cheap) >= 2 and expensive
+    for name in expensive:
+        mm.record_call(name, 0.1, ok=True)
+    for i, name in enumerate(cheap):
+        mm.record_call(name, 10.0 + i, ok=True)
+    assert mm.route_auto(auto)["openrouter_name"] == cheap[0]
+
+    # The fastest one starts failing: traffic moves to the next one until the cooldown ends.
+    health = mm.health(cheap[0])
+    for _ in range(5):
+        mm.record_call(cheap[0], None, ok=False)
+    assert not health.healthy
+    assert mm.route_auto(auto)["openrouter_name"] == cheap[1]
+    health.last_error_at -= health.cooldown
+    assert mm.route_auto(auto)["openrouter_name"] == cheap[0]
+
+    stats = mm.health_stats()[cheap[0]]
+    assert stats["errors"] == 5 and stats["ewma_ms"] == 10000
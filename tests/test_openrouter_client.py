@@ -0,0 +1,65 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from tg_bot.clients import openrouter_client
+from tg_bot.clients.openrouter_client import OpenRouterClient
+
+
+@pytest.fixture(autouse=True)
+def _api_key(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(openrouter_client, "OPENROUTER_API_KEY", "test-key")
+
+
+def _completion(url: str) -> dict:
+    return {
+        "id": "gen-1",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "test/model",
+        "choices": [
+            {
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {
+                    "role": "assistant",
+                    "content": None,
+                    "images": [{"type": "image_url", "image_url": {"url": url}}],
+                },
+            }
+        ],
+    }
+
+
+@pytest.mark.asyncio
+async def test_generate_image_returns_image_url():
+    async def handler(request: httpx.Request) -> httpx.Response:
+        assert request.url.path.endswith("/chat/completions")
+        return httpx.Response(200, json=_completion("data:image/png;base64,AAAA"))
+
+    client = OpenRouterClient(http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    try:
+        assert await client.generate_image("cat", model="test/model") == "data:image/png;base64,AAAA"
+    finally:
+        await client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_generate_image_does_not_block_event_loop():
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(0.3)
+        return httpx.Response(200, json=_completion("data:image/png;base64,AAAA"))
+
+    client = OpenRouterClient(http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+    try:
+        started = time.perf_counter()
+        results = await asyncio.gather(*(client.generate_image(f"p{i}", model="test/model") for i in range(5)))
+        elapsed = time.perf_counter() - started
+    finally:
+        await client.aclose()
+
+    assert all(results)
+    # 5 sequential calls would take >= 1.5s
+    assert elapsed < 1.0
@@ -0,0 +1,201 @@
+import asyncio
+import random
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from tg_bot.clients import openrouter_client
+from tg_bot.clients.openrouter_client import OpenRouterClient
+from tg_bot.clients.resilience import CircuitOpen, ResilientCaller, UpstreamError, classify_error
+from tg_bot.models.models_manager import ModelsManager
+
+URL = "data:image/png;base64,AAAA"
+
+
+def _completion(url: str = URL) -> dict:
+    return {
+        "id": "gen-1",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "test/model",
+        "choices": [
+            {
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": None, "images": [{"image_url": {"url": url}}]},
+            }
+        ],
+    }
+
+
+class FaultyUpstream:
+    """Local OpenRouter stand-in: each request takes the next scripted fault, then succeeds."""
+
+    def __init__(self):
+        self.faults = []
+        self.requests = 0
+        self.delay = 0.0
+
+    async def handle(self, request):
+        self.requests += 1
+        fault = self.faults.pop(0) if self.faults else None
+        if fault == "slow":
+            await asyncio.sleep(1.0)
+        elif fault is not None:
+            status, headers = fault
+            return web.json_response({"error": {"message": "injected", "code": status}}, status=status, headers=headers)
+        await asyncio.sleep(self.delay)
+        return web.json_response(_completion())
+
+
+@pytest.fixture(autouse=True)
+def _api_key(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(openrouter_client, "OPENROUTER_API_KEY", "test-key")
+
+
+@pytest.fixture
+async def upstream():
+    faulty = FaultyUpstream()
+    app = web.Application()
+    app.router.add_post("/api/v1/chat/completions", faulty.handle)
+    server = TestServer(app)
+    await server.start_server()
+    faulty.base_url = str(server.make_url("/api/v1"))
+    try:
+        yield faulty
+    finally:
+        await server.close()
+
+
+def _caller(**kwargs):
+    params = dict(
+        attempts=3,
+        base_delay=0.01,
+        max_delay=0.05,
+        deadline=5,
+        hedge=False,
+        breaker_failures=5,
+        breaker_reset=30,
+        rng=random.Random(0),
+    )
+    params.update(kwargs)
+    return ResilientCaller(**params)
+
+
+@pytest.fixture
+async def make_client(upstream):
+    clients = []
+
+    def make(**kwargs):
+        client = OpenRouterClient(base_url=upstream.base_url, resilience=_caller(**kwargs))
+        clients.append(client)
+        return client
+
+    try:
+        yield make
+    finally:
+        for client in clients:
+            await client.aclose()
+
+
+@pytest.mark.asyncio
+async def test_transient_errors_are_retried(upstream, make_client):
+    client = make_client()
+    upstream.faults = [(429, {"Retry-After": "0"}), (502, {})]
+
+    assert await client.generate_image("cat", model="test/model") == URL
+    assert upstream.requests == 3
+    stats = client.stats()
+    assert stats["retries"] == 2 and stats["errors"] == {"rate_limited": 1, "server": 1}
+
+
+@pytest.mark.asyncio
+async def test_client_errors_are_not_retried(upstream, make_client):
+    client = make_client()
+    upstream.faults = [(400, {})]
+
+    with pytest.raises(UpstreamError) as exc:
+        await client.generate_image("cat", model="test/model")
+    assert exc.value.kind == "client" and not exc.value.retryable
+    assert upstream.requests == 1
+
+
+@pytest.mark.asyncio
+async def test_retries_stop_at_the_deadline(upstream, make_client):
+    # The breaker must not open first: this test is about the deadline alone.
+    client = make_client(attempts=100, base_delay=0.1, max_delay=0.1, deadline=0.3, breaker_failures=100)
+    upstream.faults = [(503, {})] * 100
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    with pytest.raises(UpstreamError) as exc:
+        await client.generate_image("cat", model="test/model")
+    assert exc.value.kind == "server"
+    assert loop.time() - started < 0.6
+    assert upstream.requests < 10
+
+
+@pytest.mark.asyncio
+async def test_circuit_opens_fails_fast_and_recovers(upstream, make_client):
+    client = make_client(attempts=1, breaker_failures=2, breaker_reset=0.1)
+    upstream.faults = [(503, {}), (503, {})]
+
+    for _ in range(2):
+        with pytest.raises(UpstreamError):
+            await client.generate_image("cat", model="test/model")
+    with pytest.raises(CircuitOpen):
+        await client.generate_image("cat", model="test/model")
+    assert upstream.requests == 2
+    # Other models are not affected.
+    assert await client.generate_image("cat", model="other/model") == URL
+
+    await asyncio.sleep(0.15)
+    # Half-open: one probe goes through and closes the circuit.
+    assert await client.generate_image("cat", model="test/model") == URL
+    assert client.resilience.breaker("test/model").state == "closed"
+    stats = client.stats()
+    assert stats["fast_failed"] == 1 and stats["circuit_opens"] == 1 and stats["open_circuits"] == "-"
+
+
+@pytest.mark.asyncio
+async def test_cancelled_half_open_probe_releases_the_circuit(upstream, make_client):
+    client = make_client(attempts=1, breaker_failures=1, breaker_reset=0.05)
+    upstream.faults = [(503, {}), "slow"]
+    with pytest.raises(UpstreamError):
+        await client.generate_image("cat", model="test/model")
+    await asyncio.sleep(0.06)
+
+    # The half-open probe is cancelled mid-call (shutdown, a lost hedge, a torn-down waiter).
+    probe = asyncio.create_task(client.generate_image("cat", model="test/model"))
+    await asyncio.sleep(0.1)
+    probe.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await probe
+
+    assert await client.generate_image("cat", model="test/model") == URL
+    assert client.resilience.breaker("test/model").state == "closed"
+
+
+@pytest.mark.asyncio
+async def test_slow_request_is_hedged(upstream, make_client):
+    models_manager = ModelsManager()
+    client = make_client(hedge=True, hedge_min_samples=3, health=models_manager.health)
+    # The threshold is the model's p95 as recorded by the generation service.
+    for _ in range(3):
+        models_manager.record_call("test/model", 0.02, ok=True)
+
+    upstream.faults = ["slow"]
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    assert await client.generate_image("cat", model="test/model") == URL
+    assert loop.time() - started < 0.5
+    assert upstream.requests == 2
+    stats = client.stats()
+    assert stats["hedged"] == 1 and stats["hedge_wins"] == 1
+
+
+def test_errors_are_classified():
+    assert classify_error(asyncio.TimeoutError()) == "timeout"
+    assert classify_error(UpstreamError("server")) == "server"
+    assert classify_error(ValueError("boom")) == "unknown"
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+
+import pytest
+
+from tg_bot.logging_setup import InteractionLogger
+from tg_bot.services.reconciler import PaymentReconciler
+
+
+class FakeYooKassa:
+    def __init__(self, statuses):
+        self.statuses = statuses
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def check_payment_status(self, payment_id):
+        self.calls.append(payment_id)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+        finally:
+            self.in_flight -= 1
+        status = self.statuses.get(payment_id)
+        if status is None:
+            return None
+        return {"status": status, "paid": status == "succeeded", "metadata": {}}
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+
+async def _add_payment(db, payment_id, user_id, rubies, age_seconds):
+    await db.create_payment(payment_id, user_id, float(rubies), rubies)
+    async with db._connection() as conn:
+        await conn.execute(
+            "UPDATE payments SET created_at = datetime('now', ?) WHERE payment_id = ?",
+            (f"-{age_seconds} seconds", payment_id),
+        )
+        await conn.commit()
+
+
+@pytest.fixture
+async def env(database):
+    await database.get_or_create_user(1001, "tester", "Test")
+    start = await database.get_user_rubies(1001)
+    statuses = {}
+    yookassa = FakeYooKassa(statuses)
+    d = {
+        "db": database,
+        "yookassa": yookassa,
+        "interaction_logger": InteractionLogger(logging.getLogger("test_interactions")),
+    }
+    return d, statuses, start
+
+
+@pytest.mark.asyncio
+async def test_reconciler_credits_cancels_and_expires(env):
+    d, statuses, start = env
+    db = d["db"]
+    await _add_payment(db, "paid", 1001, 10, age_seconds=600)
+    await _add_payment(db, "canceled", 1001, 20, age_seconds=600)
+    await _add_payment(db, "waiting", 1001, 30, age_seconds=600)
+    await _add_payment(db, "abandoned", 1001, 40, age_seconds=3 * 86400)
+    await _add_payment(db, "fresh", 1001, 50, age_seconds=0)
+    await _add_payment(db, "flaky", 1001, 60, age_seconds=600)
+    statuses.update(paid="succeeded", canceled="canceled", waiting="pending", abandoned="pending", fresh="succeeded")
+
+    bot = FakeBot()
+    reconciler = PaymentReconciler(batch_size=2, concurrency=2, rate=0, min_age_seconds=120, pending_ttl_seconds=86400)
+    run = await reconciler.run_once(d, bot=bot)
+
+    assert "fresh" not in d["yookassa"].calls
+    assert run["checked"] == 5
+    assert (run["credited"], run["canceled"], run["expired"], run["still_pending"], run["errors"]) == (1, 1, 1, 1, 1)
+    assert d["yookassa"].max_in_flight <= 2
+
+    assert await db.get_user_rubies(1001) == start + 10
+    assert bot.sent and bot.sent[0][0] == 1001
+    statuses_in_db = {p: (await db.get_payment(p))["status"] for p in ("paid", "canceled", "waiting", "abandoned", "fresh")}
+    assert statuses_in_db == {
+        "paid": "succeeded",
+        "canceled": "canceled",
+        "waiting": "pending",
+        "abandoned": "expired",
+        "fresh": "pending",
+    }
+
+    # The next pass only sees what is still pending and never credits twice.
+    d["yookassa"].calls.clear()
+    await reconciler.run_once(d, bot=bot)
+    assert sorted(d["yookassa"].calls) == ["flaky", "waiting"]
+    assert await db.get_user_rubies(1001) == start + 10
+    assert reconciler.stats()["runs"] == 2
+
+
+@pytest.mark.asyncio
+async def test_reconciler_respects_rate_limit(env):
+    d, statuses, _ = env
+    for i in range(5):
+        await _add_payment(d["db"], f"p{i}", 1001, 1, age_seconds=600)
+        statuses[f"p{i}"] = "pending"
+
+    reconciler = PaymentReconciler(batch_size=100, concurrency=5, rate=50, min_age_seconds=120)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    run = await reconciler.run_once(d)
+    assert run["checked"] == 5
+    # 5 calls at 50/s are spaced 20 ms apart.
+    assert loop.time() - started >= 0.08
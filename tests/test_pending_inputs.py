@@ -0,0 +1,83 @@
+import asyncio
+import os
+
+import pytest
+
+from tg_bot.pending_inputs import PendingInputStore
+
+KB = 1024
+
+
+@pytest.fixture
+async def store(tmp_path):
+    s = PendingInputStore(
+        memory_budget=100 * KB,
+        disk_budget=300 * KB,
+        max_users=50,
+        ttl=60,
+        spill_dir=str(tmp_path / "spill"),
+    )
+    try:
+        yield s
+    finally:
+        await s.stop()
+
+
+@pytest.mark.asyncio
+async def test_over_budget_uploads_spill_to_disk_and_come_back(store, tmp_path):
+    uploads = {user_id: [os.urandom(30 * KB), os.urandom(10 * KB)] for user_id in range(5)}
+    for user_id, images in uploads.items():
+        await store.put(user_id, images)
+
+    stats = store.stats()
+    assert stats["memory_bytes"] <= 100 * KB
+    assert stats["spilled"] >= 2
+    assert stats["disk_bytes"] == 200 * KB - stats["memory_bytes"]
+    assert len(os.listdir(tmp_path / "spill")) == stats["spilled"]
+
+    for user_id, images in uploads.items():
+        assert await store.take(user_id) == images
+    assert await store.take(0) is None
+    assert store.stats()["memory_bytes"] == store.stats()["disk_bytes"] == 0
+    assert os.listdir(tmp_path / "spill") == []
+
+
+@pytest.mark.asyncio
+async def test_memory_stays_flat_with_many_abandoned_uploads(store):
+    for user_id in range(200):
+        await store.put(user_id, [os.urandom(20 * KB)])
+
+    stats = store.stats()
+    # 5 uploads fit in memory and 15 on disk; older ones are dropped.
+    assert stats["users"] == 20
+    assert stats["memory_bytes"] <= 100 * KB
+    assert stats["disk_bytes"] <= 300 * KB
+    assert stats["evicted"] == 180
+    # The most recent uploads survive.
+    assert await store.take(199) is not None
+    assert await store.take(0) is None
+
+
+@pytest.mark.asyncio
+async def test_new_upload_replaces_previous(store):
+    await store.put(1, [b"old"])
+    await store.put(1, [b"new-1", b"new-2"])
+    assert await store.take(1) == [b"new-1", b"new-2"]
+    assert store.stats()["memory_bytes"] == 0
+
+
+@pytest.mark.asyncio
+async def test_expired_uploads_are_cleaned_in_background(tmp_path):
+    store = PendingInputStore(memory_budget=KB, ttl=0.05, spill_dir=str(tmp_path / "spill"), cleanup_interval=0.02)
+    store.start()
+    try:
+        await store.put(1, [os.urandom(4 * KB)])
+        await store.put(2, [b"small"])
+        await asyncio.sleep(0.15)
+        stats = store.stats()
+        assert stats["users"] == 0
+        assert stats["expired"] == 2
+        assert stats["memory_bytes"] == stats["disk_bytes"] == 0
+        assert os.listdir(tmp_path / "spill") == []
+    finally:
+        await store.stop()
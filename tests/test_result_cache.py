@@ -0,0 +1,41 @@
+import io
+import os
+
+import pytest
+
+from tg_bot.result_cache import ResultCache, cache_key
+
+KB = 1024
+
+
+def test_cache_key_normalizes_prompt_and_orders_images():
+    assert cache_key("m", "  Red   CAT ") == cache_key("m", "red cat")
+    assert cache_key("m", "red cat") != cache_key("other", "red cat")
+    assert cache_key("m", "p", [b"a", b"b"]) != cache_key("m", "p", [b"b", b"a"])
+    assert cache_key("m", "p", [b"a"]) != cache_key("m", "p")
+    # One photo as "image" and as a one-photo album are built into different requests.
+    assert cache_key("m", "p", [b"a"], "image") != cache_key("m", "p", [b"a"], "images")
+
+
+@pytest.mark.asyncio
+async def test_lru_eviction_and_index_rebuilt_from_disk(tmp_path):
+    cache = ResultCache(enabled=True, directory=str(tmp_path), max_bytes=100 * KB)
+    images = {f"k{i:02d}": os.urandom(30 * KB) for i in range(4)}
+    for key, data in list(images.items())[:3]:
+        await cache.put(key, io.BytesIO(data))
+    # Touch k00 so that k01 becomes the least recently used entry.
+    assert await cache.get("k00") == images["k00"]
+    await cache.put("k03", io.BytesIO(images["k03"]))
+
+    assert await cache.get("k01") is None
+    stats = cache.stats()
+    assert stats["entries"] == 3 and stats["evictions"] == 1
+    assert stats["bytes"] == 90 * KB
+    assert stats["hits"] == 1 and stats["misses"] == 1
+
+    restored = ResultCache(enabled=True, directory=str(tmp_path), max_bytes=100 * KB)
+    await restored.load()
+    assert restored.stats()["entries"] == 3
+    for key in ("k00", "k02", "k03"):
+        assert await restored.get(key) == images[key]
+
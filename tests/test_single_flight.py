@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+from tg_bot.services.single_flight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_concurrent_callers_share_result_and_errors():
+    flights = SingleFlight(enabled=True)
+    release = asyncio.Event()
+    calls = 0
+
+    async def call():
+        nonlocal calls
+        calls += 1
+        await release.wait()
+        return "result"
+
+    waiters = [asyncio.create_task(flights.run("k", call)) for _ in range(3)]
+    await asyncio.sleep(0)
+    release.set()
+    assert await asyncio.gather(*waiters) == ["result"] * 3
+    assert calls == 1
+    assert flights.stats() == {"enabled": True, "in_flight": 0, "upstream_calls": 1, "saved_calls": 2}
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    results = await asyncio.gather(*(flights.run("e", failing) for _ in range(2)), return_exceptions=True)
+    assert all(isinstance(r, ValueError) for r in results)
+    # Finished calls are not reused: the next request starts a new one.
+    assert await flights.run("k", call) == "result" and calls == 2
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_does_not_cancel_the_call_for_others():
+    flights = SingleFlight(enabled=True)
+    release = asyncio.Event()
+    started = []
+
+    async def call():
+        started.append(1)
+        await release.wait()
+        return 42
+
+    first = asyncio.create_task(flights.run("k", call))
+    second = asyncio.create_task(flights.run("k", call))
+    await asyncio.sleep(0)
+    first.cancel()
+    await asyncio.sleep(0)
+    release.set()
+    assert await second == 42
+    assert first.cancelled() and len(started) == 1
+
+    # The last waiter leaving cancels the call.
+    release.clear()
+    lone = asyncio.create_task(flights.run("x", call))
+    await asyncio.sleep(0.01)
+    lone.cancel()
+    await asyncio.sleep(0)
+    assert flights.stats()["in_flight"] == 0
@@ -0,0 +1,42 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from tg_bot.update_processor import PerUserUpdateProcessor
+
+
+def _update(user_id: int):
+    return SimpleNamespace(effective_user=SimpleNamespace(id=user_id), effective_chat=None)
+
+
+@pytest.mark.asyncio
+async def test_same_user_updates_run_in_order():
+    processor = PerUserUpdateProcessor(8)
+    seen = []
+
+    async def handler(i: int):
+        # later updates are faster, so any reordering would show up
+        await asyncio.sleep(0.01 * (5 - i))
+        seen.append(i)
+
+    await asyncio.gather(*(processor.process_update(_update(1), handler(i)) for i in range(5)))
+    assert seen == [0, 1, 2, 3, 4]
+
+
+@pytest.mark.asyncio
+async def test_different_users_run_in_parallel_within_limit():
+    processor = PerUserUpdateProcessor(3)
+    running = 0
+    peak = 0
+
+    async def handler():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.02)
+        running -= 1
+
+    await asyncio.gather(*(processor.process_update(_update(uid), handler()) for uid in range(10)))
+    assert peak == 3
+    assert processor._user_locks == {}
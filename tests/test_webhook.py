@@ -0,0 +1,74 @@
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from telegram import Update
+from telegram.ext import Application
+
+from tg_bot.webhook import SECRET_HEADER, create_web_app
+
+SECRET = "test-secret"
+
+# Recorded from a real getUpdates response (ids anonymized).
+TEXT_UPDATE = {
+    "update_id": 700000001,
+    "message": {
+        "message_id": 42,
+        "from": {"id": 1001, "is_bot": False, "first_name": "Test", "username": "tester", "language_code": "ru"},
+        "chat": {"id": 1001, "first_name": "Test", "username": "tester", "type": "private"},
+        "date": 1768600000,
+        "text": "Кот в космосе",
+    },
+}
+
+CALLBACK_UPDATE = {
+    "update_id": 700000002,
+    "callback_query": {
+        "id": "4382bfdwdsb323b2d9",
+        "from": {"id": 1001, "is_bot": False, "first_name": "Test", "username": "tester"},
+        "chat_instance": "-1234567890",
+        "data": "buy_10",
+        "message": {
+            "message_id": 43,
+            "from": {"id": 5000, "is_bot": True, "first_name": "Bot", "username": "photo_bot"},
+            "chat": {"id": 1001, "first_name": "Test", "type": "private"},
+            "date": 1768600001,
+            "text": "💎 Пополнение баланса рубинов",
+        },
+    },
+}
+
+
+@pytest.fixture
+async def client():
+    application = Application.builder().token("123456:TEST-TOKEN").updater(None).build()
+    test_client = TestClient(TestServer(create_web_app(application, SECRET, "/telegram")))
+    await test_client.start_server()
+    test_client.application = application
+    try:
+        yield test_client
+    finally:
+        await test_client.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("payload", [TEXT_UPDATE, CALLBACK_UPDATE])
+async def test_recorded_updates_are_queued(client, payload):
+    resp = await client.post("/telegram", json=payload, headers={SECRET_HEADER: SECRET})
+    assert resp.status == 200
+
+    update = client.application.update_queue.get_nowait()
+    assert isinstance(update, Update)
+    assert update.update_id == payload["update_id"]
+    assert update.effective_user.id == 1001
+
+
+@pytest.mark.asyncio
+async def test_wrong_secret_is_rejected(client):
+    resp = await client.post("/telegram", json=TEXT_UPDATE, headers={SECRET_HEADER: "nope"})
+    assert resp.status == 403
+    assert client.application.update_queue.empty()
+
+
+@pytest.mark.asyncio
+async def test_malformed_body_is_rejected(client):
+    resp = await client.post("/telegram", data=b"not json", headers={SECRET_HEADER: SECRET})
+    assert resp.status == 400
@@ -0,0 +1,97 @@
+import json
+
+import httpx
+import pytest
+
+from tg_bot.payments import yookassa_payment
+from tg_bot.payments.yookassa_payment import YooKassaError, YooKassaPayment
+
+
+@pytest.fixture(autouse=True)
+def _credentials(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(yookassa_payment, "YOOKASSA_SHOP_ID", "123456")
+    monkeypatch.setattr(yookassa_payment, "YOOKASSA_SECRET_KEY", "test_secret")
+    monkeypatch.setattr(yookassa_payment, "RETRY_DELAY", 0)
+
+
+def _payment(payment_id="2d6f7a3c-000f-5000-9000-1b2c3d4e5f60", status="pending", paid=False) -> dict:
+    return {
+        "id": payment_id,
+        "status": status,
+        "paid": paid,
+        "amount": {"value": "10.00", "currency": "RUB"},
+        "confirmation": {"type": "redirect", "confirmation_url": f"https://yoomoney.ru/checkout/{payment_id}"},
+        "metadata": {"user_id": "1001", "rubies": "10"},
+    }
+
+
+def _client(handler) -> YooKassaPayment:
+    return YooKassaPayment(http_client=httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+
+@pytest.mark.asyncio
+async def test_create_payment_retries_with_same_idempotence_key():
+    requests = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if len(requests) == 1:
+            raise httpx.ConnectError("connection reset", request=request)
+        if len(requests) == 2:
+            return httpx.Response(503)
+        return httpx.Response(200, json=_payment())
+
+    client = _client(handler)
+    try:
+        result = await client.create_payment(amount=10.0, user_id=1001, rubies=10)
+    finally:
+        await client.aclose()
+
+    assert result == {
+        "payment_id": "2d6f7a3c-000f-5000-9000-1b2c3d4e5f60",
+        "confirmation_url": "https://yoomoney.ru/checkout/2d6f7a3c-000f-5000-9000-1b2c3d4e5f60",
+        "status": "pending",
+    }
+    assert len(requests) == 3
+    assert len({r.headers["Idempotence-Key"] for r in requests}) == 1
+    assert requests[0].headers["Authorization"].startswith("Basic ")
+    body = json.loads(requests[-1].content)
+    assert body["amount"] == {"value": "10.00", "currency": "RUB"}
+    assert body["metadata"] == {"user_id": "1001", "rubies": "10"}
+
+
+@pytest.mark.asyncio
+async def test_client_error_is_not_retried():
+    calls = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        return httpx.Response(400, json={"type": "error", "code": "invalid_request"})
+
+    client = _client(handler)
+    try:
+        with pytest.raises(YooKassaError):
+            await client.create_payment(amount=10.0, user_id=1001, rubies=10)
+    finally:
+        await client.aclose()
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_check_payment_status_shape_and_failure():
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/missing"):
+            return httpx.Response(404, json={"type": "error", "code": "not_found"})
+        assert request.method == "GET"
+        return httpx.Response(200, json=_payment(status="succeeded", paid=True))
+
+    client = _client(handler)
+    try:
+        assert await client.check_payment_status("2d6f7a3c-000f-5000-9000-1b2c3d4e5f60") == {
+            "status": "succeeded",
+            "paid": True,
+            "metadata": {"user_id": "1001", "rubies": "10"},
+        }
+        assert await client.check_payment_status("missing") is None
+    finally:
+        await client.aclose()
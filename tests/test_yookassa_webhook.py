@@ -0,0 +1,150 @@
+import asyncio
+import logging
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from telegram import Bot
+from telegram.ext import Application
+
+from tg_bot.logging_setup import InteractionLogger
+from tg_bot.webhook import create_web_app
+
+
+class FakeBot(Bot):
+    """Bot без сети: сообщения складываются в список."""
+
+    def __init__(self):
+        super().__init__("123456:TEST-TOKEN")
+        with self._unfrozen():
+            self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+
+class FakeYooKassa:
+    def __init__(self, status="succeeded", paid=True):
+        self.status = status
+        self.paid = paid
+        self.calls = 0
+
+    async def check_payment_status(self, payment_id):
+        self.calls += 1
+        if self.status is None:
+            return None
+        return {"status": self.status, "paid": self.paid, "metadata": {}}
+
+
+def notification(payment_id, event="payment.succeeded"):
+    """Тело уведомления в формате ЮКассы."""
+    status = event.split(".", 1)[1]
+    return {
+        "type": "notification",
+        "event": event,
+        "object": {"id": payment_id, "status": status, "paid": status == "succeeded", "amount": {"value": "10.00"}},
+    }
+
+
+async def _make_client(database, yookassa, allowed_ips=None):
+    bot = FakeBot()
+    application = Application.builder().bot(bot).updater(None).build()
+    application.bot_data.update(
+        db=database,
+        yookassa=yookassa,
+        interaction_logger=InteractionLogger(logging.getLogger("test_interactions")),
+    )
+    client = TestClient(
+        TestServer(create_web_app(application, yookassa_path="/yookassa", yookassa_allowed_ips=allowed_ips))
+    )
+    await client.start_server()
+    client.bot = bot
+    return client
+
+
+@pytest.fixture
+async def paid_env(database):
+    await database.get_or_create_user(1001, "tester", "Test")
+    await database.create_payment("pay-1", 1001, 10.0, 10)
+    yookassa = FakeYooKassa()
+    client = await _make_client(database, yookassa)
+    try:
+        yield database, yookassa, client, await database.get_user_rubies(1001)
+    finally:
+        await client.close()
+
+
+@pytest.mark.asyncio
+async def test_duplicate_notifications_credit_once_and_notify(paid_env):
+    database, yookassa, client, start = paid_env
+
+    responses = await asyncio.gather(*(client.post("/yookassa", json=notification("pay-1")) for _ in range(5)))
+    assert [r.status for r in responses] == [200] * 5
+
+    assert await database.get_user_rubies(1001) == start + 10
+    assert (await database.get_payment("pay-1"))["status"] == "succeeded"
+    assert len(client.bot.sent) == 1
+    chat_id, text = client.bot.sent[0]
+    assert chat_id == 1001
+    assert "Начислено: 10" in text
+
+    # Later duplicates are answered from the DB without asking the provider again.
+    calls = yookassa.calls
+    resp = await client.post("/yookassa", json=notification("pay-1"))
+    assert resp.status == 200
+    assert yookassa.calls == calls
+
+
+@pytest.mark.asyncio
+async def test_notification_is_verified_with_provider(paid_env):
+    database, yookassa, client, start = paid_env
+    yookassa.status, yookassa.paid = "pending", False
+
+    resp = await client.post("/yookassa", json=notification("pay-1"))
+    assert resp.status == 200
+    assert await database.get_user_rubies(1001) == start
+    assert (await database.get_payment("pay-1"))["status"] == "pending"
+    assert client.bot.sent == []
+
+
+@pytest.mark.asyncio
+async def test_provider_unreachable_asks_for_retry(paid_env):
+    database, yookassa, client, start = paid_env
+    yookassa.status = None
+
+    resp = await client.post("/yookassa", json=notification("pay-1"))
+    assert resp.status == 500
+    assert await database.get_user_rubies(1001) == start
+
+
+@pytest.mark.asyncio
+async def test_canceled_notification(paid_env):
+    database, yookassa, client, start = paid_env
+    yookassa.status, yookassa.paid = "canceled", False
+
+    resp = await client.post("/yookassa", json=notification("pay-1", "payment.canceled"))
+    assert resp.status == 200
+    assert (await database.get_payment("pay-1"))["status"] == "canceled"
+
+
+@pytest.mark.asyncio
+async def test_unknown_payment_and_bad_body(paid_env):
+    _, yookassa, client, _ = paid_env
+
+    resp = await client.post("/yookassa", json=notification("unknown"))
+    assert resp.status == 200
+    assert yookassa.calls == 0
+
+    resp = await client.post("/yookassa", data=b"not json")
+    assert resp.status == 400
+
+
+@pytest.mark.asyncio
+async def test_source_ip_allowlist(database):
+    yookassa = FakeYooKassa()
+    client = await _make_client(database, yookassa, allowed_ips=["185.71.76.0/27"])
+    try:
+        resp = await client.post("/yookassa", json=notification("pay-1"))
+        assert resp.status == 403
+        assert yookassa.calls == 0
+    finally:
+        await client.close()
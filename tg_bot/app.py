@@ -1,36 +1,61 @@
+import asyncio
 import logging
+import secrets
+import signal
 
+from aiohttp import web
 from telegram import Update
 from telegram.ext import (
     Application,
     CallbackQueryHandler,
     CommandHandler,
+    ContextTypes,
     MessageHandler,
     filters,
 )
 
-from tg_bot.core.config import TELEGRAM_BOT_TOKEN, YOOKASSA_SECRET_KEY, YOOKASSA_SHOP_ID
-from tg_bot.deps import init_deps
+from tg_bot.core.config import (
+    BOT_MODE,
+    PAYMENT_RECONCILE_INTERVAL,
+    TELEGRAM_BOT_TOKEN,
+    UPDATE_CONCURRENCY,
+    UPDATE_MAX_PENDING,
+    WEBHOOK_LISTEN,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET_TOKEN,
+    WEBHOOK_URL,
+    YOOKASSA_SECRET_KEY,
+    YOOKASSA_SHOP_ID,
+    YOOKASSA_WEBHOOK_ALLOWED_IPS,
+    YOOKASSA_WEBHOOK_ENABLED,
+    YOOKASSA_WEBHOOK_PATH,
+)
+from tg_bot.deps import deps_from_context, init_deps
+from tg_bot.handlers.admin import stats_command
 from tg_bot.handlers.basic import error_handler, feedback_command, help_command, profile, start
 from tg_bot.handlers.generate import generate_command, handle_message, handle_photo
 from tg_bot.handlers.models import models_command, select_model_callback
 from tg_bot.handlers.payments import buy_callback, buy_rubies, check_payment_callback
 from tg_bot.handlers.transfers import send_rubies
+from tg_bot.services.generation import notify_refund, run_generation_job
+from tg_bot.update_processor import PerUserUpdateProcessor
+from tg_bot.webhook import create_web_app
 
 logger = logging.getLogger(__name__)
 
 
-def run() -> None:
-    """Создать приложение и запустить polling."""
-    if not TELEGRAM_BOT_TOKEN:
-        logger.error("TELEGRAM_BOT_TOKEN не установлен!")
-        return
+async def reconcile_payments_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Задача JobQueue: один проход сверки ожидающих платежей."""
+    d = deps_from_context(context)
+    await d["payment_reconciler"].run_once(d, bot=context.bot)
 
-    if not YOOKASSA_SHOP_ID or not YOOKASSA_SECRET_KEY:
-        logger.error("YOOKASSA_SHOP_ID и YOOKASSA_SECRET_KEY должны быть установлены в .env файле!")
-        logger.error("Без этих данных функция покупки рубинов работать не будет.")
 
+def build_application(with_updater: bool = True) -> Application:
+    """Создать Application с зависимостями, хендлерами и фоновыми задачами."""
     deps = init_deps()
+    # Polling mode has no web server of its own; payment notifications get a standalone one.
+    payments_runner = []
 
     async def post_init(application: Application) -> None:
         application.bot_data.update(deps)
@@ -40,8 +65,51 @@ def run() -> None:
         except Exception as e:
             logger.error(f"Ошибка при инициализации БД: {e}", exc_info=True)
             raise
+        deps["pending_inputs"].start()
+        await deps["result_cache"].load()
+        # Also resumes jobs left by a previous run once their lease expires.
+        deps["generation_workers"].start(
+            lambda job: run_generation_job(deps, application.bot, job),
+            lambda refund: notify_refund(application.bot, refund),
+        )
+        if with_updater and YOOKASSA_WEBHOOK_ENABLED:
+            runner = web.AppRunner(
+                create_web_app(
+                    application,
+                    yookassa_path=YOOKASSA_WEBHOOK_PATH,
+                    yookassa_allowed_ips=YOOKASSA_WEBHOOK_ALLOWED_IPS,
+                )
+            )
+            await runner.setup()
+            await web.TCPSite(runner, WEBHOOK_LISTEN, WEBHOOK_PORT).start()
+            payments_runner.append(runner)
+            logger.info(f"Уведомления ЮКассы принимаются на {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{YOOKASSA_WEBHOOK_PATH}")
 
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).post_init(post_init).build()
+    async def post_shutdown(application: Application) -> None:
+        for runner in payments_runner:
+            await runner.cleanup()
+        # Unfinished jobs go back to the queue and are resumed by the next start.
+        await deps["generation_workers"].stop()
+        await deps["openrouter"].aclose()
+        await deps["downloader"].aclose()
+        deps["image_preprocessor"].close()
+        await deps["pending_inputs"].stop()
+        await deps["albums"].close()
+        await deps["yookassa"].aclose()
+        await deps["db"].close()
+        deps["interaction_logger"].close()
+
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .concurrent_updates(PerUserUpdateProcessor(UPDATE_CONCURRENCY, UPDATE_MAX_PENDING))
+    )
+    if not with_updater:
+        # Webhook mode feeds application.update_queue from our own aiohttp server.
+        builder = builder.updater(None)
+    application = builder.build()
 
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
@@ -51,6 +119,7 @@ def run() -> None:
     application.add_handler(CommandHandler("generate", generate_command))
     application.add_handler(CommandHandler("models", models_command))
     application.add_handler(CommandHandler("feedback", feedback_command))
+    application.add_handler(CommandHandler("stats", stats_command))
     application.add_handler(CallbackQueryHandler(buy_callback, pattern="^buy_"))
     application.add_handler(CallbackQueryHandler(check_payment_callback, pattern="^check_"))
     application.add_handler(CallbackQueryHandler(select_model_callback, pattern="^select_model_"))
@@ -58,6 +127,81 @@ def run() -> None:
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     application.add_error_handler(error_handler)
 
+    if PAYMENT_RECONCILE_INTERVAL > 0:
+        application.job_queue.run_repeating(
+            reconcile_payments_job,
+            interval=PAYMENT_RECONCILE_INTERVAL,
+            first=PAYMENT_RECONCILE_INTERVAL,
+            name="reconcile_payments",
+        )
+    return application
+
+
+async def serve_webhook(application: Application, secret_token: str) -> None:
+    """Запустить aiohttp-сервер webhook-режима до SIGINT/SIGTERM."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # pragma: no cover - Windows
+            pass
+
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+
+    runner = web.AppRunner(
+        create_web_app(
+            application,
+            secret_token,
+            WEBHOOK_PATH,
+            yookassa_path=YOOKASSA_WEBHOOK_PATH if YOOKASSA_WEBHOOK_ENABLED else None,
+            yookassa_allowed_ips=YOOKASSA_WEBHOOK_ALLOWED_IPS,
+        )
+    )
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_LISTEN, WEBHOOK_PORT)
+    await site.start()
+    logger.info(f"Webhook слушает {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    await application.bot.set_webhook(
+        url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=secret_token,
+        allowed_updates=Update.ALL_TYPES,
+        max_connections=100,
+    )
+
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+        await application.stop()
+        await application.shutdown()
+        await application.post_shutdown(application)
+
+
+def run() -> None:
+    """Создать приложение и запустить polling или webhook-сервер."""
+    if not TELEGRAM_BOT_TOKEN:
+        logger.error("TELEGRAM_BOT_TOKEN не установлен!")
+        return
+
+    if not YOOKASSA_SHOP_ID or not YOOKASSA_SECRET_KEY:
+        logger.error("YOOKASSA_SHOP_ID и YOOKASSA_SECRET_KEY должны быть установлены в .env файле!")
+        logger.error("Без этих данных функция покупки рубинов работать не будет.")
+
+    if BOT_MODE == "webhook":
+        if not WEBHOOK_URL:
+            logger.error("BOT_MODE=webhook требует WEBHOOK_URL!")
+            return
+        # One process: per-user state (dialog flags, pending inputs, albums, update order)
+        # lives in memory, so all updates must reach the same process.
+        application = build_application(with_updater=False)
+        logger.info("Бот запущен в webhook-режиме...")
+        asyncio.run(serve_webhook(application, WEBHOOK_SECRET_TOKEN or secrets.token_urlsafe(32)))
+        return
+
+    application = build_application()
     logger.info("Бот запущен...")
     application.run_polling(allowed_updates=Update.ALL_TYPES)
-
@@ -0,0 +1,110 @@
+import logging
+import tempfile
+import time
+from typing import BinaryIO, Optional
+
+import aiohttp
+
+from tg_bot.core.config import (
+    DOWNLOAD_MAX_BYTES,
+    DOWNLOAD_MAX_CONNECTIONS,
+    DOWNLOAD_SPOOL_BYTES,
+    DOWNLOAD_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+class DownloadTooLarge(Exception):
+    """Тело ответа больше max_bytes."""
+
+
+class ImageDownloader:
+    """Скачивание результатов генерации через одну aiohttp-сессию на всё время работы бота.
+
+    Keep-alive и кэш DNS переиспользуются между запросами; тело читается кусками в
+    SpooledTemporaryFile (крупные ответы уходят на диск) и обрезается на max_bytes.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = DOWNLOAD_MAX_BYTES,
+        timeout: float = DOWNLOAD_TIMEOUT,
+        spool_bytes: int = DOWNLOAD_SPOOL_BYTES,
+        max_connections: int = DOWNLOAD_MAX_CONNECTIONS,
+    ):
+        self.max_bytes = max_bytes
+        self.spool_bytes = spool_bytes
+        self.timeout = aiohttp.ClientTimeout(total=timeout, sock_connect=min(timeout, 10))
+        self.max_connections = max_connections
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._count = 0
+        self._errors = 0
+        self._too_large = 0
+        self._bytes = 0
+        self._total_ms = 0.0
+        self._max_ms = 0.0
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # Created lazily: a ClientSession must be bound to the running event loop.
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections,
+                ttl_dns_cache=300,
+                keepalive_timeout=30,
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    async def aclose(self) -> None:
+        """Закрыть сессию (вызывается при остановке бота)"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def fetch(self, url: str) -> Optional[BinaryIO]:
+        """Скачать `url` в файловый буфер (позиция в начале). None при ошибке или превышении размера"""
+        started = time.monotonic()
+        buffer = tempfile.SpooledTemporaryFile(max_size=self.spool_bytes)
+        try:
+            async with self._get_session().get(url) as resp:
+                if resp.status != 200:
+                    raise aiohttp.ClientResponseError(resp.request_info, resp.history, status=resp.status)
+                if resp.content_length is not None and resp.content_length > self.max_bytes:
+                    raise DownloadTooLarge(f"{resp.content_length} байт")
+                size = 0
+                async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise DownloadTooLarge(f"больше {self.max_bytes} байт")
+                    buffer.write(chunk)
+        except DownloadTooLarge as e:
+            buffer.close()
+            self._too_large += 1
+            logger.error(f"Изображение по {url[:100]} слишком большое: {e}")
+            return None
+        except Exception as e:
+            buffer.close()
+            self._errors += 1
+            logger.error(f"Error downloading image: {e!r}")
+            return None
+
+        elapsed_ms = (time.monotonic() - started) * 1000
+        self._count += 1
+        self._bytes += size
+        self._total_ms += elapsed_ms
+        self._max_ms = max(self._max_ms, elapsed_ms)
+        buffer.seek(0)
+        return buffer
+
+    def stats(self) -> dict:
+        return {
+            "downloads": self._count,
+            "errors": self._errors,
+            "too_large": self._too_large,
+            "bytes": self._bytes,
+            "avg_ms": round(self._total_ms / self._count, 1) if self._count else 0.0,
+            "max_ms": round(self._max_ms, 1),
+        }
@@ -1,92 +1,167 @@
-from openai import OpenAI
+import binascii
+import logging
 
-from tg_bot.core.config import OPENROUTER_API_KEY, OPENROUTER_MODEL
+import httpx
+from openai import AsyncOpenAI
 
-import base64
+from tg_bot.clients.resilience import ResilientCaller
+from tg_bot.core.config import (
+    OPENROUTER_API_KEY,
+    OPENROUTER_BASE_URL,
+    OPENROUTER_CONNECT_TIMEOUT,
+    OPENROUTER_MAX_CONNECTIONS,
+    OPENROUTER_MODEL,
+    OPENROUTER_READ_TIMEOUT,
+)
+from tg_bot.images import sniff_mime
+
+logger = logging.getLogger(__name__)
 
 
 class OpenRouterClient:
-    def __init__(self):
-        self.client = OpenAI(
-            base_url="https://openrouter.ai/api/v1",
+    def __init__(
+        self,
+        http_client: httpx.AsyncClient | None = None,
+        base_url: str = OPENROUTER_BASE_URL,
+        resilience: ResilientCaller | None = None,
+    ):
+        # One pooled keep-alive HTTP client for the whole bot lifetime: requests from
+        # different users share TLS connections instead of opening a new one each time.
+        self.timeout = httpx.Timeout(OPENROUTER_READ_TIMEOUT, connect=OPENROUTER_CONNECT_TIMEOUT)
+        self.http_client = http_client or httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(
+                max_connections=OPENROUTER_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENROUTER_MAX_CONNECTIONS,
+            ),
+        )
+        # Retries are ours (ResilientCaller): the SDK's own would hide failures from the breaker.
+        self.client = AsyncOpenAI(
+            base_url=base_url,
             api_key=OPENROUTER_API_KEY,
+            http_client=self.http_client,
+            max_retries=0,
         )
+        self.resilience = resilience or ResilientCaller()
         self.model = OPENROUTER_MODEL
 
-    def encode_image_to_base64(self, image_bytes: bytes) -> str:
-        """Кодирование изображения в base64"""
-        return base64.b64encode(image_bytes).decode("utf-8")
+    def stats(self) -> dict:
+        return self.resilience.stats()
 
-    async def generate_image(self, prompt: str, input_image: bytes = None, input_images: list = None, model: str = None):
-        """Генерация изображения по промпту, опционально на основе входного изображения или нескольких изображений"""
-        model_to_use = model if model else self.model
+    async def aclose(self) -> None:
+        """Закрыть общий HTTP-пул (вызывается при остановке бота)"""
+        await self.client.close()
 
-        try:
-            if input_images:
-                content = []
-                for img_bytes in input_images:
-                    base64_image = self.encode_image_to_base64(img_bytes)
-                    content.append(
-                        {
-                            "type": "image_url",
-                            "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"},
-                        }
-                    )
-                content.append({"type": "text", "text": prompt})
-            elif input_image:
-                base64_image = self.encode_image_to_base64(input_image)
-                content = [
+    def encode_image_to_base64(self, image_bytes) -> str:
+        """Кодирование изображения в base64 (принимает bytes, bytearray или memoryview без копирования)"""
+        return binascii.b2a_base64(image_bytes, newline=False).decode("ascii")
+
+    def image_data_url(self, image_bytes, mime_type: str = None) -> str:
+        """data URL изображения: base64 кодируется прямо из буфера вызывающего, без копии входа.
+
+        MIME-тип по умолчанию определяется по сигнатуре содержимого.
+        """
+        mime_type = mime_type or sniff_mime(image_bytes)
+        return f"data:{mime_type};base64," + self.encode_image_to_base64(image_bytes)
+
+    def build_content(self, prompt: str, input_image: bytes = None, input_images: list = None):
+        """Содержимое сообщения запроса: промпт и входные изображения как data URL"""
+        if input_images:
+            content = []
+            for img_bytes in input_images:
+                content.append(
                     {
                         "type": "image_url",
-                        "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"},
-                    },
-                    {
-                        "type": "text",
-                        "text": f"Создай новое изображение на основе этого, учитывая следующее описание: {prompt}",
-                    },
-                ]
-            else:
-                content = prompt
-
-            response = self.client.chat.completions.create(
+                        "image_url": {"url": self.image_data_url(img_bytes)},
+                    }
+                )
+            content.append({"type": "text", "text": prompt})
+        elif input_image:
+            content = [
+                {
+                    "type": "image_url",
+                    "image_url": {"url": self.image_data_url(input_image)},
+                },
+                {
+                    "type": "text",
+                    "text": f"Создай новое изображение на основе этого, учитывая следующее описание: {prompt}",
+                },
+            ]
+        else:
+            content = prompt
+        return content
+
+    async def generate_image(
+        self, prompt: str, input_image: bytes = None, input_images: list = None, model: str = None, content=None
+    ):
+        """Генерация изображения по промпту, опционально на основе входного изображения или нескольких изображений.
+
+        content — заранее собранное build_content содержимое: тогда вызывающий может не
+        держать исходные байты входов, пока идёт запрос.
+        Возвращает URL изображения или None, если модель ответила без изображения.
+        Временные ошибки повторяются (ResilientCaller); если запрос так и не удался,
+        выбрасывается UpstreamError (CircuitOpen — модель сейчас недоступна).
+        """
+        model_to_use = model if model else self.model
+        if content is None:
+            content = self.build_content(prompt, input_image, input_images)
+
+        async def attempt(remaining: float):
+            # Awaiting here frees the event loop for other users' updates; cancelling
+            # the awaiting task aborts the in-flight HTTP request.
+            return await self.client.chat.completions.create(
                 model=model_to_use,
                 messages=[{"role": "user", "content": content}],
                 # We only need image output from all models.
                 # Requesting ["image", "text"] can fail for some providers/models.
                 extra_body={"modalities": ["image"]},
+                timeout=httpx.Timeout(
+                    max(0.001, min(OPENROUTER_READ_TIMEOUT, remaining)), connect=OPENROUTER_CONNECT_TIMEOUT
+                ),
             )
 
-            message = response.choices[0].message
-
-            if hasattr(message, "images") and message.images:
-                if isinstance(message.images, list) and len(message.images) > 0:
-                    image_data = message.images[0]
-                    if isinstance(image_data, dict) and "image_url" in image_data:
-                        return image_data["image_url"]["url"]
-                    if isinstance(image_data, str):
-                        return image_data
-
-            if hasattr(message, "content") and message.content:
-                if isinstance(message.content, list):
-                    for part in message.content:
-                        if hasattr(part, "type") and part.type == "image_url":
-                            if hasattr(part, "image_url") and hasattr(part.image_url, "url"):
-                                return part.image_url.url
-                elif isinstance(message.content, str) and message.content.startswith("data:image"):
-                    return message.content
-
+        response = await self.resilience.call(model_to_use, attempt)
+        try:
+            return self._extract_image_url(response)
+        except (AttributeError, IndexError, KeyError, TypeError) as e:
+            # E.g. a 200 response that carries an error object instead of choices.
+            logger.error(f"Неожиданный ответ {model_to_use}: {e}")
             return None
-        except Exception as e:
-            print(f"Error generating image: {e}")
-            import traceback
 
-            traceback.print_exc()
-            return None
+    @staticmethod
+    def _extract_image_url(response):
+        message = response.choices[0].message
+
+        if hasattr(message, "images") and message.images:
+            if isinstance(message.images, list) and len(message.images) > 0:
+                image_data = message.images[0]
+                if isinstance(image_data, dict) and "image_url" in image_data:
+                    return image_data["image_url"]["url"]
+                if isinstance(image_data, str):
+                    return image_data
+
+        if hasattr(message, "content") and message.content:
+            if isinstance(message.content, list):
+                for part in message.content:
+                    if hasattr(part, "type") and part.type == "image_url":
+                        if hasattr(part, "image_url") and hasattr(part.image_url, "url"):
+                            return part.image_url.url
+            elif isinstance(message.content, str) and message.content.startswith("data:image"):
+                return message.content
+
+        return None
 
     def decode_base64_image(self, data_url: str) -> bytes:
-        """Декодирование base64 изображения из data URL"""
+        """Декодирование base64 изображения из data URL.
+
+        Для больших URL вызывается из потока (см. services.generation), так как
+        декодирование нескольких мегабайт держит GIL и event loop.
+        """
         if data_url.startswith("data:image"):
-            _, encoded = data_url.split(",", 1)
-            return base64.b64decode(encoded)
+            # Only the header is searched; split() would copy the whole payload into a list.
+            comma = data_url.find(",", 0, 256)
+            if comma < 0:
+                return None
+            return binascii.a2b_base64(data_url[comma + 1 :])
         return None
 
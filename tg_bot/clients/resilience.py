@@ -0,0 +1,289 @@
+"""Retries, hedged requests and per-model circuit breakers for upstream calls."""
+
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+import httpx
+import openai
+
+from tg_bot.core.config import (
+    OPENROUTER_BREAKER_FAILURES,
+    OPENROUTER_BREAKER_RESET,
+    OPENROUTER_DEADLINE,
+    OPENROUTER_HEDGE_ENABLED,
+    OPENROUTER_HEDGE_MIN_SAMPLES,
+    OPENROUTER_RETRY_ATTEMPTS,
+    OPENROUTER_RETRY_BASE_DELAY,
+    OPENROUTER_RETRY_MAX_DELAY,
+)
+from tg_bot.models.health import ModelHealth
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Error kinds worth another attempt; they also count against the provider's circuit.
+RETRYABLE = frozenset({"rate_limited", "server", "timeout", "network"})
+
+# Attempts slower than this quantile of the model's latency get a hedged twin.
+HEDGE_QUANTILE = 0.95
+
+
+class UpstreamError(Exception):
+    """Вызов апстрима не удался; kind — класс ошибки (см. classify_error)"""
+
+    def __init__(self, kind: str, message: str = ""):
+        super().__init__(f"{kind}: {message}" if message else kind)
+        self.kind = kind
+
+    @property
+    def retryable(self) -> bool:
+        return self.kind in RETRYABLE
+
+
+class CircuitOpen(UpstreamError):
+    """Модель помечена как недоступная: запрос отклонён без обращения к апстриму"""
+
+    def __init__(self, key: str):
+        super().__init__("circuit_open", key)
+        self.key = key
+
+
+def classify_error(exc: BaseException) -> str:
+    """Класс ошибки: rate_limited, server, timeout, network (повторяемые), client или unknown"""
+    if isinstance(exc, UpstreamError):
+        return exc.kind
+    # APITimeoutError is a subclass of APIConnectionError, so it goes first.
+    if isinstance(exc, (openai.APITimeoutError, httpx.TimeoutException, asyncio.TimeoutError)):
+        return "timeout"
+    if isinstance(exc, (openai.APIConnectionError, httpx.TransportError)):
+        return "network"
+    if isinstance(exc, openai.APIStatusError):
+        status = exc.status_code
+        if status == 429:
+            return "rate_limited"
+        if status == 408:
+            return "timeout"
+        if status >= 500:
+            return "server"
+        return "client"
+    return "unknown"
+
+
+def retry_after(exc: BaseException) -> Optional[float]:
+    """Пауза из заголовка Retry-After (секунды), если апстрим её указал"""
+    response = getattr(exc, "response", None)
+    if response is None:
+        return None
+    try:
+        return max(0.0, float(response.headers.get("retry-after")))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, base: float, cap: float, rng: random.Random) -> float:
+    """Экспоненциальная пауза с полным джиттером: случайно в [0, min(cap, base * 2^(attempt-1))]"""
+    return rng.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    """Предохранитель одной модели.
+
+    После failure_threshold подряд повторяемых ошибок размыкается (open) и reset_timeout
+    секунд отклоняет запросы сразу. Затем пропускает один пробный запрос (half_open):
+    успех замыкает цепь, ошибка снова размыкает.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float, clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self._probing = False
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            if self.clock() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = "half_open"
+            self._probing = False
+        if self._probing:
+            return False
+        self._probing = True
+        return True
+
+    def on_success(self) -> None:
+        self.state = "closed"
+        self.failures = 0
+        self._probing = False
+
+    def on_cancelled(self) -> None:
+        """Вызов отменён, исход неизвестен: пробное место освобождается для следующего запроса"""
+        self._probing = False
+
+    def on_failure(self) -> None:
+        self.failures += 1
+        self._probing = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.opens += 1
+            self.state = "open"
+            self.opened_at = self.clock()
+
+
+class ResilientCaller:
+    """Устойчивый вызов апстрима с ключом (моделью).
+
+    - ошибки классифицируются (classify_error); повторяются только временные
+      (429, 5xx, таймауты, обрывы соединения) — до attempts попыток с паузой
+      backoff_delay (или Retry-After), и всё это в пределах deadline секунд;
+    - hedge: если попытка дольше p95 успешных вызовов модели по её ModelHealth
+      (health(key), не меньше hedge_min_samples замеров), параллельно отправляется
+      второй такой же запрос, используется первый ответ, второй отменяется;
+    - у каждой модели свой CircuitBreaker: пока модель лежит, запросы сразу
+      отклоняются с CircuitOpen.
+    """
+
+    def __init__(
+        self,
+        attempts: int = OPENROUTER_RETRY_ATTEMPTS,
+        base_delay: float = OPENROUTER_RETRY_BASE_DELAY,
+        max_delay: float = OPENROUTER_RETRY_MAX_DELAY,
+        deadline: float = OPENROUTER_DEADLINE,
+        hedge: bool = OPENROUTER_HEDGE_ENABLED,
+        hedge_min_samples: int = OPENROUTER_HEDGE_MIN_SAMPLES,
+        breaker_failures: int = OPENROUTER_BREAKER_FAILURES,
+        breaker_reset: float = OPENROUTER_BREAKER_RESET,
+        rng: Optional[random.Random] = None,
+        health: Optional[Callable[[str], ModelHealth]] = None,
+    ):
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.hedge = hedge
+        self.hedge_min_samples = max(1, hedge_min_samples)
+        self.breaker_failures = breaker_failures
+        self.breaker_reset = breaker_reset
+        self.rng = rng or random.Random()
+        # Latency is tracked by the caller's ModelHealth (ModelsManager.health); without it there is no hedging.
+        self.health = health
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self.calls = 0
+        self.retries = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.failed = 0
+        self.fast_failed = 0
+        self.errors: Dict[str, int] = {}
+
+    def breaker(self, key: str) -> CircuitBreaker:
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = self._breakers[key] = CircuitBreaker(self.breaker_failures, self.breaker_reset)
+        return breaker
+
+    def hedge_delay(self, key: str) -> Optional[float]:
+        """Порог hedged-запроса для модели (p95 успешных вызовов) или None"""
+        if not self.hedge or self.health is None:
+            return None
+        sketch = self.health(key).sketch
+        if sketch.count < self.hedge_min_samples:
+            return None
+        return sketch.quantile(HEDGE_QUANTILE)
+
+    async def call(self, key: str, attempt: Callable[[float], Awaitable[T]]) -> T:
+        """Выполнить attempt(timeout) с повторами; UpstreamError, если не удалось.
+
+        attempt получает оставшееся до дедлайна время и должен сам его соблюдать.
+        """
+        self.calls += 1
+        breaker = self.breaker(key)
+        if not breaker.allow():
+            self.fast_failed += 1
+            raise CircuitOpen(key)
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline
+        number = 0
+        while True:
+            number += 1
+            try:
+                result = await self._attempt(key, attempt, deadline - loop.time())
+            except asyncio.CancelledError:
+                # A cancelled half-open probe must not keep the circuit closed to everyone else.
+                breaker.on_cancelled()
+                raise
+            except Exception as e:
+                kind = classify_error(e)
+                self.errors[kind] = self.errors.get(kind, 0) + 1
+                if kind in RETRYABLE:
+                    breaker.on_failure()
+                else:
+                    # The provider answered; a bad request says nothing about its health.
+                    breaker.on_success()
+                delay = max(backoff_delay(number, self.base_delay, self.max_delay, self.rng), retry_after(e) or 0.0)
+                if kind not in RETRYABLE or number >= self.attempts or loop.time() + delay >= deadline:
+                    self.failed += 1
+                    if isinstance(e, UpstreamError):
+                        raise
+                    raise UpstreamError(kind, str(e)) from e
+                logger.warning(f"{key}: попытка {number} не удалась ({kind}), повтор через {delay:.2f} с")
+                await asyncio.sleep(delay)
+                if not breaker.allow():
+                    self.fast_failed += 1
+                    raise CircuitOpen(key) from e
+                self.retries += 1
+                continue
+            breaker.on_success()
+            return result
+
+    async def _attempt(self, key: str, attempt: Callable[[float], Awaitable[T]], remaining: float) -> T:
+        threshold = self.hedge_delay(key)
+        if threshold is None or threshold >= remaining:
+            return await attempt(remaining)
+
+        first = asyncio.ensure_future(attempt(remaining))
+        pending = {first}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=threshold)
+            if not done:
+                # Slower than p95: race a second identical request against the first.
+                self.hedged += 1
+                pending.add(asyncio.ensure_future(attempt(remaining - threshold)))
+            error: Optional[BaseException] = None
+            while True:
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+                if not pending:
+                    raise error
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> Dict:
+        open_circuits = [key for key, breaker in self._breakers.items() if breaker.state != "closed"]
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "failed": self.failed,
+            "fast_failed": self.fast_failed,
+            "errors": dict(self.errors),
+            "circuit_opens": sum(breaker.opens for breaker in self._breakers.values()),
+            "open_circuits": ", ".join(open_circuits) or "-",
+        }
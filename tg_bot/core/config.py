@@ -9,17 +9,162 @@ except Exception:  # pragma: no cover
 
 load_dotenv()
 
+
+def _env_flag(name: str, default: bool) -> bool:
+    """Boolean setting: 1/true/yes/on (any case) is on; unset uses the default."""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in {"1", "true", "yes", "on"}
+
 # Telegram Bot
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+# Updates of different users are handled in parallel (same user — strictly in order).
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "64"))
+# Upper bound on accepted updates (running + waiting) before intake applies backpressure.
+UPDATE_MAX_PENDING = int(os.getenv("UPDATE_MAX_PENDING", "1024"))
 
 # OpenRouter API
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 OPENROUTER_MODEL = os.getenv("OPENROUTER_MODEL", "google/gemini-2.5-flash-image")
+# Shared HTTP pool + per-request deadlines (seconds). Generation is slow (20-60s),
+# so the read deadline is generous while connect stays short.
+OPENROUTER_CONNECT_TIMEOUT = float(os.getenv("OPENROUTER_CONNECT_TIMEOUT", "10"))
+OPENROUTER_READ_TIMEOUT = float(os.getenv("OPENROUTER_READ_TIMEOUT", "180"))
+OPENROUTER_MAX_CONNECTIONS = int(os.getenv("OPENROUTER_MAX_CONNECTIONS", "100"))
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+# Transient failures (429, 5xx, timeouts, dropped connections) are retried up to
+# OPENROUTER_RETRY_ATTEMPTS times with jittered exponential backoff, all within
+# OPENROUTER_DEADLINE seconds per generation. With OPENROUTER_HEDGE a second identical
+# request is sent once an attempt is slower than the model's p95 (needs
+# OPENROUTER_HEDGE_MIN_SAMPLES successful calls; it may cost a second generation).
+# After OPENROUTER_BREAKER_FAILURES failures in a row a model fails fast for
+# OPENROUTER_BREAKER_RESET seconds.
+OPENROUTER_RETRY_ATTEMPTS = int(os.getenv("OPENROUTER_RETRY_ATTEMPTS", "3"))
+OPENROUTER_RETRY_BASE_DELAY = float(os.getenv("OPENROUTER_RETRY_BASE_DELAY", "1"))
+OPENROUTER_RETRY_MAX_DELAY = float(os.getenv("OPENROUTER_RETRY_MAX_DELAY", "10"))
+OPENROUTER_DEADLINE = float(os.getenv("OPENROUTER_DEADLINE", "240"))
+OPENROUTER_HEDGE_ENABLED = _env_flag("OPENROUTER_HEDGE", False)
+OPENROUTER_HEDGE_MIN_SAMPLES = int(os.getenv("OPENROUTER_HEDGE_MIN_SAMPLES", "20"))
+OPENROUTER_BREAKER_FAILURES = int(os.getenv("OPENROUTER_BREAKER_FAILURES", "5"))
+OPENROUTER_BREAKER_RESET = float(os.getenv("OPENROUTER_BREAKER_RESET", "30"))
+# Rolling health of each model (EWMA with MODEL_HEALTH_ALPHA + p95 sketch), used by the "auto"
+# model to route to the fastest healthy model and for the hedging threshold above. A model with an error rate of at least
+# MODEL_HEALTH_MAX_ERROR_RATE is skipped for MODEL_HEALTH_COOLDOWN seconds after its last error.
+MODEL_HEALTH_ALPHA = float(os.getenv("MODEL_HEALTH_ALPHA", "0.2"))
+MODEL_HEALTH_MAX_ERROR_RATE = float(os.getenv("MODEL_HEALTH_MAX_ERROR_RATE", "0.5"))
+MODEL_HEALTH_COOLDOWN = float(os.getenv("MODEL_HEALTH_COOLDOWN", "60"))
+# Admission control per model: at most this many OpenRouter calls in flight and this many
+# waiting (FIFO, up to GENERATION_QUEUE_TIMEOUT seconds); beyond that users get a "busy" reply.
+# Models can override the limits with "max_in_flight" / "max_queue" in models_pricing.json.
+GENERATION_MAX_IN_FLIGHT = int(os.getenv("GENERATION_MAX_IN_FLIGHT", "8"))
+GENERATION_MAX_QUEUE = int(os.getenv("GENERATION_MAX_QUEUE", "32"))
+GENERATION_QUEUE_TIMEOUT = float(os.getenv("GENERATION_QUEUE_TIMEOUT", "60"))
+# Fair share between users. Waiting calls of a model are served by weighted deficit round robin
+# over per-user queues (cost = generation price, GENERATION_FAIR_QUANTUM per turn), and one user
+# never has more than GENERATION_MAX_IN_FLIGHT_PER_USER jobs running (0 = no cap). Users who paid
+# within GENERATION_PAYING_WINDOW_DAYS get GENERATION_PAYING_WEIGHT times the share.
+GENERATION_FAIR_SCHEDULING = _env_flag("GENERATION_FAIR_SCHEDULING", True)
+GENERATION_FAIR_QUANTUM = float(os.getenv("GENERATION_FAIR_QUANTUM", "5"))
+GENERATION_MAX_IN_FLIGHT_PER_USER = int(os.getenv("GENERATION_MAX_IN_FLIGHT_PER_USER", "2"))
+GENERATION_PAYING_WEIGHT = float(os.getenv("GENERATION_PAYING_WEIGHT", "2"))
+GENERATION_PAYING_WINDOW_DAYS = int(os.getenv("GENERATION_PAYING_WINDOW_DAYS", "30"))
+# Identical (model, prompt, inputs) generations running at the same time share one upstream call;
+# every user is still charged and gets the result separately.
+GENERATION_SINGLE_FLIGHT = _env_flag("GENERATION_SINGLE_FLIGHT", True)
+# Generations are durable jobs in SQLite (generation_jobs): handlers only enqueue them and
+# GENERATION_WORKERS workers per process run them under a lease of GENERATION_LEASE_SECONDS
+# (renewed while running). A job whose lease expired (crash) is resumed by any worker; after
+# GENERATION_MAX_ATTEMPTS attempts it is refunded.
+GENERATION_WORKERS = int(os.getenv("GENERATION_WORKERS", "16"))
+GENERATION_LEASE_SECONDS = float(os.getenv("GENERATION_LEASE_SECONDS", "60"))
+GENERATION_MAX_ATTEMPTS = int(os.getenv("GENERATION_MAX_ATTEMPTS", "2"))
+# Idle workers poll the table this often (jobs enqueued by this process wake them at once).
+GENERATION_POLL_INTERVAL = float(os.getenv("GENERATION_POLL_INTERVAL", "1.0"))
+# Result images returned as http(s) URLs are downloaded through one shared keep-alive session.
+DOWNLOAD_MAX_BYTES = int(os.getenv("DOWNLOAD_MAX_BYTES", str(20 * 1024 * 1024)))
+DOWNLOAD_TIMEOUT = float(os.getenv("DOWNLOAD_TIMEOUT", "60"))
+# Bodies above this size are spooled to a temporary file instead of memory.
+DOWNLOAD_SPOOL_BYTES = int(os.getenv("DOWNLOAD_SPOOL_BYTES", str(1024 * 1024)))
+DOWNLOAD_MAX_CONNECTIONS = int(os.getenv("DOWNLOAD_MAX_CONNECTIONS", "50"))
+
+# Input photo preprocessing (needs Pillow; without it photos are sent as is).
+# Downscaling/re-encoding runs in a process pool of this size.
+IMAGE_PREPROCESS_WORKERS = int(os.getenv("IMAGE_PREPROCESS_WORKERS", "2"))
+# Longest side for models without "max_input_side" in models_pricing.json.
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "2048"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "90"))
+
+# Photos waiting for a prompt. Over the memory budget the least recently used uploads
+# are spilled to PENDING_INPUT_SPILL_DIR (a temp dir by default); over the disk budget
+# or PENDING_INPUT_MAX_USERS they are dropped. Uploads without a prompt expire after the TTL.
+PENDING_INPUT_MEMORY_BYTES = int(os.getenv("PENDING_INPUT_MEMORY_BYTES", str(64 * 1024 * 1024)))
+PENDING_INPUT_DISK_BYTES = int(os.getenv("PENDING_INPUT_DISK_BYTES", str(1024 * 1024 * 1024)))
+PENDING_INPUT_MAX_USERS = int(os.getenv("PENDING_INPUT_MAX_USERS", "10000"))
+PENDING_INPUT_TTL = int(os.getenv("PENDING_INPUT_TTL", "1800"))
+PENDING_INPUT_SPILL_DIR = os.getenv("PENDING_INPUT_SPILL_DIR", "")
+
+# Albums (media groups): photos are collected until ALBUM_MAX_PHOTOS arrive or no new photo
+# comes for an adaptive quiet period (ALBUM_MIN_DEBOUNCE..ALBUM_MAX_DEBOUNCE seconds,
+# derived from the gaps seen so far), but never longer than ALBUM_MAX_WAIT after the first one.
+ALBUM_MAX_PHOTOS = int(os.getenv("ALBUM_MAX_PHOTOS", "10"))
+ALBUM_MIN_DEBOUNCE = float(os.getenv("ALBUM_MIN_DEBOUNCE", "0.3"))
+ALBUM_MAX_DEBOUNCE = float(os.getenv("ALBUM_MAX_DEBOUNCE", "2.0"))
+ALBUM_MAX_WAIT = float(os.getenv("ALBUM_MAX_WAIT", "10"))
+
+# Content-addressed cache of generation results (off by default). Which models are cached
+# and what a cache hit costs is set per model in models_pricing.json
+# ("cache_results", "cache_hit_price_rubies"). Least recently used results are evicted over the cap.
+RESULT_CACHE_ENABLED = _env_flag("RESULT_CACHE_ENABLED", False)
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", os.path.join("data", "result_cache"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+
+# Telegram file_id registry: results already uploaded to Telegram are re-sent by file_id
+# (content sha256 -> file_id, kept in SQLite with an LRU of FILE_REGISTRY_CACHE_SIZE in memory);
+# prepared input photos are kept by file_unique_id within FILE_REGISTRY_INPUT_BYTES of memory,
+# so the same photo sent again is not downloaded and processed twice.
+FILE_REGISTRY_CACHE_SIZE = int(os.getenv("FILE_REGISTRY_CACHE_SIZE", "10000"))
+FILE_REGISTRY_INPUT_BYTES = int(os.getenv("FILE_REGISTRY_INPUT_BYTES", str(32 * 1024 * 1024)))
 
 # YooKassa
 YOOKASSA_SHOP_ID = os.getenv("YOOKASSA_SHOP_ID")
 YOOKASSA_SECRET_KEY = os.getenv("YOOKASSA_SECRET_KEY")
+YOOKASSA_API_URL = os.getenv("YOOKASSA_API_URL", "https://api.yookassa.ru/v3")
+# "http" — async pooled client of the REST API; "sdk" — the official `yookassa` SDK in a bounded thread pool.
+YOOKASSA_BACKEND = os.getenv("YOOKASSA_BACKEND", "http").lower()
+YOOKASSA_CONNECT_TIMEOUT = float(os.getenv("YOOKASSA_CONNECT_TIMEOUT", "5"))
+YOOKASSA_READ_TIMEOUT = float(os.getenv("YOOKASSA_READ_TIMEOUT", "15"))
+# Attempts per call on network errors / 429 / 5xx; payment creation reuses its Idempotence-Key.
+YOOKASSA_MAX_ATTEMPTS = int(os.getenv("YOOKASSA_MAX_ATTEMPTS", "3"))
+YOOKASSA_SDK_THREADS = int(os.getenv("YOOKASSA_SDK_THREADS", "4"))
+# Payment notifications (payment.succeeded / payment.canceled) are received on
+# WEBHOOK_LISTEN:WEBHOOK_PORT + YOOKASSA_WEBHOOK_PATH; set the same URL in the YooKassa dashboard.
+YOOKASSA_WEBHOOK_ENABLED = _env_flag("YOOKASSA_WEBHOOK_ENABLED", False)
+YOOKASSA_WEBHOOK_PATH = os.getenv("YOOKASSA_WEBHOOK_PATH", "/yookassa")
+# Optional source allowlist (comma-separated IPs/CIDRs, e.g. YooKassa's published ranges
+# 185.71.76.0/27,185.71.77.0/27,77.75.153.0/25,77.75.156.11,77.75.156.35,77.75.154.128/25,2a02:5180::/32).
+# Empty = no check: every notification is verified by re-reading the payment from the API anyway.
+YOOKASSA_WEBHOOK_ALLOWED_IPS = [x for x in os.getenv("YOOKASSA_WEBHOOK_ALLOWED_IPS", "").replace(" ", "").split(",") if x]
+# Background reconciliation of pending payments (JobQueue); interval 0 disables it.
+PAYMENT_RECONCILE_INTERVAL = float(os.getenv("PAYMENT_RECONCILE_INTERVAL", "60"))
+# Payments younger than this are left alone: the user is most likely still paying.
+PAYMENT_RECONCILE_MIN_AGE = int(os.getenv("PAYMENT_RECONCILE_MIN_AGE", "120"))
+PAYMENT_RECONCILE_BATCH = int(os.getenv("PAYMENT_RECONCILE_BATCH", "100"))
+# Provider status checks: at most this many in flight and this many per second.
+PAYMENT_RECONCILE_CONCURRENCY = int(os.getenv("PAYMENT_RECONCILE_CONCURRENCY", "5"))
+PAYMENT_RECONCILE_RATE = float(os.getenv("PAYMENT_RECONCILE_RATE", "10"))
+# Still unpaid after this many seconds -> status "expired" (a late payment is still credited).
+PAYMENT_PENDING_TTL = int(os.getenv("PAYMENT_PENDING_TTL", str(24 * 3600)))
+
+# Update intake: "polling" (default) or "webhook".
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+# Public HTTPS base URL of this bot (Telegram posts updates to WEBHOOK_URL + WEBHOOK_PATH).
 WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Checked against X-Telegram-Bot-Api-Secret-Token; generated at startup if empty.
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN", "")
 
 # Pricing - 1 рубин = 1 рубль
 RUBY_PRICE = float(os.getenv("RUBY_PRICE", "1"))
@@ -27,7 +172,27 @@ RUBY_PRICE = float(os.getenv("RUBY_PRICE", "1"))
 # Database
 # NOTE: docker-compose already sets DATABASE_PATH; we respect it here.
 DATABASE_PATH = os.getenv("DATABASE_PATH", os.path.join("data", "bot_database.db"))
+# Long-lived connections opened in Database.init_db and reused by every query.
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "4"))
+DATABASE_BUSY_TIMEOUT_MS = int(os.getenv("DATABASE_BUSY_TIMEOUT_MS", "5000"))
+DATABASE_CACHED_STATEMENTS = int(os.getenv("DATABASE_CACHED_STATEMENTS", "256"))
+# Append-only inserts (generation/transfer history) are group-committed by one background
+# writer: one transaction every DB_WRITER_FLUSH_INTERVAL_MS or every DB_WRITER_MAX_BATCH rows.
+DB_WRITER_FLUSH_INTERVAL_MS = int(os.getenv("DB_WRITER_FLUSH_INTERVAL_MS", "100"))
+DB_WRITER_MAX_BATCH = int(os.getenv("DB_WRITER_MAX_BATCH", "500"))
+# In-process LRU cache of users/balances (0 disables it). The cache is per process:
+# disable it if several processes write to the same database file.
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+
+# Telegram user ids allowed to use operator commands (/stats), comma-separated.
+ADMIN_USER_IDS = {int(x) for x in os.getenv("ADMIN_USER_IDS", "").replace(" ", "").split(",") if x}
 
 # Data files
 FEEDBACK_PATH = os.getenv("FEEDBACK_PATH", os.path.join("data", "feedback.jsonl"))
 
+# User interaction log: written by a background thread; "text" (legacy lines) or "json" (JSON Lines).
+INTERACTION_LOG_PATH = os.getenv("INTERACTION_LOG_PATH", os.path.join("logs", "user_interactions.log"))
+INTERACTION_LOG_FORMAT = os.getenv("INTERACTION_LOG_FORMAT", "text").lower()
+# Set to WARNING to switch interaction events off entirely (they are INFO).
+INTERACTION_LOG_LEVEL = os.getenv("INTERACTION_LOG_LEVEL", "INFO").upper()
+
@@ -0,0 +1,67 @@
+"""In-process LRU cache of known users and their balances."""
+
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+class UserCache:
+    """LRU-кэш пользователей (user_id -> строка users) со счётчиками попаданий.
+
+    Кэш write-through: Database обновляет его в каждом методе, который меняет баланс,
+    значениями, которые вернул сам SQL (RETURNING). max_size=0 отключает кэш.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max(0, max_size)
+        self._users: "OrderedDict[int, Dict]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id: int) -> Optional[Dict]:
+        user = self._users.get(user_id)
+        if user is None:
+            self.misses += 1
+            return None
+        self._users.move_to_end(user_id)
+        self.hits += 1
+        return dict(user)
+
+    def put(self, user: Dict) -> None:
+        if not self.max_size:
+            return
+        user_id = user["user_id"]
+        self._users[user_id] = dict(user)
+        self._users.move_to_end(user_id)
+        while len(self._users) > self.max_size:
+            self._users.popitem(last=False)
+            self.evictions += 1
+
+    def set_rubies(self, user_id: int, rubies: int) -> None:
+        """Обновить баланс, если пользователь уже в кэше"""
+        user = self._users.get(user_id)
+        if user is not None:
+            user["rubies"] = rubies
+
+    def set_last_paid_at(self, user_id: int, paid_at: float) -> None:
+        """Обновить время последнего платежа, если пользователь уже в кэше"""
+        user = self._users.get(user_id)
+        if user is not None:
+            user["last_paid_at"] = paid_at
+
+    def invalidate(self, user_id: int) -> None:
+        self._users.pop(user_id, None)
+
+    def clear(self) -> None:
+        self._users.clear()
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._users),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
@@ -1,12 +1,68 @@
+import asyncio
+import functools
+import json
+import logging
+import sqlite3
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import AsyncIterator, List, Optional, Sequence
+
 import aiosqlite
 import os
 
-from tg_bot.core.config import DATABASE_PATH
+from tg_bot.core.config import (
+    DATABASE_BUSY_TIMEOUT_MS,
+    DATABASE_CACHED_STATEMENTS,
+    DATABASE_PATH,
+    DATABASE_POOL_SIZE,
+    DB_WRITER_FLUSH_INTERVAL_MS,
+    DB_WRITER_MAX_BATCH,
+    USER_CACHE_SIZE,
+)
+from tg_bot.db.cache import UserCache
+from tg_bot.db.migrations import apply_migrations
+from tg_bot.db.writer import BatchWriter
+
+logger = logging.getLogger(__name__)
+
+BUSY_RETRIES = 5
+BUSY_RETRY_DELAY = 0.05
+# Balance writes of one user are serialized in-process so the cache is updated in commit order.
+BALANCE_LOCK_STRIPES = 64
+
+
+def _is_busy_error(exc: sqlite3.OperationalError) -> bool:
+    message = str(exc).lower()
+    return "database is locked" in message or "database is busy" in message
+
+
+def retry_on_busy(func):
+    """Повторить метод, если SQLite вернул SQLITE_BUSY (транзакция к этому моменту уже откатана)."""
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        for attempt in range(BUSY_RETRIES):
+            try:
+                return await func(*args, **kwargs)
+            except sqlite3.OperationalError as e:
+                if not _is_busy_error(e) or attempt == BUSY_RETRIES - 1:
+                    raise
+                logger.warning(f"SQLite busy in {func.__name__}, retry {attempt + 1}/{BUSY_RETRIES - 1}")
+                await asyncio.sleep(BUSY_RETRY_DELAY * (2**attempt))
+
+    return wrapper
 
 
 class Database:
-    def __init__(self):
+    def __init__(self, pool_size: int = DATABASE_POOL_SIZE, user_cache_size: int = USER_CACHE_SIZE):
         self.db_path = DATABASE_PATH
+        self.pool_size = max(1, pool_size)
+        self._pool: Optional[asyncio.Queue] = None
+        self._connections: List[aiosqlite.Connection] = []
+        self._pool_lock = asyncio.Lock()
+        self.users = UserCache(user_cache_size)
+        self._balance_locks = [asyncio.Lock() for _ in range(BALANCE_LOCK_STRIPES)]
+        self.writer = BatchWriter(self._connection, DB_WRITER_FLUSH_INTERVAL_MS, DB_WRITER_MAX_BATCH)
 
         # If user had old DB in repo root, migrate once.
         old_path = "bot_database.db"
@@ -20,6 +76,67 @@ class Database:
             # Non-fatal; init_db will create new if needed
             pass
 
+    async def _open_connection(self) -> aiosqlite.Connection:
+        db = await aiosqlite.connect(
+            self.db_path,
+            timeout=DATABASE_BUSY_TIMEOUT_MS / 1000,
+            cached_statements=DATABASE_CACHED_STATEMENTS,
+        )
+        # WAL: readers don't block the writer; NORMAL is durable in WAL mode except on power loss.
+        await db.execute("PRAGMA journal_mode=WAL")
+        await db.execute("PRAGMA synchronous=NORMAL")
+        await db.execute(f"PRAGMA busy_timeout={DATABASE_BUSY_TIMEOUT_MS}")
+        return db
+
+    async def _ensure_pool(self) -> asyncio.Queue:
+        if self._pool is not None:
+            return self._pool
+        async with self._pool_lock:
+            if self._pool is None:
+                pool: asyncio.Queue = asyncio.Queue()
+                for _ in range(self.pool_size):
+                    db = await self._open_connection()
+                    self._connections.append(db)
+                    pool.put_nowait(db)
+                self._pool = pool
+        return self._pool
+
+    @asynccontextmanager
+    async def _connection(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Взять соединение из пула; незавершённая транзакция откатывается перед возвратом."""
+        pool = await self._ensure_pool()
+        db = await pool.get()
+        try:
+            yield db
+        except BaseException:
+            if db.in_transaction:
+                await db.rollback()
+            raise
+        finally:
+            pool.put_nowait(db)
+
+    def _balance_lock(self, user_id: int) -> asyncio.Lock:
+        return self._balance_locks[user_id % BALANCE_LOCK_STRIPES]
+
+    async def _append(self, sql: str, params: tuple) -> None:
+        """Append-only INSERT: через групповой коммит, если писатель запущен, иначе сразу"""
+        if self.writer.running:
+            await self.writer.submit(sql, params)
+            return
+        async with self._connection() as db:
+            await db.execute(sql, params)
+            await db.commit()
+
+    async def close(self):
+        """Дописать очередь вставок и закрыть все соединения пула (вызывается при остановке бота)"""
+        await self.writer.stop()
+        async with self._pool_lock:
+            connections, self._connections = self._connections, []
+            self._pool = None
+            for db in connections:
+                await db.close()
+
+    @retry_on_busy
     async def init_db(self):
         """Инициализация базы данных"""
         db_dir = os.path.dirname(self.db_path)
@@ -28,7 +145,7 @@ class Database:
             if not os.access(db_dir, os.W_OK):
                 raise PermissionError(f"Нет прав на запись в директорию: {db_dir}")
 
-        async with aiosqlite.connect(self.db_path, timeout=10.0) as db:
+        async with self._connection() as db:
             await db.execute(
                 """
                 CREATE TABLE IF NOT EXISTS users (
@@ -83,67 +200,195 @@ class Database:
             )
 
             await db.commit()
+            await apply_migrations(db)
+
+        self.writer.start()
 
+    _USER_COLUMNS = ("user_id", "username", "first_name", "rubies", "last_paid_at")
+
+    @retry_on_busy
     async def get_or_create_user(self, user_id: int, username: str = None, first_name: str = None):
         """Получить или создать пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-            user = await cursor.fetchone()
+        cached = self.users.get(user_id)
+        if cached is not None:
+            return cached
+
+        async with self._balance_lock(user_id), self._connection() as db:
+            cursor = await db.execute(f"SELECT {', '.join(self._USER_COLUMNS)} FROM users WHERE user_id = ?", (user_id,))
+            row = await cursor.fetchone()
 
-            if not user:
+            if not row:
                 await db.execute(
                     "INSERT INTO users (user_id, username, first_name, rubies) VALUES (?, ?, ?, ?)",
                     (user_id, username, first_name, 20),
                 )
                 await db.commit()
-                return {"user_id": user_id, "username": username, "first_name": first_name, "rubies": 20}
+                row = (user_id, username, first_name, 20, None)
+            user = dict(zip(self._USER_COLUMNS, row))
+            self.users.put(user)
+            return dict(user)
+
+    async def _get_user(self, user_id: int) -> Optional[dict]:
+        """Строка пользователя из кэша или из базы (с заполнением кэша); None, если его нет"""
+        cached = self.users.get(user_id)
+        if cached is not None:
+            return cached
 
-            return {"user_id": user[0], "username": user[1], "first_name": user[2], "rubies": user[3]}
+        async with self._balance_lock(user_id), self._connection() as db:
+            cursor = await db.execute(f"SELECT {', '.join(self._USER_COLUMNS)} FROM users WHERE user_id = ?", (user_id,))
+            row = await cursor.fetchone()
+            if not row:
+                return None
+            user = dict(zip(self._USER_COLUMNS, row))
+            self.users.put(user)
+            return user
 
+    @retry_on_busy
     async def get_user_rubies(self, user_id: int) -> int:
         """Получить количество рубинов пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute("SELECT rubies FROM users WHERE user_id = ?", (user_id,))
-            result = await cursor.fetchone()
-            return result[0] if result else 0
+        user = await self._get_user(user_id)
+        return user["rubies"] if user else 0
 
+    @retry_on_busy
     async def add_rubies(self, user_id: int, amount: int):
         """Добавить рубины пользователю"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("UPDATE users SET rubies = rubies + ? WHERE user_id = ?", (amount, user_id))
+        async with self._balance_lock(user_id), self._connection() as db:
+            balance = await self._credit(db, user_id, amount)
             await db.commit()
+            if balance is not None:
+                self.users.set_rubies(user_id, balance)
 
+    @retry_on_busy
     async def deduct_rubies(self, user_id: int, amount: int) -> bool:
         """Списать рубины у пользователя. Возвращает True если успешно"""
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute("SELECT rubies FROM users WHERE user_id = ?", (user_id,))
-            result = await cursor.fetchone()
-            current_rubies = result[0] if result else 0
+        cached = self.users.get(user_id)
+        if cached is not None and cached["rubies"] < amount:
+            # Known-insufficient balance: no need to touch the database.
+            return False
 
-            if current_rubies >= amount:
-                await db.execute("UPDATE users SET rubies = rubies - ? WHERE user_id = ?", (amount, user_id))
-                await db.commit()
-                return True
+        async with self._balance_lock(user_id), self._connection() as db:
+            balance = await self._debit(db, user_id, amount)
+            await db.commit()
+        if balance is None:
             return False
+        self.users.set_rubies(user_id, balance)
+        return True
+
+    # Balance changes inside a caller's transaction (under _balance_lock); the caller commits
+    # and updates the user cache.
+
+    @staticmethod
+    async def _debit(db, user_id: int, amount: int) -> Optional[int]:
+        """Списать amount одним условным UPDATE. Остаток или None, если рубинов недостаточно"""
+        rows = await db.execute_fetchall(
+            "UPDATE users SET rubies = rubies - ? WHERE user_id = ? AND rubies >= ? RETURNING rubies",
+            (amount, user_id, amount),
+        )
+        return rows[0][0] if rows else None
+
+    @staticmethod
+    async def _credit(db, user_id: int, amount: int) -> Optional[int]:
+        """Вернуть amount на баланс. Новый баланс или None, если пользователя нет"""
+        rows = await db.execute_fetchall(
+            "UPDATE users SET rubies = rubies + ? WHERE user_id = ? RETURNING rubies", (amount, user_id)
+        )
+        return rows[0][0] if rows else None
 
+    @retry_on_busy
     async def create_payment(self, payment_id: str, user_id: int, amount: float, rubies: int):
         """Создать запись о платеже"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             await db.execute(
                 "INSERT INTO payments (payment_id, user_id, amount, rubies, status) VALUES (?, ?, ?, ?, ?)",
                 (payment_id, user_id, amount, rubies, "pending"),
             )
             await db.commit()
 
-    async def update_payment_status(self, payment_id: str, status: str):
-        """Обновить статус платежа"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("UPDATE payments SET status = ? WHERE payment_id = ?", (status, payment_id))
+    @retry_on_busy
+    async def update_payment_status(self, payment_id: str, status: str, expected_status: Optional[str] = None) -> bool:
+        """Обновить статус платежа (с expected_status — только если текущий статус совпадает).
+
+        Возвращает True, если строка была изменена.
+        """
+        async with self._connection() as db:
+            if expected_status is None:
+                cursor = await db.execute("UPDATE payments SET status = ? WHERE payment_id = ?", (status, payment_id))
+            else:
+                cursor = await db.execute(
+                    "UPDATE payments SET status = ? WHERE payment_id = ? AND status = ?",
+                    (status, payment_id, expected_status),
+                )
             await db.commit()
+            return cursor.rowcount > 0
+
+    @retry_on_busy
+    async def get_pending_payments(
+        self, limit: int, min_age_seconds: int, stale_after_seconds: int, after: Optional[tuple] = None
+    ) -> list:
+        """Порция ожидающих платежей старше min_age_seconds, по возрастанию (created_at, payment_id).
 
+        `after` — ключ последней строки предыдущей порции (keyset-пагинация по
+        idx_payments_status_created). Поле `stale` — платеж старше stale_after_seconds.
+        """
+        after = after or ("", "")
+        async with self._connection() as db:
+            rows = await db.execute_fetchall(
+                """
+                SELECT payment_id, user_id, rubies, created_at,
+                       created_at <= datetime('now', ?) AS stale
+                FROM payments
+                WHERE status = 'pending'
+                  AND created_at <= datetime('now', ?)
+                  AND (created_at, payment_id) > (?, ?)
+                ORDER BY created_at, payment_id
+                LIMIT ?
+                """,
+                (f"-{int(stale_after_seconds)} seconds", f"-{int(min_age_seconds)} seconds", after[0], after[1], limit),
+            )
+        return [
+            {"payment_id": r[0], "user_id": r[1], "rubies": r[2], "created_at": r[3], "stale": bool(r[4])}
+            for r in rows
+        ]
+
+    @retry_on_busy
+    async def credit_payment(self, payment_id: str) -> Optional[dict]:
+        """Отметить платеж успешным и начислить рубины — ровно один раз.
+
+        Compare-and-set по статусу: повторные уведомления, нажатия кнопки и фоновые
+        проверки получают None. При успехе возвращает user_id, rubies и новый баланс.
+        """
+        async with self._connection() as db:
+            rows = await db.execute_fetchall("SELECT user_id FROM payments WHERE payment_id = ?", (payment_id,))
+        if not rows:
+            return None
+        user_id = rows[0][0]
+
+        async with self._balance_lock(user_id), self._connection() as db:
+            rows = await db.execute_fetchall(
+                "UPDATE payments SET status = 'succeeded' WHERE payment_id = ? AND status != 'succeeded' "
+                "RETURNING user_id, rubies",
+                (payment_id,),
+            )
+            if not rows:
+                await db.rollback()
+                return None
+            rubies = rows[0][1]
+            paid_at = time.time()
+            balance_rows = await db.execute_fetchall(
+                "UPDATE users SET rubies = rubies + ?, last_paid_at = ? WHERE user_id = ? RETURNING rubies",
+                (rubies, paid_at, user_id),
+            )
+            await db.commit()
+            balance = balance_rows[0][0] if balance_rows else 0
+            if balance_rows:
+                self.users.set_rubies(user_id, balance)
+                self.users.set_last_paid_at(user_id, paid_at)
+            return {"payment_id": payment_id, "user_id": user_id, "rubies": rubies, "balance": balance}
+
+    @retry_on_busy
     async def get_payment(self, payment_id: str):
         """Получить информацию о платеже"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             cursor = await db.execute("SELECT * FROM payments WHERE payment_id = ?", (payment_id,))
             result = await cursor.fetchone()
             if result:
@@ -159,13 +404,284 @@ class Database:
 
     async def log_generation(self, user_id: int, prompt: str, cost: int):
         """Записать генерацию в историю"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("INSERT INTO generations (user_id, prompt, cost) VALUES (?, ?, ?)", (user_id, prompt, cost))
+        await self._append("INSERT INTO generations (user_id, prompt, cost) VALUES (?, ?, ?)", (user_id, prompt, cost))
+
+    # --- Generation jobs -------------------------------------------------------------------
+    # queued -> running (lease) -> succeeded | refunded; an expired lease makes the job claimable again.
+
+    _JOB_COLUMNS = (
+        "id, user_id, username, chat_id, status_message_id, kind, model, prompt, cost, cache_key, "
+        "attempts, lease_owner, enqueued_at, weight, cache_hit"
+    )
+
+    @retry_on_busy
+    async def enqueue_generation_job(
+        self,
+        user_id: int,
+        chat_id: int,
+        kind: str,
+        model: str,
+        prompt: str,
+        cost: int,
+        inputs: Sequence[bytes] = (),
+        *,
+        username: Optional[str] = None,
+        status_message_id: Optional[int] = None,
+        cache_key: Optional[str] = None,
+        weight: float = 1.0,
+        cache_hit: bool = False,
+    ) -> Optional[int]:
+        """Зарезервировать рубины и поставить генерацию в очередь одной транзакцией.
+
+        cache_hit — cost посчитан по цене результата из кэша. Возвращает id задачи или
+        None, если рубинов недостаточно.
+        """
+        async with self._balance_lock(user_id), self._connection() as db:
+            balance = await self._debit(db, user_id, cost)
+            if balance is None:
+                await db.rollback()
+                return None
+            cursor = await db.execute(
+                "INSERT INTO generation_jobs (user_id, username, chat_id, status_message_id, kind, model, prompt, "
+                "cost, cache_key, weight, cache_hit, enqueued_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    user_id,
+                    username,
+                    chat_id,
+                    status_message_id,
+                    kind,
+                    model,
+                    prompt,
+                    cost,
+                    cache_key,
+                    weight,
+                    int(cache_hit),
+                    time.time(),
+                ),
+            )
+            job_id = cursor.lastrowid
+            await db.executemany(
+                "INSERT INTO generation_job_inputs (job_id, position, data) VALUES (?, ?, ?)",
+                [(job_id, position, data) for position, data in enumerate(inputs)],
+            )
+            await db.commit()
+            self.users.set_rubies(user_id, balance)
+            return job_id
+
+    @retry_on_busy
+    async def claim_generation_job(
+        self,
+        owner: str,
+        lease_seconds: float,
+        max_attempts: int,
+        max_per_user: int = 0,
+        skip_models: Sequence[str] = (),
+    ) -> Optional[dict]:
+        """Взять задачу из очереди (или с истёкшей арендой) под аренду owner.
+
+        Первыми идут пользователи, у которых меньше всего выполняющихся задач с учётом
+        веса, внутри пользователя — по порядку. Пользователи, у которых уже max_per_user
+        задач выполняется, пропускаются (0 — без ограничения), как и задачи моделей из
+        skip_models, кроме отвечаемых из кэша.
+        """
+        now = time.time()
+        async with self._connection() as db:
+            rows = await db.execute_fetchall(
+                "WITH busy AS (SELECT user_id, COUNT(*) AS running FROM generation_jobs "
+                "WHERE status = 'running' AND lease_expires_at >= :now GROUP BY user_id) "
+                "UPDATE generation_jobs SET status = 'running', lease_owner = :owner, lease_expires_at = :expires, "
+                "attempts = attempts + 1 "
+                "WHERE id = (SELECT j.id FROM generation_jobs j LEFT JOIN busy b ON b.user_id = j.user_id "
+                "WHERE (j.status = 'queued' OR (j.status = 'running' AND j.lease_expires_at < :now)) "
+                "AND j.attempts < :max_attempts AND (:max_per_user <= 0 OR COALESCE(b.running, 0) < :max_per_user) "
+                "AND (j.cache_hit = 1 OR j.model NOT IN (SELECT value FROM json_each(:skip_models))) "
+                "ORDER BY COALESCE(b.running, 0) / j.weight, j.id LIMIT 1) "
+                f"RETURNING {self._JOB_COLUMNS}",
+                {
+                    "now": now,
+                    "owner": owner,
+                    "expires": now + lease_seconds,
+                    "max_attempts": max_attempts,
+                    "max_per_user": max_per_user,
+                    "skip_models": json.dumps(list(skip_models)),
+                },
+            )
+            await db.commit()
+            if not rows:
+                return None
+            columns = [c.strip() for c in self._JOB_COLUMNS.split(",")]
+            job = dict(zip(columns, rows[0]))
+            job["cache_hit"] = bool(job["cache_hit"])
+            cursor = await db.execute(
+                "SELECT data FROM generation_job_inputs WHERE job_id = ? ORDER BY position", (job["id"],)
+            )
+            job["inputs"] = [row[0] for row in await cursor.fetchall()]
+            # Closing last also drops the connection thread's reference to the fetched blobs, so
+            # the worker can free them once the request is built.
+            await cursor.close()
+            return job
+
+    @retry_on_busy
+    async def has_recent_payment(self, user_id: int, within_seconds: int) -> bool:
+        """Был ли у пользователя успешный платёж за последние within_seconds секунд.
+
+        Время платежа хранится в строке пользователя (credit_payment), поэтому для
+        известного пользователя ответ берётся из кэша без запроса к базе.
+        """
+        user = await self._get_user(user_id)
+        paid_at = user.get("last_paid_at") if user else None
+        return paid_at is not None and paid_at >= time.time() - within_seconds
+
+    @retry_on_busy
+    async def reprice_generation_job(self, job_id: int, owner: str, user_id: int, cost: int) -> Optional[int]:
+        """Поднять резерв выполняющейся задачи до cost (доплата списывается сразу).
+
+        Возвращает новый баланс или None, если рубинов на доплату недостаточно или
+        аренда потеряна; тогда ничего не меняется.
+        """
+        async with self._balance_lock(user_id), self._connection() as db:
+            rows = await db.execute_fetchall(
+                "SELECT cost FROM generation_jobs WHERE id = ? AND status = 'running' AND lease_owner = ?",
+                (job_id, owner),
+            )
+            balance = await self._debit(db, user_id, max(0, cost - rows[0][0])) if rows else None
+            if balance is None:
+                await db.rollback()
+                return None
+            await db.execute("UPDATE generation_jobs SET cost = MAX(cost, ?), cache_hit = 0 WHERE id = ?", (cost, job_id))
+            await db.commit()
+            self.users.set_rubies(user_id, balance)
+            return balance
+
+    @retry_on_busy
+    async def extend_generation_lease(self, job_id: int, owner: str, lease_seconds: float) -> bool:
+        """Продлить аренду. False — задачу уже забрал другой исполнитель или она завершена"""
+        async with self._connection() as db:
+            cursor = await db.execute(
+                "UPDATE generation_jobs SET lease_expires_at = ? WHERE id = ? AND status = 'running' AND lease_owner = ?",
+                (time.time() + lease_seconds, job_id, owner),
+            )
+            await db.commit()
+            return cursor.rowcount > 0
+
+    @retry_on_busy
+    async def complete_generation_job(self, job_id: int, owner: str, history_prompt: str) -> Optional[int]:
+        """Завершить задачу и записать генерацию в историю. Возвращает баланс или None, если аренда потеряна"""
+        async with self._connection() as db:
+            # Rubies were reserved at enqueue, so the balance read here is the one after the charge.
+            rows = await db.execute_fetchall(
+                "UPDATE generation_jobs SET status = 'succeeded', lease_owner = NULL, lease_expires_at = NULL "
+                "WHERE id = ? AND status = 'running' AND lease_owner = ? "
+                "RETURNING user_id, cost, (SELECT rubies FROM users WHERE users.user_id = generation_jobs.user_id)",
+                (job_id, owner),
+            )
+            if not rows:
+                await db.rollback()
+                return None
+            user_id, cost, balance = rows[0]
+            await db.execute("DELETE FROM generation_job_inputs WHERE job_id = ?", (job_id,))
             await db.commit()
+        # History is append-only: it goes through the group-commit writer, not this transaction.
+        await self.log_generation(user_id, history_prompt, cost)
+        return balance
 
+    @retry_on_busy
+    async def refund_generation_job(self, job_id: int, error: str, owner: Optional[str] = None) -> Optional[dict]:
+        """Вернуть рубины за незавершённую задачу — ровно один раз.
+
+        owner=None — без проверки аренды (восстановление после сбоя). Возвращает user_id,
+        chat_id, cost и новый баланс или None, если задача уже завершена или возвращена.
+        """
+        async with self._connection() as db:
+            rows = await db.execute_fetchall("SELECT user_id FROM generation_jobs WHERE id = ?", (job_id,))
+        if not rows:
+            return None
+        user_id = rows[0][0]
+
+        async with self._balance_lock(user_id), self._connection() as db:
+            rows = await db.execute_fetchall(
+                "UPDATE generation_jobs SET status = 'refunded', error = ?, lease_owner = NULL, lease_expires_at = NULL "
+                "WHERE id = ? AND status IN ('queued', 'running') AND (? IS NULL OR lease_owner = ?) "
+                "RETURNING chat_id, status_message_id, cost",
+                (error[:500], job_id, owner, owner),
+            )
+            if not rows:
+                await db.rollback()
+                return None
+            chat_id, status_message_id, cost = rows[0]
+            balance = await self._credit(db, user_id, cost)
+            await db.execute("DELETE FROM generation_job_inputs WHERE job_id = ?", (job_id,))
+            await db.commit()
+            if balance is not None:
+                self.users.set_rubies(user_id, balance)
+            else:
+                balance = 0
+            return {
+                "id": job_id,
+                "user_id": user_id,
+                "chat_id": chat_id,
+                "status_message_id": status_message_id,
+                "cost": cost,
+                "balance": balance,
+            }
+
+    @retry_on_busy
+    async def requeue_generation_job(self, job_id: int, owner: str) -> bool:
+        """Вернуть задачу в очередь без траты попытки (остановка бота посреди генерации)"""
+        async with self._connection() as db:
+            cursor = await db.execute(
+                "UPDATE generation_jobs SET status = 'queued', attempts = attempts - 1, lease_owner = NULL, "
+                "lease_expires_at = NULL WHERE id = ? AND status = 'running' AND lease_owner = ?",
+                (job_id, owner),
+            )
+            await db.commit()
+            return cursor.rowcount > 0
+
+    @retry_on_busy
+    async def get_abandoned_generation_jobs(self, max_attempts: int) -> List[int]:
+        """id задач с истёкшей арендой, у которых не осталось попыток"""
+        async with self._connection() as db:
+            rows = await db.execute_fetchall(
+                "SELECT id FROM generation_jobs WHERE status = 'running' AND lease_expires_at < ? AND attempts >= ?",
+                (time.time(), max_attempts),
+            )
+            return [row[0] for row in rows]
+
+    @retry_on_busy
+    async def count_generation_jobs(self) -> dict:
+        """Число задач в каждом незавершённом статусе"""
+        async with self._connection() as db:
+            rows = await db.execute_fetchall(
+                "SELECT status, COUNT(*) FROM generation_jobs WHERE status IN ('queued', 'running') GROUP BY status"
+            )
+            return {"queued": 0, "running": 0, **dict(rows)}
+
+    @retry_on_busy
+    async def get_telegram_file_id(self, digest: str) -> Optional[str]:
+        """file_id уже загруженного в Telegram файла по sha256 содержимого"""
+        async with self._connection() as db:
+            cursor = await db.execute("SELECT file_id FROM telegram_files WHERE digest = ?", (digest,))
+            row = await cursor.fetchone()
+            return row[0] if row else None
+
+    async def save_telegram_file_id(self, digest: str, file_id: str, file_unique_id: Optional[str] = None) -> None:
+        """Запомнить file_id загруженного файла (через групповой коммит)"""
+        await self._append(
+            "INSERT OR REPLACE INTO telegram_files (digest, file_id, file_unique_id) VALUES (?, ?, ?)",
+            (digest, file_id, file_unique_id),
+        )
+
+    @retry_on_busy
+    async def forget_telegram_file_id(self, digest: str) -> None:
+        """Удалить file_id, который Telegram больше не принимает"""
+        async with self._connection() as db:
+            await db.execute("DELETE FROM telegram_files WHERE digest = ?", (digest,))
+            await db.commit()
+
+    @retry_on_busy
     async def get_user_by_username(self, username: str):
         """Получить пользователя по username"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             username = username.lstrip("@")
             cursor = await db.execute(
                 "SELECT user_id, username, first_name, rubies FROM users WHERE username = ? COLLATE NOCASE",
@@ -176,29 +692,39 @@ class Database:
                 return {"user_id": result[0], "username": result[1], "first_name": result[2], "rubies": result[3]}
             return None
 
+    @retry_on_busy
     async def transfer_rubies(self, from_user_id: int, to_user_id: int, amount: int) -> bool:
         """Перевести рубины от одного пользователя другому"""
-        async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute("SELECT rubies FROM users WHERE user_id = ?", (from_user_id,))
-            result = await cursor.fetchone()
-            from_balance = result[0] if result else 0
+        # Both stripes are taken in a fixed order to avoid deadlocks between opposite transfers.
+        stripes = sorted({from_user_id % BALANCE_LOCK_STRIPES, to_user_id % BALANCE_LOCK_STRIPES})
+        async with AsyncExitStack() as stack:
+            for stripe in stripes:
+                await stack.enter_async_context(self._balance_locks[stripe])
+            db = await stack.enter_async_context(self._connection())
 
-            if from_balance < amount:
+            # Conditional UPDATE: the balance check and the debit are one atomic statement.
+            from_balance = await self._debit(db, from_user_id, amount)
+            if from_balance is None:
+                await db.rollback()
                 return False
-
-            await db.execute("UPDATE users SET rubies = rubies - ? WHERE user_id = ?", (amount, from_user_id))
-            await db.execute("UPDATE users SET rubies = rubies + ? WHERE user_id = ?", (amount, to_user_id))
-            await db.execute(
-                "INSERT INTO transfers (from_user_id, to_user_id, amount) VALUES (?, ?, ?)",
-                (from_user_id, to_user_id, amount),
-            )
+            to_balance = await self._credit(db, to_user_id, amount)
 
             await db.commit()
-            return True
+            self.users.set_rubies(from_user_id, from_balance)
+            if to_balance is not None:
+                self.users.set_rubies(to_user_id, to_balance)
+
+        # History row goes through group commit; the balances above are already durable.
+        await self._append(
+            "INSERT INTO transfers (from_user_id, to_user_id, amount) VALUES (?, ?, ?)",
+            (from_user_id, to_user_id, amount),
+        )
+        return True
 
+    @retry_on_busy
     async def get_transfer_history(self, user_id: int, limit: int = 10):
         """Получить историю переводов пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connection() as db:
             cursor = await db.execute(
                 """
                 SELECT t.id, t.from_user_id, t.to_user_id, t.amount, t.created_at,
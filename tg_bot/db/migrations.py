@@ -0,0 +1,158 @@
+"""Versioned schema migrations.
+
+Each migration runs once, in its own transaction, and is recorded in `schema_version`.
+Add new migrations to the end of MIGRATIONS with the next version number; never edit
+a migration that may already have been applied.
+"""
+
+import logging
+from typing import List, Tuple
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS: List[Tuple[int, str, List[str]]] = [
+    (
+        1,
+        "hot-path indexes",
+        [
+            "CREATE INDEX IF NOT EXISTS idx_transfers_from_user ON transfers (from_user_id, created_at)",
+            "CREATE INDEX IF NOT EXISTS idx_transfers_to_user ON transfers (to_user_id, created_at)",
+            "CREATE INDEX IF NOT EXISTS idx_generations_user ON generations (user_id, created_at)",
+            "CREATE INDEX IF NOT EXISTS idx_payments_user_status ON payments (user_id, status)",
+            "CREATE INDEX IF NOT EXISTS idx_users_username_nocase ON users (username COLLATE NOCASE)",
+        ],
+    ),
+    (
+        2,
+        "pending payments scan index",
+        [
+            "CREATE INDEX IF NOT EXISTS idx_payments_status_created ON payments (status, created_at, payment_id)",
+        ],
+    ),
+    (
+        3,
+        "telegram file_id registry",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS telegram_files (
+                digest TEXT PRIMARY KEY,
+                file_id TEXT NOT NULL,
+                file_unique_id TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+        ],
+    ),
+    (
+        4,
+        "durable generation jobs",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS generation_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                username TEXT,
+                chat_id INTEGER NOT NULL,
+                status_message_id INTEGER,
+                kind TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prompt TEXT NOT NULL,
+                cost INTEGER NOT NULL,
+                cache_key TEXT,
+                status TEXT NOT NULL DEFAULT 'queued',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                lease_owner TEXT,
+                lease_expires_at REAL,
+                enqueued_at REAL NOT NULL,
+                error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (user_id)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS generation_job_inputs (
+                job_id INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                data BLOB NOT NULL,
+                PRIMARY KEY (job_id, position)
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_generation_jobs_status ON generation_jobs (status, id)",
+        ],
+    ),
+    (
+        5,
+        "fair share of generation jobs",
+        [
+            "ALTER TABLE generation_jobs ADD COLUMN weight REAL NOT NULL DEFAULT 1",
+            "CREATE INDEX IF NOT EXISTS idx_generation_jobs_user_status ON generation_jobs (user_id, status)",
+        ],
+    ),
+    (
+        6,
+        "generation jobs priced as a cache hit",
+        ["ALTER TABLE generation_jobs ADD COLUMN cache_hit INTEGER NOT NULL DEFAULT 0"],
+    ),
+    (
+        7,
+        "time of the last credited payment on the user row",
+        [
+            "ALTER TABLE users ADD COLUMN last_paid_at REAL",
+            """
+            UPDATE users SET last_paid_at = (
+                SELECT CAST(strftime('%s', MAX(created_at)) AS REAL) FROM payments
+                WHERE payments.user_id = users.user_id AND payments.status = 'succeeded'
+            )
+            """,
+        ],
+    ),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+async def get_schema_version(db: aiosqlite.Connection) -> int:
+    cursor = await db.execute("SELECT MAX(version) FROM schema_version")
+    row = await cursor.fetchone()
+    return row[0] or 0
+
+
+async def apply_migrations(db: aiosqlite.Connection) -> int:
+    """Применить недостающие миграции. Возвращает итоговую версию схемы"""
+    await db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """
+    )
+    await db.commit()
+
+    current = await get_schema_version(db)
+    for version, description, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        # IMMEDIATE takes the write lock up front: if two starts overlap (say, an old
+        # instance still shutting down), each migration is still applied exactly once.
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            if version <= await get_schema_version(db):
+                await db.rollback()
+                continue
+            for statement in statements:
+                await db.execute(statement)
+            await db.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (version, description),
+            )
+            await db.commit()
+        except BaseException:
+            await db.rollback()
+            raise
+        logger.info(f"Применена миграция схемы БД v{version}: {description}")
+        current = version
+    return current
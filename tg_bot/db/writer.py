@@ -0,0 +1,141 @@
+"""Single background writer with group commit for append-only inserts."""
+
+import asyncio
+import logging
+import sqlite3
+import time
+from itertools import groupby
+from typing import Any, AsyncContextManager, Callable, Dict, List, Optional, Sequence, Tuple
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+FLUSH_RETRIES = 3
+
+
+class BatchWriter:
+    """Копит append-only INSERT'ы и пишет их одной транзакцией раз в N мс или каждые M строк.
+
+    История генераций и переводов не участвует в расчёте баланса, поэтому её можно
+    писать с задержкой: вместо fsync на каждую строку — один commit на пачку.
+    При остановке (stop) очередь дописывается полностью. При падении процесса теряются
+    только строки последнего окна flush_interval_ms.
+    """
+
+    def __init__(
+        self,
+        connection: Callable[[], AsyncContextManager[aiosqlite.Connection]],
+        flush_interval_ms: int,
+        max_batch: int,
+        max_queue: int = 10000,
+    ):
+        self._connection = connection
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch = max(1, max_batch)
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._task: Optional[asyncio.Task] = None
+        self.rows_written = 0
+        self.batches = 0
+        self.rows_dropped = 0
+        self.last_flush_ms = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if not self.running:
+            self._task = asyncio.create_task(self._run(), name="db-batch-writer")
+
+    async def stop(self) -> None:
+        """Дописать всё из очереди и остановить писателя"""
+        if not self.running:
+            return
+        await self._queue.put(_STOP)
+        await self._task
+        self._task = None
+
+    async def flush(self) -> None:
+        """Дождаться записи всего, что уже поставлено в очередь"""
+        if self.running:
+            await self._queue.join()
+
+    async def submit(self, sql: str, params: Sequence[Any]) -> None:
+        """Поставить INSERT в очередь (ждёт только если очередь переполнена)"""
+        await self._queue.put((sql, tuple(params)))
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                break
+            batch = [item]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is _STOP:
+                    self._queue.task_done()
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+        # Durable shutdown: nothing submitted before stop() is left behind.
+        rest = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            self._queue.task_done()
+            if item is not _STOP:
+                rest.append(item)
+        for start in range(0, len(rest), self.max_batch):
+            await self._flush(rest[start : start + self.max_batch])
+
+    async def _flush(self, batch: List[Tuple[str, tuple]]) -> None:
+        for attempt in range(FLUSH_RETRIES):
+            started = time.perf_counter()
+            try:
+                async with self._connection() as db:
+                    for sql, rows in groupby(batch, key=lambda item: item[0]):
+                        await db.executemany(sql, [params for _, params in rows])
+                    await db.commit()
+            except sqlite3.OperationalError as e:
+                logger.warning(f"Batch writer flush failed ({e}), attempt {attempt + 1}/{FLUSH_RETRIES}")
+                await asyncio.sleep(0.05 * (2**attempt))
+                continue
+            except Exception as e:
+                logger.error(f"Batch writer dropped {len(batch)} rows: {e}", exc_info=True)
+                self.rows_dropped += len(batch)
+                return
+            self.last_flush_ms = round((time.perf_counter() - started) * 1000, 2)
+            self.rows_written += len(batch)
+            self.batches += 1
+            return
+        logger.error(f"Batch writer dropped {len(batch)} rows after {FLUSH_RETRIES} attempts")
+        self.rows_dropped += len(batch)
+
+    def stats(self) -> Dict:
+        return {
+            "running": self.running,
+            "queued": self._queue.qsize(),
+            "rows_written": self.rows_written,
+            "batches": self.batches,
+            "avg_batch": round(self.rows_written / self.batches, 1) if self.batches else 0.0,
+            "rows_dropped": self.rows_dropped,
+            "last_flush_ms": self.last_flush_ms,
+        }
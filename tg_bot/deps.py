@@ -1,37 +1,71 @@
 from __future__ import annotations
 
-from typing import Any, Dict, TypedDict
+from typing import TypedDict
 
 from telegram import Update
 from telegram.ext import ContextTypes
 
+from tg_bot.clients.downloader import ImageDownloader
 from tg_bot.clients.openrouter_client import OpenRouterClient
+from tg_bot.clients.resilience import ResilientCaller
 from tg_bot.db.database import Database
+from tg_bot.file_registry import FileRegistry
+from tg_bot.images import ImagePreprocessor
 from tg_bot.models.models_manager import ModelsManager
 from tg_bot.payments.yookassa_payment import YooKassaPayment
+from tg_bot.pending_inputs import PendingInputStore
+from tg_bot.result_cache import ResultCache
+from tg_bot.services.admission import AdmissionController
+from tg_bot.services.albums import AlbumAggregator
+from tg_bot.services.jobs import GenerationWorkerPool
+from tg_bot.services.single_flight import SingleFlight
+from tg_bot.services.reconciler import PaymentReconciler
 
-from tg_bot.logging_setup import setup_logging
+from tg_bot.logging_setup import InteractionLogger, setup_logging
 
 
 class BotDeps(TypedDict):
     db: Database
     openrouter: OpenRouterClient
+    downloader: ImageDownloader
+    image_preprocessor: ImagePreprocessor
     yookassa: YooKassaPayment
     models_manager: ModelsManager
-    interaction_logger: Any
-    media_groups: Dict[str, Any]
+    interaction_logger: InteractionLogger
+    payment_reconciler: PaymentReconciler
+    pending_inputs: PendingInputStore
+    albums: AlbumAggregator
+    result_cache: ResultCache
+    file_registry: FileRegistry
+    admission: AdmissionController
+    generation_workers: GenerationWorkerPool
+    single_flight: SingleFlight
 
 
 def init_deps() -> BotDeps:
     """Create singleton dependencies for the bot runtime."""
     interaction_logger = setup_logging()
+    db = Database()
+    models_manager = ModelsManager()
+    admission = AdmissionController(models_manager)
     return {
-        "db": Database(),
-        "openrouter": OpenRouterClient(),
+        "db": db,
+        # Hedging reads the same per-model latency that routes the "auto" model.
+        "openrouter": OpenRouterClient(resilience=ResilientCaller(health=models_manager.health)),
+        "downloader": ImageDownloader(),
+        "image_preprocessor": ImagePreprocessor(),
         "yookassa": YooKassaPayment(),
-        "models_manager": ModelsManager(),
+        "models_manager": models_manager,
         "interaction_logger": interaction_logger,
-        "media_groups": {},
+        "payment_reconciler": PaymentReconciler(),
+        "pending_inputs": PendingInputStore(),
+        "albums": AlbumAggregator(),
+        "result_cache": ResultCache(),
+        "file_registry": FileRegistry(db),
+        "admission": admission,
+        # Jobs of a model with a full admission queue stay queued instead of taking a worker.
+        "generation_workers": GenerationWorkerPool(db, skip_models=admission.full_models),
+        "single_flight": SingleFlight(),
     }
 
 
@@ -0,0 +1,133 @@
+"""Registry of files already known to Telegram: reuse file_id instead of re-uploading."""
+
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import BinaryIO, Dict, Optional, Tuple
+
+from telegram.error import BadRequest
+
+from tg_bot.core.config import FILE_REGISTRY_CACHE_SIZE, FILE_REGISTRY_INPUT_BYTES
+
+logger = logging.getLogger(__name__)
+
+
+def file_digest(source: BinaryIO) -> str:
+    """sha256 содержимого файлового объекта; позиция возвращается в начало"""
+    source.seek(0)
+    try:
+        # BytesIO is hashed through getbuffer() without a copy, other files in chunks.
+        return hashlib.file_digest(source, "sha256").hexdigest()
+    finally:
+        source.seek(0)
+
+
+class FileRegistry:
+    """Соответствия содержимого и файлов Telegram.
+
+    Отправленные результаты: sha256 содержимого -> file_id (SQLite + LRU на cache_size
+    записей), повторная отправка того же изображения идёт по file_id без загрузки.
+    Входные фото: file_unique_id и максимальная сторона -> подготовленные байты (LRU в
+    пределах input_budget байт), повторное фото не скачивается и не обрабатывается заново.
+    """
+
+    def __init__(self, db, cache_size: int = FILE_REGISTRY_CACHE_SIZE, input_budget: int = FILE_REGISTRY_INPUT_BYTES):
+        self.db = db
+        self.cache_size = max(0, cache_size)
+        self.input_budget = max(0, input_budget)
+        self._file_ids: "OrderedDict[str, str]" = OrderedDict()
+        self._inputs: "OrderedDict[Tuple[str, int], bytes]" = OrderedDict()
+        self.input_bytes = 0
+        self.uploads = 0
+        self.reused = 0
+        self.stale = 0
+        self.input_hits = 0
+        self.input_misses = 0
+
+    def _remember_file_id(self, digest: str, file_id: str) -> None:
+        if not self.cache_size:
+            return
+        self._file_ids[digest] = file_id
+        self._file_ids.move_to_end(digest)
+        while len(self._file_ids) > self.cache_size:
+            self._file_ids.popitem(last=False)
+
+    async def file_id_for(self, digest: str) -> Optional[str]:
+        """file_id ранее загруженного изображения с таким содержимым или None"""
+        file_id = self._file_ids.get(digest)
+        if file_id is not None:
+            self._file_ids.move_to_end(digest)
+            return file_id
+        file_id = await self.db.get_telegram_file_id(digest)
+        if file_id is not None:
+            self._remember_file_id(digest, file_id)
+        return file_id
+
+    async def remember(self, digest: str, message) -> None:
+        """Запомнить file_id фото из отправленного сообщения"""
+        photos = getattr(message, "photo", None)
+        if not photos:
+            return
+        largest = photos[-1]
+        self._remember_file_id(digest, largest.file_id)
+        await self.db.save_telegram_file_id(digest, largest.file_id, largest.file_unique_id)
+
+    async def forget(self, digest: str) -> None:
+        self._file_ids.pop(digest, None)
+        await self.db.forget_telegram_file_id(digest)
+
+    async def send_photo(self, bot, chat_id: int, image: BinaryIO, **kwargs):
+        """Отправить фото: по file_id, если такое содержимое уже загружалось, иначе загрузкой"""
+        digest = await asyncio.to_thread(file_digest, image)
+        file_id = await self.file_id_for(digest)
+        if file_id is not None:
+            try:
+                sent = await bot.send_photo(chat_id, photo=file_id, **kwargs)
+                self.reused += 1
+                return sent
+            except BadRequest as e:
+                # E.g. the bot token changed: file_ids of another bot are not valid.
+                logger.warning(f"file_id для {digest} не принят Telegram ({e}), загружаем заново")
+                self.stale += 1
+                await self.forget(digest)
+        sent = await bot.send_photo(chat_id, photo=image, **kwargs)
+        self.uploads += 1
+        await self.remember(digest, sent)
+        return sent
+
+    def get_input(self, file_unique_id: str, max_side: int) -> Optional[bytes]:
+        """Подготовленное входное фото, если оно уже скачивалось"""
+        key = (file_unique_id, max_side)
+        data = self._inputs.get(key)
+        if data is None:
+            self.input_misses += 1
+            return None
+        self._inputs.move_to_end(key)
+        self.input_hits += 1
+        return data
+
+    def put_input(self, file_unique_id: str, max_side: int, data: bytes) -> None:
+        if len(data) > self.input_budget:
+            return
+        key = (file_unique_id, max_side)
+        previous = self._inputs.pop(key, None)
+        if previous is not None:
+            self.input_bytes -= len(previous)
+        self._inputs[key] = data
+        self.input_bytes += len(data)
+        while self.input_bytes > self.input_budget:
+            _, evicted = self._inputs.popitem(last=False)
+            self.input_bytes -= len(evicted)
+
+    def stats(self) -> Dict:
+        return {
+            "file_ids_cached": len(self._file_ids),
+            "uploads": self.uploads,
+            "reused": self.reused,
+            "stale": self.stale,
+            "inputs_cached": len(self._inputs),
+            "input_bytes": self.input_bytes,
+            "input_hits": self.input_hits,
+            "input_misses": self.input_misses,
+        }
@@ -0,0 +1,42 @@
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from tg_bot.core.config import ADMIN_USER_IDS
+from tg_bot.deps import deps_from_context
+
+
+def _format_section(title: str, stats: dict) -> str:
+    lines = [f"▫️ {title}"]
+    lines.extend(f"   {key}: {value}" for key, value in stats.items())
+    return "\n".join(lines)
+
+
+def collect_stats(d) -> list:
+    """Собрать метрики компонентов: список (заголовок, dict)."""
+    return [
+        ("Кэш пользователей", d["db"].users.stats()),
+        ("Групповая запись в БД", d["db"].writer.stats()),
+        ("Альбомы", d["albums"].stats()),
+        ("Фото в ожидании промпта", d["pending_inputs"].stats()),
+        ("Предобработка фото", d["image_preprocessor"].stats()),
+        ("OpenRouter", d["openrouter"].stats()),
+        ("Скачивание результатов", d["downloader"].stats()),
+        ("Кэш результатов", d["result_cache"].stats()),
+        ("Файлы Telegram", d["file_registry"].stats()),
+        ("Очередь генераций", d["generation_workers"].stats()),
+        ("Объединение одинаковых запросов", d["single_flight"].stats()),
+        ("Сверка платежей", d["payment_reconciler"].stats()),
+        *((f"Очередь модели {model}", stats) for model, stats in d["admission"].stats().items()),
+        *((f"Модель {model}", stats) for model, stats in d["models_manager"].health_stats().items()),
+    ]
+
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /stats - внутренние метрики бота (только для администраторов)."""
+    user = update.effective_user
+    if not user or user.id not in ADMIN_USER_IDS:
+        return
+
+    d = deps_from_context(context)
+    sections = [_format_section(title, stats) for title, stats in collect_stats(d)]
+    await update.message.reply_text("📊 Статистика\n\n" + "\n\n".join(sections))
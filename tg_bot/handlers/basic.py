@@ -20,9 +20,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     interaction_logger = d["interaction_logger"]
 
     user = update.effective_user
-    interaction_logger.info(
-        f"USER: @{user.username or 'не указан'} (ID: {user.id}) | COMMAND: /start | NAME: {user.first_name}"
-    )
+    interaction_logger.event(user, "command", command="/start", name=user.first_name)
 
     await ensure_user(update, context)
     rubies = await db.get_user_rubies(user.id)
@@ -56,7 +54,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     interaction_logger = d["interaction_logger"]
 
     user = update.effective_user
-    interaction_logger.info(f"USER: @{user.username or 'не указан'} (ID: {user.id}) | COMMAND: /help")
+    interaction_logger.event(user, "command", command="/help")
 
     help_text = """
 📖 Справка по боту:
@@ -92,7 +90,7 @@ async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     interaction_logger = d["interaction_logger"]
 
     user = update.effective_user
-    interaction_logger.info(f"USER: @{user.username or 'не указан'} (ID: {user.id}) | COMMAND: /profile")
+    interaction_logger.event(user, "command", command="/profile")
 
     user_data = await db.get_or_create_user(
         user_id=user.id,
@@ -140,7 +138,7 @@ async def feedback_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     interaction_logger = d["interaction_logger"]
 
     user = update.effective_user
-    interaction_logger.info(f"USER: @{user.username or 'не указан'} (ID: {user.id}) | COMMAND: /feedback")
+    interaction_logger.event(user, "command", command="/feedback")
 
     text = """
 💡 Совет для улучшения бота
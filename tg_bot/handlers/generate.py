@@ -1,19 +1,19 @@
-import asyncio
-import io
 import logging
 
-import aiohttp
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes
 
 from tg_bot.core.config import RUBY_PRICE
 from tg_bot.deps import deps_from_context, ensure_user
+from tg_bot.images import pick_photo_size
 from tg_bot.keyboards import get_main_menu_keyboard
-from tg_bot.services.generation import process_image_generation, process_images_generation
+from tg_bot.services.generation import (
+    process_image_generation,
+    process_images_generation,
+    process_text_generation,
+)
 from tg_bot.services.models import get_user_selected_model
 from tg_bot.state import (
-    INPUT_IMAGE,
-    INPUT_IMAGES,
     WAITING_FOR_FEEDBACK,
     WAITING_FOR_IMAGE_PROMPT,
     WAITING_FOR_IMAGES_PROMPT,
@@ -34,7 +34,7 @@ async def generate_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     interaction_logger = d["interaction_logger"]
 
     user = update.effective_user
-    interaction_logger.info(f"USER: @{user.username or 'не указан'} (ID: {user.id}) | COMMAND: /generate")
+    interaction_logger.event(user, "command", command="/generate")
 
     default_model = models_manager.get_default_model()
     model_info = ""
@@ -63,28 +63,27 @@ async def generate_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(text, reply_markup=get_main_menu_keyboard())
 
 
-async def handle_media_group(group_data):
-    """Обработка группы фото (альбома)."""
-    photos = group_data["photos"]
-    caption = group_data["caption"]
-    user_id = group_data["user_id"]
-    update = group_data["update"]
-    context = group_data["context"]
+async def handle_media_group(update: Update, context: ContextTypes.DEFAULT_TYPE, photos: list, caption: str = None):
+    """Обработка собранного альбома (вызывается AlbumAggregator)."""
     user = update.effective_user
 
-    context.user_data[INPUT_IMAGES] = photos
-    context.user_data[WAITING_FOR_IMAGES_PROMPT] = True
-
     d = deps_from_context(context)
     interaction_logger = d["interaction_logger"]
-    interaction_logger.info(
-        f"USER: @{user.username or 'не указан'} (ID: {user_id}) | ACTION: media_group_uploaded | COUNT: {len(photos)}"
-    )
+    interaction_logger.event(user, "media_group_uploaded", count=len(photos))
+
+    if not photos:
+        await update.message.reply_text(
+            "❌ Не удалось загрузить фото. Пожалуйста, отправьте альбом заново.",
+            reply_markup=get_main_menu_keyboard(),
+        )
+        return
 
     if caption:
-        context.user_data[WAITING_FOR_IMAGES_PROMPT] = False
         await process_images_generation(update, context, caption, photos)
     else:
+        await d["pending_inputs"].put(user.id, photos)
+        context.user_data[WAITING_FOR_IMAGES_PROMPT] = True
+        context.user_data[WAITING_FOR_IMAGE_PROMPT] = False
         await update.message.reply_text(
             f"📸 Получено {len(photos)} фото! Теперь отправьте описание того, что вы хотите сделать.\n\n"
             f"Примеры:\n"
@@ -95,73 +94,78 @@ async def handle_media_group(group_data):
         )
 
 
+async def _download_photo(d, photo, max_side: int):
+    """Скачать PhotoSize и подготовить его для модели (то же фото повторно не скачивается)."""
+    file_registry = d["file_registry"]
+    prepared = file_registry.get_input(photo.file_unique_id, max_side)
+    if prepared is not None:
+        return prepared
+    photo_file = await photo.get_file()
+    prepared = await d["image_preprocessor"].prepare(await photo_file.download_as_bytearray(), max_side)
+    file_registry.put_input(photo.file_unique_id, max_side, prepared)
+    return prepared
+
+
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик фотографий для генерации на основе изображения."""
     d = deps_from_context(context)
     db = d["db"]
-    media_groups = d["media_groups"]
+    albums = d["albums"]
     interaction_logger = d["interaction_logger"]
 
     user = update.effective_user
     media_group_id = update.message.media_group_id
+    caption = update.message.caption if update.message.caption else None
 
-    await ensure_user(update, context)
+    # Later photos of an album skip the user/balance checks: they were done for the first one.
+    if not (media_group_id and albums.is_known(media_group_id)):
+        await ensure_user(update, context)
 
-    selected_model = get_user_selected_model(context)
-    generation_cost = selected_model["price_rubies"] if selected_model else 2
+        selected_model = get_user_selected_model(context)
+        generation_cost = selected_model["price_rubies"] if selected_model else 2
 
-    rubies = await db.get_user_rubies(user.id)
-    if rubies < generation_cost:
-        interaction_logger.info(
-            f"USER: @{user.username or 'не указан'} (ID: {user.id}) | ACTION: photo_upload | STATUS: insufficient_balance"
-        )
-        await update.message.reply_text(
-            f"❌ Недостаточно рубинов для генерации!\n\n"
-            f"Текущий баланс: {rubies} 💎\n"
-            f"Требуется: {generation_cost} 💎\n\n",
-            reply_markup=get_main_menu_keyboard(),
-        )
-        return
+        rubies = await db.get_user_rubies(user.id)
+        if rubies < generation_cost:
+            interaction_logger.event(user, "photo_upload", status="insufficient_balance", rubies=rubies)
+            if media_group_id:
+                albums.reject(media_group_id, user.id)
+            await update.message.reply_text(
+                f"❌ Недостаточно рубинов для генерации!\n\n"
+                f"Текущий баланс: {rubies} 💎\n"
+                f"Требуется: {generation_cost} 💎\n\n",
+                reply_markup=get_main_menu_keyboard(),
+            )
+            return
+    else:
+        selected_model = get_user_selected_model(context)
 
-    photo = update.message.photo[-1]
-    photo_file = await photo.get_file()
-    photo_bytes = await photo_file.download_as_bytearray()
-    caption = update.message.caption if update.message.caption else None
+    # The smallest size that still covers the model's input limit: less to download and resize.
+    max_side = d["models_manager"].get_max_input_side(selected_model["openrouter_name"])
+    photo = pick_photo_size(update.message.photo, max_side)
 
     if media_group_id:
-        if media_group_id not in media_groups:
-            media_groups[media_group_id] = {
-                "photos": [],
-                "caption": caption,
-                "user_id": user.id,
-                "update": update,
-                "context": context,
-            }
-
-        media_groups[media_group_id]["photos"].append(bytes(photo_bytes))
-
-        if "timer" in media_groups[media_group_id]:
-            media_groups[media_group_id]["timer"].cancel()
-
-        async def process_media_group():
-            await asyncio.sleep(2)
-            if media_group_id in media_groups:
-                group_data = media_groups.pop(media_group_id)
-                await handle_media_group(group_data)
-
-        task = asyncio.create_task(process_media_group())
-        media_groups[media_group_id]["timer"] = task
+        # Download runs in the background so the next photo of the album is handled right away.
+        albums.add(
+            media_group_id,
+            update,
+            context,
+            lambda: _download_photo(d, photo, max_side),
+            handle_media_group,
+            caption=caption,
+        )
         return
 
-    context.user_data[INPUT_IMAGE] = bytes(photo_bytes)
-    context.user_data[WAITING_FOR_IMAGE_PROMPT] = True
-    interaction_logger.info(f"USER: @{user.username or 'не указан'} (ID: {user.id}) | ACTION: photo_uploaded")
+    photo_bytes = await _download_photo(d, photo, max_side)
+    interaction_logger.event(user, "photo_uploaded")
 
     if caption:
-        context.user_data[WAITING_FOR_IMAGE_PROMPT] = False
-        await process_image_generation(update, context, caption, bytes(photo_bytes))
+        await process_image_generation(update, context, caption, photo_bytes)
         return
 
+    await d["pending_inputs"].put(user.id, [photo_bytes])
+    context.user_data[WAITING_FOR_IMAGE_PROMPT] = True
+    context.user_data[WAITING_FOR_IMAGES_PROMPT] = False
+
     await update.message.reply_text(
         "📸 Фото получено! Теперь отправьте описание того, как вы хотите изменить это изображение.\n\n"
         "Примеры:\n"
@@ -176,7 +180,6 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик текстовых сообщений для генерации изображений и покупки рубинов."""
     d = deps_from_context(context)
     db = d["db"]
-    openrouter = d["openrouter"]
     yookassa = d["yookassa"]
     interaction_logger = d["interaction_logger"]
 
@@ -218,10 +221,9 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Ожидаем промпт для нескольких изображений
     if context.user_data.get(WAITING_FOR_IMAGES_PROMPT):
         context.user_data[WAITING_FOR_IMAGES_PROMPT] = False
-        input_images = context.user_data.get(INPUT_IMAGES)
+        input_images = await d["pending_inputs"].take(user.id)
         if input_images:
             await process_images_generation(update, context, text, input_images)
-            context.user_data.pop(INPUT_IMAGES, None)
         else:
             await update.message.reply_text(
                 "❌ Изображения не найдены. Пожалуйста, загрузите фото заново.",
@@ -232,10 +234,9 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Ожидаем промпт для одного изображения
     if context.user_data.get(WAITING_FOR_IMAGE_PROMPT):
         context.user_data[WAITING_FOR_IMAGE_PROMPT] = False
-        input_image = context.user_data.get(INPUT_IMAGE)
-        if input_image:
-            await process_image_generation(update, context, text, input_image)
-            context.user_data.pop(INPUT_IMAGE, None)
+        input_images = await d["pending_inputs"].take(user.id)
+        if input_images:
+            await process_image_generation(update, context, text, input_images[0])
         else:
             await update.message.reply_text(
                 "❌ Изображение не найдено. Пожалуйста, загрузите фото заново.",
@@ -246,7 +247,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Ожидаем отзыв
     if context.user_data.get(WAITING_FOR_FEEDBACK):
         context.user_data[WAITING_FOR_FEEDBACK] = False
-        interaction_logger.info(f"USER: @{user.username or 'не указан'} (ID: {user.id}) | FEEDBACK: {text[:100]}...")
+        interaction_logger.event(user, "feedback", text=text)
 
         success = await save_feedback_to_jsonl(username=user.username, text=text, user_id=user.id)
         if success:
@@ -268,12 +269,10 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return
 
             amount = rubies_count * RUBY_PRICE
-            interaction_logger.info(
-                f"USER: @{user.username or 'не указан'} (ID: {user.id}) | ACTION: buy_rubies | COUNT: {rubies_count} | AMOUNT: {amount:.2f} руб."
-            )
+            interaction_logger.event(user, "buy_rubies", count=rubies_count, amount=round(amount, 2))
 
             try:
-                payment_info = yookassa.create_payment(amount=amount, user_id=user.id, rubies=rubies_count)
+                payment_info = await yookassa.create_payment(amount=amount, user_id=user.id, rubies=rubies_count)
                 await db.create_payment(
                     payment_id=payment_info["payment_id"],
                     user_id=user.id,
@@ -309,71 +308,4 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             context.user_data[WAITING_FOR_RUBIES] = False
 
     # Обычная генерация по тексту
-    prompt = text
-    interaction_logger.info(
-        f"USER: @{user.username or 'не указан'} (ID: {user.id}) | ACTION: generate_image | PROMPT: {text[:100]}..."
-    )
-
-    selected_model = get_user_selected_model(context)
-    generation_cost = selected_model["price_rubies"] if selected_model else 2
-
-    rubies = await db.get_user_rubies(user.id)
-    if rubies < generation_cost:
-        interaction_logger.info(
-            f"USER: @{user.username or 'не указан'} (ID: {user.id}) | ACTION: generate_image | STATUS: insufficient_balance | RUBIES: {rubies}"
-        )
-        await update.message.reply_text(
-            f"❌ Недостаточно рубинов!\n\n"
-            f"Текущий баланс: {rubies} 💎\n"
-            f"Требуется: {generation_cost} 💎\n\n"
-        )
-        return
-
-    status_message = await update.message.reply_text("⏳ Генерирую изображение... Это может занять некоторое время.")
-
-    try:
-        image_url = await openrouter.generate_image(prompt, model=selected_model["openrouter_name"])
-        if not image_url:
-            await status_message.edit_text("❌ Ошибка при генерации изображения. Попробуйте еще раз.")
-            return
-
-        image_data = None
-        if image_url.startswith("data:image"):
-            image_data = openrouter.decode_base64_image(image_url)
-        elif image_url.startswith("http"):
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(image_url) as resp:
-                        if resp.status == 200:
-                            image_data = await resp.read()
-            except Exception as e:
-                logger.error(f"Error downloading image: {e}")
-
-        if not image_data:
-            await status_message.edit_text("❌ Не удалось обработать изображение. Попробуйте еще раз.")
-            return
-
-        success = await db.deduct_rubies(user.id, generation_cost)
-        if not success:
-            await status_message.edit_text("❌ Ошибка при списании рубинов")
-            return
-
-        await db.log_generation(user.id, prompt, generation_cost)
-        interaction_logger.info(
-            f"USER: @{user.username or 'не указан'} (ID: {user.id}) | ACTION: image_generated | COST: {generation_cost} rubies | SUCCESS"
-        )
-
-        await status_message.delete()
-        short_prompt = prompt[:150] + "..." if len(prompt) > 150 else prompt
-        await update.message.reply_photo(
-            photo=io.BytesIO(image_data),
-            caption=f"🎨 Сгенерировано по запросу: {short_prompt}\n\n💎 Потрачено: {generation_cost} рубина",
-        )
-
-        new_rubies = await db.get_user_rubies(user.id)
-        await update.message.reply_text(f"💎 Остаток рубинов: {new_rubies}")
-
-    except Exception as e:
-        logger.error(f"Error in handle_message: {e}")
-        await status_message.edit_text("❌ Произошла ошибка при генерации изображения. Попробуйте позже.")
-
+    await process_text_generation(update, context, text)
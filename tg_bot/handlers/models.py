@@ -2,6 +2,7 @@ from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes
 
 from tg_bot.deps import deps_from_context, ensure_user
+from tg_bot.models.models_manager import price_label
 from tg_bot.state import SELECTED_MODEL
 
 
@@ -12,7 +13,7 @@ async def models_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     interaction_logger = d["interaction_logger"]
 
     user = update.effective_user
-    interaction_logger.info(f"USER: @{user.username or 'не указан'} (ID: {user.id}) | COMMAND: /models")
+    interaction_logger.event(user, "command", command="/models")
 
     await ensure_user(update, context)
 
@@ -30,9 +31,10 @@ async def models_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         models_text += f"{icon} **{model['display_name']}**\n"
         models_text += f"   {model['description']}\n"
-        models_text += f"   💎 Цена: {model['price_rubies']} рубин{'ов' if model['price_rubies'] > 1 else ''}\n\n"
+        models_text += f"   💎 Цена: {price_label(model)}\n\n"
 
-        button_text = f"{'✅' if is_current else '⚪'} {model['display_name']} - {model['price_rubies']} 💎"
+        price = f"до {model['price_rubies']}" if model.get("auto") else model["price_rubies"]
+        button_text = f"{'✅' if is_current else '⚪'} {model['display_name']} - {price} 💎"
         keyboard.append(
             [
                 InlineKeyboardButton(
@@ -63,14 +65,12 @@ async def select_model_callback(update: Update, context: ContextTypes.DEFAULT_TY
     if model:
         context.user_data[SELECTED_MODEL] = model_name
 
-        interaction_logger.info(
-            f"USER: @{user.username or 'не указан'} (ID: {user.id}) | ACTION: select_model | MODEL: {model['display_name']}"
-        )
+        interaction_logger.event(user, "select_model", model=model["openrouter_name"])
 
         await query.edit_message_text(
             f"✅ Выбрана модель: **{model['display_name']}**\n\n"
             f"📝 {model['description']}\n\n"
-            f"💎 Цена генерации: {model['price_rubies']} рубин{'ов' if model['price_rubies'] > 1 else ''}\n\n"
+            f"💎 Цена генерации: {price_label(model)}\n\n"
             f"Теперь все ваши генерации будут использовать эту модель.",
             parse_mode="Markdown",
         )
@@ -3,8 +3,9 @@ import logging
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import ContextTypes
 
-from tg_bot.core.config import RUBY_PRICE
+from tg_bot.core.config import RUBY_PRICE, YOOKASSA_WEBHOOK_ENABLED
 from tg_bot.deps import deps_from_context, ensure_user
+from tg_bot.services.payments import apply_provider_status, payment_success_text
 
 logger = logging.getLogger(__name__)
 
@@ -15,7 +16,7 @@ async def buy_rubies(update: Update, context: ContextTypes.DEFAULT_TYPE):
     interaction_logger = d["interaction_logger"]
 
     user = update.effective_user
-    interaction_logger.info(f"USER: @{user.username or 'не указан'} (ID: {user.id}) | COMMAND: /buy")
+    interaction_logger.event(user, "command", command="/buy")
 
     text = f"""
 💎 Пополнение баланса рубинов
@@ -51,7 +52,7 @@ async def buy_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     user = update.effective_user
     data = query.data
-    interaction_logger.info(f"USER: @{user.username or 'не указан'} (ID: {user.id}) | CALLBACK: {data}")
+    interaction_logger.event(user, "callback", data=data)
 
     await ensure_user(update, context)
 
@@ -68,7 +69,7 @@ async def buy_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     amount = rubies_count * RUBY_PRICE
 
     try:
-        payment_info = yookassa.create_payment(amount=amount, user_id=user.id, rubies=rubies_count)
+        payment_info = await yookassa.create_payment(amount=amount, user_id=user.id, rubies=rubies_count)
 
         await db.create_payment(
             payment_id=payment_info["payment_id"],
@@ -114,9 +115,7 @@ async def check_payment_callback(update: Update, context: ContextTypes.DEFAULT_T
 
     user = update.effective_user
     payment_id = query.data.replace("check_", "")
-    interaction_logger.info(
-        f"USER: @{user.username or 'не указан'} (ID: {user.id}) | CALLBACK: check_payment | PAYMENT_ID: {payment_id}"
-    )
+    interaction_logger.event(user, "check_payment", payment_id=payment_id)
 
     await ensure_user(update, context)
 
@@ -125,24 +124,28 @@ async def check_payment_callback(update: Update, context: ContextTypes.DEFAULT_T
         await query.edit_message_text("❌ Платеж не найден")
         return
 
-    yookassa_status = yookassa.check_payment_status(payment_id)
-
-    if yookassa_status and yookassa_status["paid"]:
-        if payment_data["status"] != "succeeded":
-            await db.add_rubies(payment_data["user_id"], payment_data["rubies"])
-            await db.update_payment_status(payment_id, "succeeded")
+    # Credits arrive through the YooKassa notification; the button only reads the DB.
+    if payment_data["status"] == "succeeded":
+        await query.edit_message_text("✅ Платеж уже был обработан ранее")
+        return
+    if payment_data["status"] == "canceled":
+        await query.edit_message_text("❌ Платеж отменен. Создайте новый через /buy")
+        return
 
-            rubies = await db.get_user_rubies(payment_data["user_id"])
-            await query.edit_message_text(
-                f"✅ Платеж успешно обработан!\n\n"
-                f"Начислено: {payment_data['rubies']} 💎\n"
-                f"Текущий баланс: {rubies} 💎"
-            )
-        else:
+    if not YOOKASSA_WEBHOOK_ENABLED:
+        yookassa_status = await yookassa.check_payment_status(payment_id)
+        result = await apply_provider_status(d, payment_id, yookassa_status)
+        if result["result"] == "credited":
+            await query.edit_message_text(payment_success_text(result["rubies"], result["balance"]))
+            return
+        if result["result"] == "already_processed":
             await query.edit_message_text("✅ Платеж уже был обработан ранее")
-    else:
-        await query.edit_message_text(
-            "⏳ Платеж еще не обработан. Попробуйте проверить позже.\n\n"
-            "Или нажмите кнопку 'Проверить оплату' еще раз."
-        )
-
+            return
+        if result["result"] == "canceled":
+            await query.edit_message_text("❌ Платеж отменен. Создайте новый через /buy")
+            return
+
+    await query.edit_message_text(
+        "⏳ Платеж еще не обработан. Попробуйте проверить позже.\n\n"
+        "Или нажмите кнопку 'Проверить оплату' еще раз."
+    )
@@ -15,7 +15,7 @@ async def send_rubies(update: Update, context: ContextTypes.DEFAULT_TYPE):
     interaction_logger = d["interaction_logger"]
 
     user = update.effective_user
-    interaction_logger.info(f"USER: @{user.username or 'не указан'} (ID: {user.id}) | COMMAND: /send")
+    interaction_logger.event(user, "command", command="/send")
 
     await ensure_user(update, context)
 
@@ -74,10 +74,8 @@ async def send_rubies(update: Update, context: ContextTypes.DEFAULT_TYPE):
     recipient_new_balance = await db.get_user_rubies(recipient["user_id"])
     recipient_name = f"@{recipient['username']}" if recipient["username"] else recipient["first_name"]
 
-    interaction_logger.info(
-        f"USER: @{user.username or 'не указан'} (ID: {user.id}) | "
-        f"ACTION: transfer_rubies | TO: @{recipient['username']} (ID: {recipient['user_id']}) | "
-        f"AMOUNT: {amount}"
+    interaction_logger.event(
+        user, "transfer_rubies", to_user_id=recipient["user_id"], to_username=recipient["username"], amount=amount
     )
 
     await update.message.reply_text(
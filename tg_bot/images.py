@@ -0,0 +1,128 @@
+"""Input photo preprocessing: size selection, MIME sniffing, downscaling in a process pool."""
+
+import asyncio
+import io
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Sequence
+
+from tg_bot.core.config import IMAGE_JPEG_QUALITY, IMAGE_PREPROCESS_WORKERS
+
+try:
+    from PIL import Image, ImageOps  # type: ignore
+except Exception:  # pragma: no cover
+    # Pillow is optional: without it photos are forwarded unchanged.
+    Image = ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+
+def sniff_mime(data) -> str:
+    """MIME-тип изображения по сигнатуре (по умолчанию image/jpeg)"""
+    head = bytes(memoryview(data)[:12])
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return "image/gif"
+    return "image/jpeg"
+
+
+def pick_photo_size(photos: Sequence, max_side: int):
+    """Наименьший из размеров PhotoSize, у которого длинная сторона не меньше max_side.
+
+    Если такого нет — самый большой. Telegram отдаёт размеры по возрастанию.
+    """
+    ordered = sorted(photos, key=lambda p: max(p.width, p.height))
+    for photo in ordered:
+        if max(photo.width, photo.height) >= max_side:
+            return photo
+    return ordered[-1]
+
+
+def preprocess_image(data: bytes, max_side: int, quality: int = IMAGE_JPEG_QUALITY) -> bytes:
+    """Уменьшить до max_side и перекодировать без метаданных (JPEG, с прозрачностью — PNG).
+
+    Выполняется в процессе пула. Поворот из EXIF применяется до удаления метаданных.
+    Если перекодирование без уменьшения дало файл больше исходного, остаётся исходный.
+    """
+    if Image is None:
+        return data
+    try:
+        with Image.open(io.BytesIO(data)) as source:
+            image = ImageOps.exif_transpose(source)
+            resized = max(image.size) > max_side
+            if resized:
+                image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+            out = io.BytesIO()
+            has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+            if has_alpha:
+                image.save(out, format="PNG", optimize=True)
+            else:
+                if image.mode != "RGB":
+                    image = image.convert("RGB")
+                image.save(out, format="JPEG", quality=quality, optimize=True)
+    except Exception as e:
+        logger.warning(f"Не удалось обработать изображение, отправляем как есть: {e}")
+        return data
+
+    if not resized and out.getbuffer().nbytes >= len(data):
+        return data
+    return out.getvalue()
+
+
+class ImagePreprocessor:
+    """Предобработка входных фото в ProcessPoolExecutor (CPU-работа не держит event loop).
+
+    Пул создаётся при первом вызове; без Pillow или при workers=0 байты возвращаются как есть.
+    """
+
+    def __init__(self, workers: int = IMAGE_PREPROCESS_WORKERS, quality: int = IMAGE_JPEG_QUALITY):
+        self.workers = workers
+        self.quality = quality
+        self.enabled = Image is not None and workers > 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._count = 0
+        self._bytes_in = 0
+        self._bytes_out = 0
+        self._total_ms = 0.0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: forking a process that runs aiosqlite/logging threads is unsafe.
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    async def prepare(self, data, max_side: int):
+        """Подготовить фото для модели с ограничением max_side (MIME потом определяется по содержимому)"""
+        if not self.enabled:
+            return data
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(self._get_executor(), preprocess_image, data, max_side, self.quality)
+        self._count += 1
+        self._bytes_in += len(data)
+        self._bytes_out += len(result)
+        self._total_ms += (time.monotonic() - started) * 1000
+        return result
+
+    def close(self) -> None:
+        """Остановить пул процессов (вызывается при остановке бота)"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "processed": self._count,
+            "bytes_in": self._bytes_in,
+            "bytes_out": self._bytes_out,
+            "avg_ms": round(self._total_ms / self._count, 1) if self._count else 0.0,
+        }
@@ -1,9 +1,159 @@
+import json
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+import queue
+import threading
+from datetime import datetime
+from logging.handlers import QueueHandler, RotatingFileHandler
+from typing import Any, Dict, List, Optional
 
+from tg_bot.core.config import INTERACTION_LOG_FORMAT, INTERACTION_LOG_LEVEL, INTERACTION_LOG_PATH
 
-def setup_logging() -> logging.Logger:
+_STOP = None
+MAX_TEXT_FIELD = 100
+
+
+class InteractionTextFormatter(logging.Formatter):
+    """`2026-01-17 10:45:15 - USER: @name (ID: 1) | ACTION: x | KEY: value` — прежний формат лога."""
+
+    def __init__(self):
+        super().__init__(datefmt="%Y-%m-%d %H:%M:%S")
+
+    def format(self, record: logging.LogRecord) -> str:
+        event = getattr(record, "event", None)
+        if event is None:
+            return f"{self.formatTime(record, self.datefmt)} - {record.getMessage()}"
+        parts = [f"USER: @{event['username'] or 'не указан'} (ID: {event['user_id']})", f"ACTION: {event['action']}"]
+        for key, value in event["fields"].items():
+            if isinstance(value, str) and len(value) > MAX_TEXT_FIELD:
+                value = value[:MAX_TEXT_FIELD] + "..."
+            parts.append(f"{key.upper()}: {value}")
+        return f"{self.formatTime(record, self.datefmt)} - " + " | ".join(parts)
+
+
+class InteractionJsonFormatter(logging.Formatter):
+    """Одна JSON-строка на событие (JSON Lines)."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        event = getattr(record, "event", None)
+        entry: Dict[str, Any] = {"ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds")}
+        if event is None:
+            entry["message"] = record.getMessage()
+        else:
+            entry.update(user_id=event["user_id"], username=event["username"], action=event["action"])
+            entry.update(event["fields"])
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _EventQueueHandler(QueueHandler):
+    """QueueHandler без форматирования на стороне вызывающего: всё делает поток-слушатель."""
+
+    def __init__(self, log_queue: queue.SimpleQueue, listener: "BatchingLogListener"):
+        super().__init__(log_queue)
+        # Kept so that a repeated setup_logging can stop the thread along with the handler.
+        self.listener = listener
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class BatchingLogListener:
+    """Поток, который забирает записи из очереди пачками, форматирует, ротирует и пишет их одним flush."""
+
+    def __init__(self, log_queue: queue.SimpleQueue, handler: RotatingFileHandler, max_batch: int = 512):
+        self.queue = log_queue
+        self.handler = handler
+        self.max_batch = max_batch
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="interaction-log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self.queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+        self.handler.close()
+
+    def _run(self) -> None:
+        while True:
+            record = self.queue.get()
+            if record is _STOP:
+                return
+            batch = [record]
+            stopping = False
+            while len(batch) < self.max_batch:
+                try:
+                    record = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is _STOP:
+                    stopping = True
+                    break
+                batch.append(record)
+            try:
+                self._write(batch)
+            except Exception:
+                self.handler.handleError(batch[0])
+            if stopping:
+                return
+
+    def _write(self, batch: List[logging.LogRecord]) -> None:
+        handler = self.handler
+        lines = "".join(handler.format(record) + handler.terminator for record in batch)
+        with handler.lock:
+            if handler.maxBytes > 0 and handler.stream.tell() + len(lines.encode("utf-8")) >= handler.maxBytes:
+                handler.doRollover()
+            handler.stream.write(lines)
+            handler.stream.flush()
+
+
+class InteractionLogger:
+    """Структурированный лог действий пользователей.
+
+    `event()` на event loop только кладёт запись в очередь; форматирование, запись
+    и ротация файла выполняются в потоке BatchingLogListener. Если уровень события
+    отфильтрован, event() сразу возвращается; на горячих путях вызывающий проверяет
+    `enabled` заранее, чтобы не собирать поля события вовсе.
+    """
+
+    def __init__(self, logger: logging.Logger, listener: Optional[BatchingLogListener] = None):
+        self.logger = logger
+        self.listener = listener
+
+    @property
+    def enabled(self) -> bool:
+        """Пишутся ли события (уровень INFO не отфильтрован)"""
+        return self.logger.isEnabledFor(logging.INFO)
+
+    def event(self, user, action: str, **fields: Any) -> None:
+        if not self.logger.isEnabledFor(logging.INFO):
+            return
+        # makeRecord + handle skips logger.info's stack walk (findCaller) on the hot path.
+        record = self.logger.makeRecord(self.logger.name, logging.INFO, "", 0, action, (), None)
+        record.event = {
+            "user_id": getattr(user, "id", None),
+            "username": getattr(user, "username", None),
+            "action": action,
+            "fields": fields,
+        }
+        self.logger.handle(record)
+
+    def info(self, message: str, *args: Any) -> None:
+        """Произвольное сообщение (не событие пользователя)"""
+        self.logger.info(message, *args)
+
+    def close(self) -> None:
+        """Дописать очередь и закрыть файл (вызывается при остановке бота)"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+
+def setup_logging() -> InteractionLogger:
     """Configure base logging and return interaction logger."""
     logging.basicConfig(
         format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -11,25 +161,33 @@ def setup_logging() -> logging.Logger:
     )
 
     interaction_logger = logging.getLogger("user_interactions")
-    interaction_logger.setLevel(logging.INFO)
+    interaction_logger.setLevel(INTERACTION_LOG_LEVEL)
     interaction_logger.propagate = False
 
-    log_dir = "logs"
-    os.makedirs(log_dir, exist_ok=True)
+    # Avoid duplicate handlers (and leftover writer threads) if called multiple times
+    for handler in list(interaction_logger.handlers):
+        if isinstance(handler, _EventQueueHandler):
+            interaction_logger.removeHandler(handler)
+            handler.listener.stop()
+
+    log_dir = os.path.dirname(INTERACTION_LOG_PATH)
+    if log_dir:
+        os.makedirs(log_dir, exist_ok=True)
 
     file_handler = RotatingFileHandler(
-        os.path.join(log_dir, "user_interactions.log"),
+        INTERACTION_LOG_PATH,
         maxBytes=10 * 1024 * 1024,  # 10MB
         backupCount=5,
         encoding="utf-8",
     )
-    file_handler.setLevel(logging.INFO)
-    file_formatter = logging.Formatter("%(asctime)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
-    file_handler.setFormatter(file_formatter)
-
-    # Avoid duplicate handlers if called multiple times
-    if not any(isinstance(h, RotatingFileHandler) for h in interaction_logger.handlers):
-        interaction_logger.addHandler(file_handler)
+    if INTERACTION_LOG_FORMAT == "json":
+        file_handler.setFormatter(InteractionJsonFormatter())
+    else:
+        file_handler.setFormatter(InteractionTextFormatter())
 
-    return interaction_logger
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    listener = BatchingLogListener(log_queue, file_handler)
+    listener.start()
+    interaction_logger.addHandler(_EventQueueHandler(log_queue, listener))
 
+    return InteractionLogger(interaction_logger, listener)
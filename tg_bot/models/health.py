@@ -0,0 +1,110 @@
+"""Rolling latency and error statistics per model."""
+
+import math
+import time
+from typing import Callable, Dict, Optional
+
+from tg_bot.core.config import MODEL_HEALTH_ALPHA, MODEL_HEALTH_COOLDOWN, MODEL_HEALTH_MAX_ERROR_RATE
+
+# Sketch buckets grow by this factor: quantiles are accurate to about ±5%.
+SKETCH_GAMMA = 1.1
+# Counts are halved after this many samples so the sketch follows recent latency.
+SKETCH_DECAY_EVERY = 500
+
+
+class LatencySketch:
+    """Квантили задержки по логарифмическим корзинам (относительная точность ~5%).
+
+    Память не зависит от числа замеров; каждые decay_every замеров счётчики делятся
+    пополам, поэтому старые замеры постепенно теряют вес.
+    """
+
+    def __init__(self, gamma: float = SKETCH_GAMMA, decay_every: int = SKETCH_DECAY_EVERY):
+        self._log_gamma = math.log(gamma)
+        self.gamma = gamma
+        self.decay_every = max(1, decay_every)
+        self._buckets: Dict[int, float] = {}
+        self._since_decay = 0
+        self.count = 0.0
+
+    def add(self, seconds: float) -> None:
+        index = math.ceil(math.log(max(seconds, 1e-3)) / self._log_gamma)
+        self._buckets[index] = self._buckets.get(index, 0.0) + 1
+        self.count += 1
+        self._since_decay += 1
+        if self._since_decay >= self.decay_every:
+            self._since_decay = 0
+            # Buckets that decayed to almost nothing are dropped to keep the sketch small.
+            self._buckets = {i: n / 2 for i, n in self._buckets.items() if n > 0.02}
+            self.count = sum(self._buckets.values())
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0.0
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if seen >= rank:
+                # Middle of the bucket (gamma^(i-1), gamma^i].
+                return 2 * self.gamma**index / (1 + self.gamma)
+        return 2 * self.gamma ** max(self._buckets) / (1 + self.gamma)
+
+
+class ModelHealth:
+    """EWMA задержки и доли ошибок одной модели, p95 по LatencySketch.
+
+    Модель считается нездоровой, пока доля ошибок не ниже max_error_rate и последняя
+    ошибка была меньше cooldown секунд назад: после паузы на неё снова идут запросы,
+    и статистика обновляется.
+    """
+
+    def __init__(
+        self,
+        alpha: float = MODEL_HEALTH_ALPHA,
+        max_error_rate: float = MODEL_HEALTH_MAX_ERROR_RATE,
+        cooldown: float = MODEL_HEALTH_COOLDOWN,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.alpha = alpha
+        self.max_error_rate = max_error_rate
+        self.cooldown = cooldown
+        self.clock = clock
+        self.sketch = LatencySketch()
+        self.ewma_latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.calls = 0
+        self.errors = 0
+        self.last_error_at: Optional[float] = None
+
+    def record(self, seconds: Optional[float], ok: bool) -> None:
+        """Учесть вызов; задержка учитывается только у успешных"""
+        self.calls += 1
+        self.error_rate += self.alpha * ((0.0 if ok else 1.0) - self.error_rate)
+        if not ok:
+            self.errors += 1
+            self.last_error_at = self.clock()
+            return
+        if seconds is not None:
+            self.sketch.add(seconds)
+            if self.ewma_latency is None:
+                self.ewma_latency = seconds
+            else:
+                self.ewma_latency += self.alpha * (seconds - self.ewma_latency)
+
+    @property
+    def healthy(self) -> bool:
+        if self.error_rate < self.max_error_rate or self.last_error_at is None:
+            return True
+        return self.clock() - self.last_error_at >= self.cooldown
+
+    def stats(self) -> Dict:
+        p95 = self.sketch.quantile(0.95)
+        return {
+            "healthy": self.healthy,
+            "calls": self.calls,
+            "errors": self.errors,
+            "error_rate": round(self.error_rate, 3),
+            "ewma_ms": round(self.ewma_latency * 1000) if self.ewma_latency is not None else "-",
+            "p95_ms": round(p95 * 1000) if p95 is not None else "-",
+        }
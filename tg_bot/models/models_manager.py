@@ -1,6 +1,16 @@
 import json
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
+
+from tg_bot.core.config import GENERATION_MAX_IN_FLIGHT, GENERATION_MAX_QUEUE, IMAGE_MAX_SIDE
+from tg_bot.models.health import ModelHealth
+
+
+def price_label(model: Dict) -> str:
+    """Цена модели для пользователя; у «auto» — верхняя граница"""
+    price = model["price_rubies"]
+    label = f"{price} рубин{'ов' if price > 1 else ''}"
+    return f"до {label}" if model.get("auto") else label
 
 
 class ModelsManager:
@@ -11,6 +21,7 @@ class ModelsManager:
         self.config_file = config_file or str(Path(__file__).with_name("models_pricing.json"))
         self.models = []
         self.default_model = None
+        self._health: Dict[str, ModelHealth] = {}
         self._load_config()
 
     def _load_config(self):
@@ -34,6 +45,41 @@ class ModelsManager:
         """Получить список доступных моделей"""
         return [model for model in self.models if model.get("enabled", False)]
 
+    def get_routable_models(self) -> List[Dict]:
+        """Доступные модели, на которые можно отправить запрос (без модели «auto»)"""
+        return [model for model in self.get_enabled_models() if not model.get("auto")]
+
+    def health(self, openrouter_name: str) -> ModelHealth:
+        health = self._health.get(openrouter_name)
+        if health is None:
+            health = self._health[openrouter_name] = ModelHealth()
+        return health
+
+    def record_call(self, openrouter_name: str, seconds: Optional[float], ok: bool) -> None:
+        """Учесть вызов модели (задержка успешного вызова или ошибка) в её статистике"""
+        self.health(openrouter_name).record(seconds, ok)
+
+    def route_auto(self, auto_model: Dict) -> Optional[Dict]:
+        """Модель для выбора «auto»: самая быстрая здоровая среди моделей не дороже его цены.
+
+        У модели без замеров задержка считается нулевой, чтобы она получила запросы и
+        статистику. Если здоровых нет, берётся самая быстрая из подходящих по цене.
+        """
+        tier = auto_model.get("price_rubies", 2)
+        candidates = [model for model in self.get_routable_models() if model.get("price_rubies", 2) <= tier]
+        if not candidates:
+            return self.get_default_model()
+
+        def latency(model: Dict) -> float:
+            return self.health(model["openrouter_name"]).ewma_latency or 0.0
+
+        healthy = [model for model in candidates if self.health(model["openrouter_name"]).healthy]
+        return min(healthy or candidates, key=latency)
+
+    def health_stats(self) -> Dict[str, Dict]:
+        """Текущая статистика моделей, к которым уже были запросы"""
+        return {name: health.stats() for name, health in self._health.items()}
+
     def get_model_price(self, openrouter_name: str) -> int:
         """Получить цену генерации для модели (в рубинах)"""
         model = self.get_model_by_name(openrouter_name)
@@ -41,6 +87,33 @@ class ModelsManager:
             return model.get("price_rubies", 2)
         return 2
 
+    def get_max_input_side(self, openrouter_name: str) -> int:
+        """Максимальная сторона входного изображения для модели (в пикселях)"""
+        model = self.get_model_by_name(openrouter_name)
+        if model:
+            return model.get("max_input_side", IMAGE_MAX_SIDE)
+        return IMAGE_MAX_SIDE
+
+    def get_admission_limits(self, openrouter_name: str) -> Tuple[int, int]:
+        """(одновременных вызовов, мест в очереди) для модели"""
+        model = self.get_model_by_name(openrouter_name) or {}
+        return (
+            model.get("max_in_flight", GENERATION_MAX_IN_FLIGHT),
+            model.get("max_queue", GENERATION_MAX_QUEUE),
+        )
+
+    def is_result_cacheable(self, openrouter_name: str) -> bool:
+        """Можно ли отдавать результаты модели из кэша (поле cache_results, по умолчанию нет)"""
+        model = self.get_model_by_name(openrouter_name)
+        return bool(model and model.get("cache_results", False))
+
+    def get_cache_hit_price(self, openrouter_name: str) -> int:
+        """Цена результата из кэша (поле cache_hit_price_rubies, по умолчанию полная цена; 0 — бесплатно)"""
+        model = self.get_model_by_name(openrouter_name)
+        if model and "cache_hit_price_rubies" in model:
+            return model["cache_hit_price_rubies"]
+        return self.get_model_price(openrouter_name)
+
     def get_default_model(self) -> Dict:
         """Получить модель по умолчанию"""
         if self.default_model:
@@ -48,7 +121,7 @@ class ModelsManager:
             if model:
                 return model
 
-        enabled = self.get_enabled_models()
+        enabled = self.get_routable_models()
         if enabled:
             return enabled[0]
 
@@ -67,7 +140,7 @@ class ModelsManager:
         for model in enabled:
             text += f"🤖 {model['display_name']}\n"
             text += f"   {model['description']}\n"
-            text += f"   💎 Цена: {model['price_rubies']} рубин{'ов' if model['price_rubies'] > 1 else ''}\n\n"
+            text += f"   💎 Цена: {price_label(model)}\n\n"
         return text
 
     def reload_config(self):
@@ -1,53 +1,137 @@
+import asyncio
 import logging
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 
-from yookassa import Configuration, Payment
+import httpx
 
-from tg_bot.core.config import YOOKASSA_SECRET_KEY, YOOKASSA_SHOP_ID, WEBHOOK_URL
+from tg_bot.core.config import (
+    YOOKASSA_API_URL,
+    YOOKASSA_BACKEND,
+    YOOKASSA_CONNECT_TIMEOUT,
+    YOOKASSA_MAX_ATTEMPTS,
+    YOOKASSA_READ_TIMEOUT,
+    YOOKASSA_SDK_THREADS,
+    YOOKASSA_SECRET_KEY,
+    YOOKASSA_SHOP_ID,
+)
+
+try:
+    from yookassa import Configuration, Payment  # type: ignore
+except Exception:  # pragma: no cover
+    # The SDK is only needed for YOOKASSA_BACKEND=sdk.
+    Configuration = Payment = None
 
 logger = logging.getLogger(__name__)
 
+RETRY_DELAY = 0.5
+# 202: YooKassa is still processing the request and asks to repeat it with the same Idempotence-Key.
+RETRYABLE_STATUSES = {202, 429, 500, 502, 503, 504}
+
+
+class YooKassaError(Exception):
+    """Ответ ЮКассы, который не исправится повтором (4xx, неожиданный формат)."""
+
 
 class YooKassaPayment:
-    def __init__(self):
+    """Асинхронный клиент ЮКассы.
+
+    По умолчанию ходит в REST API через общий httpx-пул с таймаутами и повторами;
+    повтор создания платежа идёт с тем же Idempotence-Key, поэтому дубля не будет.
+    С YOOKASSA_BACKEND=sdk вызовы делает официальный SDK в ограниченном пуле потоков.
+    """
+
+    def __init__(self, http_client: Optional[httpx.AsyncClient] = None, backend: str = YOOKASSA_BACKEND):
         if not YOOKASSA_SHOP_ID or not YOOKASSA_SECRET_KEY:
             raise ValueError("YOOKASSA_SHOP_ID и YOOKASSA_SECRET_KEY должны быть установлены в .env файле")
 
-        Configuration.account_id = YOOKASSA_SHOP_ID
-        Configuration.secret_key = YOOKASSA_SECRET_KEY
-        logger.info(f"YooKassa настроен с shop_id: {YOOKASSA_SHOP_ID[:4]}...")
+        self.backend = backend
+        self.max_attempts = max(1, YOOKASSA_MAX_ATTEMPTS)
+        self.http_client = http_client or httpx.AsyncClient(
+            timeout=httpx.Timeout(YOOKASSA_READ_TIMEOUT, connect=YOOKASSA_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=20),
+        )
+        self.http_client.auth = httpx.BasicAuth(YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY)
+        self._executor: Optional[ThreadPoolExecutor] = None
 
-    def create_payment(self, amount: float, user_id: int, rubies: int, description: str = "Пополнение рубинов"):
+        if backend == "sdk":
+            if Payment is None:
+                raise ValueError("YOOKASSA_BACKEND=sdk требует установленный пакет yookassa")
+            Configuration.account_id = YOOKASSA_SHOP_ID
+            Configuration.secret_key = YOOKASSA_SECRET_KEY
+            self._executor = ThreadPoolExecutor(max_workers=YOOKASSA_SDK_THREADS, thread_name_prefix="yookassa-sdk")
+        logger.info(f"YooKassa настроен с shop_id: {YOOKASSA_SHOP_ID[:4]}... (backend: {backend})")
+
+    async def aclose(self) -> None:
+        """Закрыть HTTP-пул и пул потоков SDK (вызывается при остановке бота)"""
+        await self.http_client.aclose()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    async def _request(self, method: str, path: str, json: dict = None, idempotence_key: str = None) -> dict:
+        headers = {"Idempotence-Key": idempotence_key} if idempotence_key else None
+        url = YOOKASSA_API_URL.rstrip("/") + path
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                response = await self.http_client.request(method, url, json=json, headers=headers)
+            except httpx.TransportError as e:
+                if attempt == self.max_attempts:
+                    raise
+                logger.warning(f"YooKassa {method} {path}: {e!r}, попытка {attempt}/{self.max_attempts}")
+            else:
+                if response.status_code == 200:
+                    return response.json()
+                if response.status_code not in RETRYABLE_STATUSES:
+                    raise YooKassaError(f"YooKassa {method} {path}: HTTP {response.status_code} {response.text[:200]}")
+                if attempt == self.max_attempts:
+                    raise YooKassaError(f"YooKassa {method} {path}: HTTP {response.status_code} после {attempt} попыток")
+                logger.warning(f"YooKassa {method} {path}: HTTP {response.status_code}, попытка {attempt}/{self.max_attempts}")
+            await asyncio.sleep(RETRY_DELAY * 2 ** (attempt - 1))
+        raise AssertionError("unreachable")
+
+    async def _in_thread(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def create_payment(self, amount: float, user_id: int, rubies: int, description: str = "Пополнение рубинов"):
         """Создать платеж в ЮКассе"""
         idempotence_key = str(uuid.uuid4())
+        body = {
+            "amount": {"value": f"{amount:.2f}", "currency": "RUB"},
+            "confirmation": {"type": "redirect", "return_url": "https://t.me"},
+            "capture": True,
+            "description": f"{description} ({rubies} рубинов)",
+            "metadata": {"user_id": str(user_id), "rubies": str(rubies)},
+        }
 
         try:
-            payment = Payment.create(
-                {
-                    "amount": {"value": f"{amount:.2f}", "currency": "RUB"},
-                    "confirmation": {"type": "redirect", "return_url": "https://t.me"},
-                    "capture": True,
-                    "description": f"{description} ({rubies} рубинов)",
-                    "metadata": {"user_id": str(user_id), "rubies": str(rubies)},
-                },
-                idempotence_key,
-            )
+            if self.backend == "sdk":
+                payment = await self._in_thread(Payment.create, body, idempotence_key)
+                return {
+                    "payment_id": payment.id,
+                    "confirmation_url": payment.confirmation.confirmation_url,
+                    "status": payment.status,
+                }
 
+            payment = await self._request("POST", "/payments", json=body, idempotence_key=idempotence_key)
             return {
-                "payment_id": payment.id,
-                "confirmation_url": payment.confirmation.confirmation_url,
-                "status": payment.status,
+                "payment_id": payment["id"],
+                "confirmation_url": payment["confirmation"]["confirmation_url"],
+                "status": payment["status"],
             }
         except Exception as e:
             logger.error(f"Ошибка при создании платежа в YooKassa: {e}", exc_info=True)
             raise
 
-    def check_payment_status(self, payment_id: str):
+    async def check_payment_status(self, payment_id: str):
         """Проверить статус платежа"""
         try:
-            payment = Payment.find_one(payment_id)
-            return {"status": payment.status, "paid": payment.paid, "metadata": payment.metadata}
+            if self.backend == "sdk":
+                payment = await self._in_thread(Payment.find_one, payment_id)
+                return {"status": payment.status, "paid": payment.paid, "metadata": payment.metadata}
+
+            payment = await self._request("GET", f"/payments/{payment_id}")
+            return {"status": payment["status"], "paid": payment["paid"], "metadata": payment.get("metadata", {})}
         except Exception as e:
-            print(f"Error checking payment: {e}")
+            logger.error(f"Ошибка при проверке платежа {payment_id} в YooKassa: {e}")
             return None
-
@@ -0,0 +1,228 @@
+"""Bounded store of uploaded photos waiting for the user's prompt."""
+
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import time
+from collections import OrderedDict
+from itertools import count
+from typing import Dict, List, Optional
+
+from tg_bot.core.config import (
+    PENDING_INPUT_DISK_BYTES,
+    PENDING_INPUT_MAX_USERS,
+    PENDING_INPUT_MEMORY_BYTES,
+    PENDING_INPUT_SPILL_DIR,
+    PENDING_INPUT_TTL,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ("images", "sizes", "path", "expires_at")
+
+    def __init__(self, images: List[bytes], expires_at: float):
+        self.images: Optional[List[bytes]] = images
+        self.sizes = [len(image) for image in images]
+        self.path: Optional[str] = None
+        self.expires_at = expires_at
+
+    @property
+    def size(self) -> int:
+        return sum(self.sizes)
+
+
+def _write_file(path: str, images: List[bytes]) -> None:
+    with open(path, "wb") as f:
+        for image in images:
+            f.write(image)
+
+
+def _read_file(path: str, sizes: List[int]) -> List[bytes]:
+    with open(path, "rb") as f:
+        return [f.read(size) for size in sizes]
+
+
+def _remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class PendingInputStore:
+    """Фото, ожидающие промпта: user_id -> список изображений (одно фото или альбом).
+
+    Память ограничена memory_budget: при превышении самые давние (LRU) загрузки
+    выгружаются на диск, при превышении disk_budget или max_users — удаляются.
+    Записи живут ttl секунд; просроченные убирает фоновая задача (start/stop).
+    Новая загрузка пользователя заменяет предыдущую.
+    """
+
+    def __init__(
+        self,
+        memory_budget: int = PENDING_INPUT_MEMORY_BYTES,
+        disk_budget: int = PENDING_INPUT_DISK_BYTES,
+        max_users: int = PENDING_INPUT_MAX_USERS,
+        ttl: float = PENDING_INPUT_TTL,
+        spill_dir: str = PENDING_INPUT_SPILL_DIR,
+        cleanup_interval: float = 60.0,
+    ):
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self.max_users = max(1, max_users)
+        self.ttl = ttl
+        self.cleanup_interval = cleanup_interval
+        self._spill_dir = spill_dir or None
+        self._own_spill_dir = not spill_dir
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._seq = count()
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        self.spilled = 0
+        self.evicted = 0
+        self.expired = 0
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._cleanup_loop(), name="pending-inputs-cleanup")
+
+    async def stop(self) -> None:
+        """Остановить очистку и удалить все выгруженные файлы"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        async with self._lock:
+            for user_id in list(self._entries):
+                await self._drop(user_id)
+        if self._own_spill_dir and self._spill_dir:
+            await asyncio.to_thread(shutil.rmtree, self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
+
+    async def put(self, user_id: int, images: List[bytes]) -> None:
+        """Сохранить загрузку пользователя (заменяет предыдущую)"""
+        entry = _Entry(list(images), time.monotonic() + self.ttl)
+        async with self._lock:
+            if user_id in self._entries:
+                await self._drop(user_id)
+            self._entries[user_id] = entry
+            self.memory_bytes += entry.size
+            await self._enforce_budgets()
+
+    async def take(self, user_id: int) -> Optional[List[bytes]]:
+        """Забрать загрузку пользователя (None, если её нет или она истекла)"""
+        async with self._lock:
+            entry = self._entries.pop(user_id, None)
+            if entry is None:
+                return None
+            if entry.images is not None:
+                self.memory_bytes -= entry.size
+            else:
+                self.disk_bytes -= entry.size
+            if entry.expires_at <= time.monotonic():
+                self.expired += 1
+                if entry.path:
+                    await asyncio.to_thread(_remove_file, entry.path)
+                return None
+        if entry.images is not None:
+            return entry.images
+        images = await asyncio.to_thread(_read_file, entry.path, entry.sizes)
+        await asyncio.to_thread(_remove_file, entry.path)
+        return images
+
+    async def _drop(self, user_id: int) -> None:
+        entry = self._entries.pop(user_id)
+        if entry.images is not None:
+            self.memory_bytes -= entry.size
+        else:
+            self.disk_bytes -= entry.size
+            # File removal blocks like the spill write does, so it runs off the event loop too.
+            await asyncio.to_thread(_remove_file, entry.path)
+
+    async def _enforce_budgets(self) -> None:
+        while len(self._entries) > self.max_users:
+            await self._drop(next(iter(self._entries)))
+            self.evicted += 1
+
+        # Spill least recently stored uploads until memory fits.
+        for user_id, entry in list(self._entries.items()):
+            if self.memory_bytes <= self.memory_budget:
+                break
+            if entry.images is None:
+                continue
+            # Make room on disk by dropping the oldest spilled uploads first.
+            while self.disk_bytes + entry.size > self.disk_budget:
+                oldest = next((uid for uid, e in self._entries.items() if e.images is None), None)
+                if oldest is None:
+                    break
+                await self._drop(oldest)
+                self.evicted += 1
+            if self.disk_bytes + entry.size > self.disk_budget:
+                await self._drop(user_id)
+                self.evicted += 1
+                continue
+            await self._spill(user_id, entry)
+
+        # Disk over budget (e.g. after a budget change): drop the oldest spilled uploads.
+        for user_id, entry in list(self._entries.items()):
+            if self.disk_bytes <= self.disk_budget:
+                break
+            if entry.images is None:
+                await self._drop(user_id)
+                self.evicted += 1
+
+    async def _spill(self, user_id: int, entry: _Entry) -> None:
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix="tg_bot_pending_")
+        else:
+            os.makedirs(self._spill_dir, exist_ok=True)
+        path = os.path.join(self._spill_dir, f"{user_id}-{next(self._seq)}.bin")
+        try:
+            await asyncio.to_thread(_write_file, path, entry.images)
+        except OSError as e:
+            logger.error(f"Не удалось выгрузить фото пользователя {user_id} на диск: {e}")
+            await self._drop(user_id)
+            self.evicted += 1
+            return
+        entry.images = None
+        entry.path = path
+        self.memory_bytes -= entry.size
+        self.disk_bytes += entry.size
+        self.spilled += 1
+
+    async def cleanup_expired(self) -> int:
+        """Удалить просроченные загрузки. Возвращает их число"""
+        now = time.monotonic()
+        async with self._lock:
+            expired = [user_id for user_id, entry in self._entries.items() if entry.expires_at <= now]
+            for user_id in expired:
+                await self._drop(user_id)
+            self.expired += len(expired)
+        return len(expired)
+
+    async def _cleanup_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.cleanup_interval)
+            try:
+                await self.cleanup_expired()
+            except Exception as e:
+                logger.error(f"Ошибка очистки ожидающих фото: {e}", exc_info=True)
+
+    def stats(self) -> Dict:
+        return {
+            "users": len(self._entries),
+            "memory_bytes": self.memory_bytes,
+            "disk_bytes": self.disk_bytes,
+            "spilled": self.spilled,
+            "evicted": self.evicted,
+            "expired": self.expired,
+        }
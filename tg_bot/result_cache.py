@@ -0,0 +1,199 @@
+"""Content-addressed cache of generation results on disk."""
+
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import time
+import unicodedata
+from collections import OrderedDict
+from itertools import count
+from typing import BinaryIO, Dict, List, Optional, Sequence, Tuple
+
+from tg_bot.core.config import RESULT_CACHE_DIR, RESULT_CACHE_ENABLED, RESULT_CACHE_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+# Input images above this total size are hashed in a worker thread.
+INLINE_HASH_LIMIT = 1024 * 1024
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Промпт без различий в регистре, пробелах и формах записи Unicode"""
+    return " ".join(unicodedata.normalize("NFKC", prompt).split()).casefold()
+
+
+def cache_key(model: str, prompt: str, images: Sequence[bytes] = (), kind: str = "text") -> str:
+    """Ключ результата: sha256 от (вид запроса, модель, нормализованный промпт, sha256 каждого входного фото по порядку).
+
+    Вид запроса (text / image / images) входит в ключ: промпт с одними и теми же фото
+    оформляется в запросе по-разному, и результаты различаются.
+    """
+    h = hashlib.sha256()
+    for part in (kind, model, normalize_prompt(prompt)):
+        encoded = part.encode("utf-8")
+        # Length-prefixed so that ("ab", "c") and ("a", "bc") never collide.
+        h.update(len(encoded).to_bytes(8, "big"))
+        h.update(encoded)
+    h.update(len(images).to_bytes(8, "big"))
+    for image in images:
+        h.update(hashlib.sha256(image).digest())
+    return h.hexdigest()
+
+
+def _scan(directory: str) -> List[Tuple[float, str, int]]:
+    """(mtime, key, size) всех записей каталога; недописанные временные файлы удаляются"""
+    entries = []
+    for root, _dirs, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            if name.endswith(".tmp"):
+                _remove_file(path)
+                continue
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, name, st.st_size))
+    entries.sort()
+    return entries
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        data = f.read()
+    # mtime is the LRU order restored after a restart.
+    os.utime(path)
+    return data
+
+
+def _write_file(path: str, tmp_path: str, source: BinaryIO) -> int:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    source.seek(0)
+    try:
+        with open(tmp_path, "wb") as f:
+            shutil.copyfileobj(source, f)
+            size = f.tell()
+        os.replace(tmp_path, path)
+    except BaseException:
+        _remove_file(tmp_path)
+        raise
+    finally:
+        source.seek(0)
+    return size
+
+
+def _remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class ResultCache:
+    """Кэш результатов генерации по содержимому запроса (включается RESULT_CACHE_ENABLED).
+
+    Изображения лежат на диске (<directory>/<2 символа ключа>/<ключ>), в памяти —
+    только индекс ключ -> размер в порядке LRU. При превышении max_bytes удаляются
+    самые давно использованные записи. Индекс восстанавливается из каталога в load().
+    """
+
+    def __init__(
+        self,
+        enabled: bool = RESULT_CACHE_ENABLED,
+        directory: str = RESULT_CACHE_DIR,
+        max_bytes: int = RESULT_CACHE_MAX_BYTES,
+    ):
+        self.enabled = enabled and max_bytes > 0
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._seq = count()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._hit_time = 0.0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    async def load(self) -> None:
+        """Восстановить индекс из каталога (вызывается при старте бота)"""
+        if not self.enabled:
+            return
+        entries = await asyncio.to_thread(_scan, self.directory)
+        self._index = OrderedDict((key, size) for _mtime, key, size in entries)
+        self.bytes = sum(self._index.values())
+        await self._evict()
+        logger.info(f"Кэш результатов: {len(self._index)} записей, {self.bytes} байт")
+
+    async def key_for(self, model: str, prompt: str, images: Sequence[bytes] = (), kind: str = "text") -> str:
+        if sum(len(image) for image in images) > INLINE_HASH_LIMIT:
+            return await asyncio.to_thread(cache_key, model, prompt, images, kind)
+        return cache_key(model, prompt, images, kind)
+
+    def contains(self, key: str) -> bool:
+        """Есть ли запись (без чтения с диска и без учёта в hits/misses)"""
+        return key in self._index
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """Изображение по ключу или None (промах)"""
+        if key not in self._index:
+            self.misses += 1
+            return None
+        started = time.monotonic()
+        self._index.move_to_end(key)
+        try:
+            data = await asyncio.to_thread(_read_file, self._path(key))
+        except OSError as e:
+            logger.warning(f"Запись кэша результатов {key} недоступна: {e}")
+            self._forget(key)
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._hit_time += time.monotonic() - started
+        return data
+
+    async def put(self, key: str, image: BinaryIO) -> None:
+        """Сохранить результат; позиция файла после записи возвращается в начало"""
+        tmp_path = os.path.join(self.directory, f"{key}.{os.getpid()}.{next(self._seq)}.tmp")
+        try:
+            size = await asyncio.to_thread(_write_file, self._path(key), tmp_path, image)
+        except OSError as e:
+            logger.error(f"Не удалось сохранить результат в кэш: {e}")
+            return
+        self._forget(key)
+        self._index[key] = size
+        self.bytes += size
+        self.stores += 1
+        await self._evict()
+
+    def _forget(self, key: str) -> None:
+        size = self._index.pop(key, None)
+        if size is not None:
+            self.bytes -= size
+
+    async def _evict(self) -> None:
+        victims = []
+        while self.bytes > self.max_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+            victims.append(self._path(key))
+        for path in victims:
+            await asyncio.to_thread(_remove_file, path)
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._index),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "avg_hit_ms": round(self._hit_time / self.hits * 1000, 2) if self.hits else 0.0,
+        }
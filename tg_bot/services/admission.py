@@ -0,0 +1,246 @@
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Hashable, List, Optional
+
+from tg_bot.core.config import GENERATION_FAIR_QUANTUM, GENERATION_FAIR_SCHEDULING, GENERATION_QUEUE_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """Запрос к модели не допущен: очередь заполнена ("queue_full") или ожидание истекло ("timeout")"""
+
+    def __init__(self, model: str, reason: str):
+        super().__init__(f"{model}: {reason}")
+        self.model = model
+        self.reason = reason
+
+
+class FairQueue:
+    """Взвешенный deficit round robin по очередям пользователей.
+
+    У каждого пользователя своя FIFO-очередь. В свой ход пользователь получает
+    quantum * weight единиц и обслуживается, пока их хватает на стоимость следующего
+    элемента (цену генерации), затем ход переходит к следующему. Так один пользователь
+    с десятками запросов не задерживает остальных, дешёвые запросы проходят чаще, а
+    пользователи с большим весом получают пропорционально большую долю.
+    """
+
+    # Marks that no user is in the middle of a turn (None is a valid user key).
+    _NO_TURN = object()
+
+    def __init__(self, quantum: float = GENERATION_FAIR_QUANTUM):
+        self.quantum = quantum if quantum > 0 else 1.0
+        self._queues: "OrderedDict[Hashable, Deque[tuple]]" = OrderedDict()
+        self._deficit: Dict[Hashable, float] = {}
+        self._weight: Dict[Hashable, float] = {}
+        self._turn: Any = self._NO_TURN
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def users(self) -> int:
+        return len(self._queues)
+
+    def push(self, user: Hashable, item: Any, cost: float = 1.0, weight: float = 1.0) -> None:
+        queue = self._queues.get(user)
+        if queue is None:
+            queue = self._queues[user] = deque()
+            self._deficit[user] = 0.0
+        self._weight[user] = weight if weight > 0 else 1.0
+        queue.append((item, max(0.0, cost)))
+        self._size += 1
+
+    def pop(self) -> Optional[Any]:
+        while self._queues:
+            user, queue = next(iter(self._queues.items()))
+            if self._turn != user:
+                # A new turn: the user at the head gets its quantum.
+                self._turn = user
+                self._deficit[user] += self.quantum * self._weight[user]
+            item, cost = queue[0]
+            if self._deficit[user] >= cost:
+                queue.popleft()
+                self._size -= 1
+                self._deficit[user] -= cost
+                if not queue:
+                    self._drop(user)
+                return item
+            # Turn is over: the user goes to the back.
+            self._turn = self._NO_TURN
+            self._queues.move_to_end(user)
+        return None
+
+    def remove(self, user: Hashable, item: Any) -> bool:
+        queue = self._queues.get(user)
+        if not queue:
+            return False
+        for entry in queue:
+            if entry[0] is item:
+                queue.remove(entry)
+                self._size -= 1
+                if not queue:
+                    self._drop(user)
+                return True
+        return False
+
+    def _drop(self, user: Hashable) -> None:
+        # An idle user does not bank credit for later.
+        del self._queues[user]
+        del self._deficit[user]
+        del self._weight[user]
+        if self._turn == user:
+            self._turn = self._NO_TURN
+
+
+class _ModelGate:
+    """Не больше max_in_flight вызовов модели одновременно и не больше max_queue ожидающих.
+
+    Освободившееся место достаётся ожидающему, которого выбирает FairQueue.
+    """
+
+    def __init__(self, max_in_flight: int, max_queue: int, quantum: float = GENERATION_FAIR_QUANTUM):
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queue = max(0, max_queue)
+        self.in_flight = 0
+        self._waiters = FairQueue(quantum)
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.waited = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    @property
+    def full(self) -> bool:
+        """Нет ни свободного места, ни места в очереди: acquire отклонит сразу"""
+        return self.in_flight >= self.max_in_flight and self.queued >= self.max_queue
+
+    async def acquire(
+        self, model: str, timeout: float, user: Hashable = None, cost: float = 1.0, weight: float = 1.0
+    ) -> None:
+        if self.in_flight < self.max_in_flight and not self.queued:
+            self.in_flight += 1
+            self.admitted += 1
+            return
+        self.check(model)
+
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._waiters.push(user, waiter, cost, weight)
+        started = loop.time()
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise AdmissionRejected(model, "timeout") from None
+        except BaseException:
+            # Cancelled right after the slot was handed over: pass it on.
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if not waiter.done() or waiter.cancelled():
+                self._waiters.remove(user, waiter)
+        waited = loop.time() - started
+        self.admitted += 1
+        self.waited += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    def check(self, model: str) -> None:
+        if self.full:
+            self.rejected += 1
+            raise AdmissionRejected(model, "queue_full")
+
+    def release(self) -> None:
+        # Hand the slot straight to the next waiter in fair order; in_flight stays the same.
+        while self._waiters:
+            waiter = self._waiters.pop()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def stats(self) -> Dict:
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queued": self.queued,
+            "users_waiting": self._waiters.users,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_wait_ms": round(self.total_wait / self.waited * 1000, 1) if self.waited else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 1),
+        }
+
+
+class AdmissionController:
+    """Ограничение одновременных запросов к каждой модели OpenRouter.
+
+    Лимиты берутся из models_pricing.json (max_in_flight, max_queue) или из
+    GENERATION_MAX_IN_FLIGHT / GENERATION_MAX_QUEUE. Когда очередь модели заполнена,
+    запрос отклоняется сразу, а не ждёт таймаута апстрима: check() — ещё до постановки
+    в очередь задач, full_models() — чтобы исполнители не брали задачи таких моделей.
+    Ожидающие обслуживаются по очереди пользователей (FairQueue); fair=False — в порядке прихода.
+    """
+
+    def __init__(
+        self,
+        models_manager,
+        queue_timeout: float = GENERATION_QUEUE_TIMEOUT,
+        fair: bool = GENERATION_FAIR_SCHEDULING,
+        quantum: float = GENERATION_FAIR_QUANTUM,
+    ):
+        self.models_manager = models_manager
+        self.queue_timeout = queue_timeout
+        self.fair = fair
+        self.quantum = quantum
+        self._gates: Dict[str, _ModelGate] = {}
+
+    def _gate(self, model: str) -> _ModelGate:
+        gate = self._gates.get(model)
+        if gate is None:
+            gate = _ModelGate(*self.models_manager.get_admission_limits(model), quantum=self.quantum)
+            self._gates[model] = gate
+        return gate
+
+    def check(self, model: str) -> None:
+        """AdmissionRejected("queue_full"), если вызов модели сейчас был бы отклонён сразу"""
+        gate = self._gates.get(model)
+        if gate is not None:
+            gate.check(model)
+
+    def full_models(self) -> List[str]:
+        """Модели, у которых заняты все места и вся очередь"""
+        return [model for model, gate in self._gates.items() if gate.full]
+
+    @asynccontextmanager
+    async def slot(
+        self, model: str, user: Hashable = None, cost: float = 1.0, weight: float = 1.0
+    ) -> AsyncIterator[None]:
+        """Занять место для вызова модели; AdmissionRejected, если места нет.
+
+        cost — цена запроса (единицы FairQueue), weight — вес пользователя.
+        """
+        gate = self._gate(model)
+        if not self.fair:
+            user, cost, weight = None, 1.0, 1.0
+        await gate.acquire(model, self.queue_timeout, user, cost, weight)
+        try:
+            yield
+        finally:
+            gate.release()
+
+    def stats(self) -> Dict[str, Dict]:
+        return {model: gate.stats() for model, gate in self._gates.items()}
@@ -0,0 +1,209 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from tg_bot.core.config import ALBUM_MAX_DEBOUNCE, ALBUM_MAX_PHOTOS, ALBUM_MAX_WAIT, ALBUM_MIN_DEBOUNCE
+
+logger = logging.getLogger(__name__)
+
+# Quiet period = GAP_FACTOR x the largest gap between photos of this album seen so far.
+GAP_FACTOR = 3.0
+# Groups (incl. rejected ones) still known this long after their first photo are dropped.
+STALE_AFTER = 60.0
+
+OnComplete = Callable[[Any, Any, List[bytes], Optional[str]], Awaitable[None]]
+
+
+class _Album:
+    __slots__ = (
+        "user_id",
+        "update",
+        "context",
+        "caption",
+        "downloads",
+        "first_at",
+        "last_at",
+        "max_gap",
+        "changed",
+        "task",
+        "rejected",
+        "expiry",
+    )
+
+    def __init__(self, user_id: int, now: float):
+        self.user_id = user_id
+        self.update = None
+        self.context = None
+        self.caption: Optional[str] = None
+        self.downloads: List[asyncio.Task] = []
+        self.first_at = now
+        self.last_at = now
+        self.max_gap = 0.0
+        self.changed = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.rejected = False
+        self.expiry: Optional[asyncio.TimerHandle] = None
+
+
+class AlbumAggregator:
+    """Сборка альбомов (media group) из отдельных апдейтов.
+
+    Фото скачиваются сразу и параллельно (хендлер не ждёт загрузку), баланс
+    проверяется один раз на альбом, а альбом закрывается, как только пришло
+    max_photos фото или новые фото перестали приходить — пауза подстраивается под
+    интервалы между фото этого альбома. Зависшие и отклонённые группы удаляются
+    таймером через stale_after секунд, даже если новых альбомов больше нет.
+    """
+
+    def __init__(
+        self,
+        max_photos: int = ALBUM_MAX_PHOTOS,
+        min_debounce: float = ALBUM_MIN_DEBOUNCE,
+        max_debounce: float = ALBUM_MAX_DEBOUNCE,
+        max_wait: float = ALBUM_MAX_WAIT,
+        stale_after: float = STALE_AFTER,
+    ):
+        self.max_photos = max(1, max_photos)
+        self.min_debounce = min_debounce
+        self.max_debounce = max(min_debounce, max_debounce)
+        self.max_wait = max_wait
+        self.stale_after = stale_after
+        self._albums: Dict[str, _Album] = {}
+        self._completed = 0
+        self._early = 0
+        self._photos = 0
+        self._dropped_photos = 0
+        self._failed_downloads = 0
+        self._rejected = 0
+        self._evicted = 0
+        self._total_wait = 0.0
+
+    def is_known(self, group_id: str) -> bool:
+        """Альбом уже собирается (или отклонён) — повторная проверка баланса не нужна"""
+        return group_id in self._albums
+
+    def reject(self, group_id: str, user_id: int) -> None:
+        """Запомнить альбом как отклонённый: остальные его фото игнорируются"""
+        album = _Album(user_id, asyncio.get_running_loop().time())
+        album.rejected = True
+        self._track(group_id, album)
+        self._rejected += 1
+
+    def add(
+        self,
+        group_id: str,
+        update,
+        context,
+        download: Callable[[], Awaitable[bytes]],
+        on_complete: OnComplete,
+        caption: Optional[str] = None,
+    ) -> None:
+        """Добавить фото альбома: загрузка стартует сразу, хендлер не ждёт её окончания"""
+        now = asyncio.get_running_loop().time()
+        album = self._albums.get(group_id)
+        if album is None:
+            album = _Album(update.effective_user.id, now)
+            album.update, album.context = update, context
+            self._track(group_id, album)
+            album.task = asyncio.create_task(self._collect(group_id, album, on_complete), name=f"album-{group_id}")
+        if album.rejected:
+            return
+        if len(album.downloads) >= self.max_photos:
+            self._dropped_photos += 1
+            return
+
+        album.max_gap = max(album.max_gap, now - album.last_at)
+        album.last_at = now
+        if caption and not album.caption:
+            album.caption = caption
+        album.downloads.append(asyncio.create_task(download()))
+        album.changed.set()
+
+    def _debounce(self, album: _Album) -> float:
+        if len(album.downloads) < 2:
+            return self.max_debounce
+        return min(self.max_debounce, max(self.min_debounce, GAP_FACTOR * album.max_gap))
+
+    async def _wait_until_complete(self, album: _Album) -> bool:
+        """Ждать конца альбома. True, если закрыт досрочно по числу фото"""
+        loop = asyncio.get_running_loop()
+        while len(album.downloads) < self.max_photos:
+            now = loop.time()
+            deadline = min(album.last_at + self._debounce(album), album.first_at + self.max_wait)
+            if now >= deadline:
+                return False
+            album.changed.clear()
+            try:
+                await asyncio.wait_for(album.changed.wait(), deadline - now)
+            except asyncio.TimeoutError:
+                pass
+        return True
+
+    async def _collect(self, group_id: str, album: _Album, on_complete: OnComplete) -> None:
+        try:
+            early = await self._wait_until_complete(album)
+            results = await asyncio.gather(*album.downloads, return_exceptions=True)
+            photos = []
+            for result in results:
+                if isinstance(result, BaseException) or not result:
+                    self._failed_downloads += 1
+                    logger.warning(f"Не удалось скачать фото альбома {group_id}: {result!r}")
+                else:
+                    photos.append(result)
+
+            self._completed += 1
+            self._early += early
+            self._photos += len(photos)
+            self._total_wait += asyncio.get_running_loop().time() - album.first_at
+            update, context, caption = album.update, album.context, album.caption
+            # The album no longer pins the update/context once it is handed over.
+            album.update = album.context = None
+            self._albums.pop(group_id, None)
+            await on_complete(update, context, photos, caption)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка обработки альбома {group_id}: {e}", exc_info=True)
+        finally:
+            if self._albums.get(group_id) is album:
+                self._albums.pop(group_id, None)
+            if album.expiry is not None:
+                album.expiry.cancel()
+            for download in album.downloads:
+                download.cancel()
+
+    def _track(self, group_id: str, album: _Album) -> None:
+        self._albums[group_id] = album
+        album.expiry = asyncio.get_running_loop().call_later(self.stale_after, self._expire, group_id, album)
+
+    def _expire(self, group_id: str, album: _Album) -> None:
+        if self._albums.get(group_id) is not album:
+            return
+        del self._albums[group_id]
+        if album.task is not None and not album.rejected:
+            album.task.cancel()
+            self._evicted += 1
+
+    async def close(self) -> None:
+        """Отменить все незавершённые альбомы (вызывается при остановке бота)"""
+        tasks = [album.task for album in self._albums.values() if album.task is not None]
+        for album in self._albums.values():
+            if album.expiry is not None:
+                album.expiry.cancel()
+        self._albums.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict:
+        return {
+            "collecting": sum(1 for album in self._albums.values() if not album.rejected),
+            "completed": self._completed,
+            "completed_by_count": self._early,
+            "photos": self._photos,
+            "dropped_over_cap": self._dropped_photos,
+            "failed_downloads": self._failed_downloads,
+            "rejected": self._rejected,
+            "evicted": self._evicted,
+            "avg_wait_ms": round(self._total_wait / self._completed * 1000, 1) if self._completed else 0.0,
+        }
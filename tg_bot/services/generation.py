@@ -1,186 +1,376 @@
+import asyncio
 import io
 import logging
+from types import SimpleNamespace
+from typing import BinaryIO, Optional
 
-import aiohttp
-from telegram import Update
+from telegram import Bot, Update
 from telegram.ext import ContextTypes
 
+from tg_bot.clients.resilience import CircuitOpen, UpstreamError
+from tg_bot.core.config import GENERATION_PAYING_WEIGHT, GENERATION_PAYING_WINDOW_DAYS
 from tg_bot.deps import deps_from_context
 from tg_bot.keyboards import get_main_menu_keyboard
+from tg_bot.services.admission import AdmissionRejected
 from tg_bot.services.models import get_user_selected_model
 
 logger = logging.getLogger(__name__)
 
-
-async def process_images_generation(
+# Data URLs longer than this are decoded in a worker thread to keep the event loop responsive.
+INLINE_DECODE_LIMIT = 256 * 1024
+
+# Texts and log actions of each kind of generation job.
+JOB_KINDS = {
+    "text": {
+        "action": "generate_image",
+        "done_action": "image_generated",
+        "history_prompt": "{prompt}",
+        "status_text": "⏳ Генерирую изображение... Это может занять некоторое время.",
+        "caption_title": "🎨 Сгенерировано по запросу",
+        "main_menu": False,
+    },
+    "image": {
+        "action": "generate_from_image",
+        "done_action": "image_generated_from_photo",
+        "history_prompt": "[Image-to-Image] {prompt}",
+        "status_text": "⏳ Генерирую изображение на основе вашего фото... Это может занять некоторое время.",
+        "caption_title": "🎨 Сгенерировано на основе вашего фото",
+        "main_menu": False,
+    },
+    "images": {
+        "action": "generate_from_images",
+        "done_action": "image_generated_from_photos",
+        "history_prompt": "[Multi-Image] {prompt}",
+        "status_text": "⏳ Генерирую изображение на основе {count} фото... Это может занять некоторое время.",
+        "caption_title": "🎨 Сгенерировано на основе {count} фото",
+        "main_menu": True,
+    },
+}
+
+GENERATION_ERROR_TEXT = "❌ Произошла ошибка при генерации изображения. Попробуйте позже."
+BUSY_TEXT = "⏳ Модель сейчас перегружена, попробуйте через минуту или выберите другую модель.\nРубины не списаны."
+UNAVAILABLE_TEXT = "⚠️ Модель сейчас недоступна, попробуйте позже или выберите другую модель.\nРубины не списаны."
+CACHE_MISS_TEXT = (
+    "❌ Готовый результат больше недоступен, а на новую генерацию не хватает рубинов.\n"
+    "Требуется: {cost} 💎\nРубины не списаны."
+)
+
+
+async def _fetch_result_image(d, image_url: str) -> Optional[BinaryIO]:
+    """Получить результат как файловый объект: data URL декодируется, http(s) URL скачивается общей сессией."""
+    if image_url.startswith("data:image"):
+        if len(image_url) > INLINE_DECODE_LIMIT:
+            image_data = await asyncio.to_thread(d["openrouter"].decode_base64_image, image_url)
+        else:
+            image_data = d["openrouter"].decode_base64_image(image_url)
+        # BytesIO over an existing bytes object shares it until written to; no copy is made.
+        return io.BytesIO(image_data) if image_data else None
+    if image_url.startswith("http"):
+        return await d["downloader"].fetch(image_url)
+    return None
+
+
+async def _enqueue_generation(
     update: Update,
     context: ContextTypes.DEFAULT_TYPE,
     prompt: str,
-    input_images: list,
+    kind: str,
+    input_images: list = (),
 ):
-    """Обработка генерации изображения на основе нескольких входных изображений."""
+    """Поставить генерацию в очередь и сразу вернуться.
+
+    Рубины резервируются в той же транзакции, что и создание задачи в generation_jobs;
+    саму генерацию выполняет GenerationWorkerPool (run_generation_job). Если модель
+    разрешает кэш и такой же запрос уже выполнялся, резервируется цена cache_hit_price_rubies
+    (если к запуску задачи запись кэша пропадёт, run_generation_job доведёт её до полной).
+    """
     d = deps_from_context(context)
     db = d["db"]
-    openrouter = d["openrouter"]
     interaction_logger = d["interaction_logger"]
+    result_cache = d["result_cache"]
+    models_manager = d["models_manager"]
 
     user = update.effective_user
     if not user:
         return
 
+    spec = JOB_KINDS[kind]
+    count = len(input_images)
+    reply_markup = get_main_menu_keyboard() if spec["main_menu"] else None
     selected_model = get_user_selected_model(context)
     generation_cost = selected_model["price_rubies"] if selected_model else 2
 
-    interaction_logger.info(
-        f"USER: @{user.username or 'не указан'} (ID: {user.id}) | "
-        f"ACTION: generate_from_images | COUNT: {len(input_images)} | PROMPT: {prompt[:100]}..."
-    )
-
-    status_message = await update.message.reply_text(
-        f"⏳ Генерирую изображение на основе {len(input_images)} фото... Это может занять некоторое время."
-    )
-
-    try:
-        image_url = await openrouter.generate_image(
-            prompt,
-            input_images=input_images,
-            model=selected_model["openrouter_name"],
-        )
-
-        if not image_url:
-            await status_message.edit_text("❌ Ошибка при генерации изображения. Попробуйте еще раз.")
+    model_name = selected_model["openrouter_name"]
+    if interaction_logger.enabled:
+        log_fields = {"count": count} if kind == "images" else {}
+        interaction_logger.event(user, spec["action"], model=model_name, prompt=prompt, **log_fields)
+
+    cache_key = None
+    cache_hit = False
+    if result_cache.enabled and models_manager.is_result_cacheable(model_name):
+        cache_key = await result_cache.key_for(model_name, prompt, input_images, kind)
+        if result_cache.contains(cache_key):
+            cache_hit = True
+            generation_cost = models_manager.get_cache_hit_price(model_name)
+
+    if not cache_hit:
+        # Refuse before reserving anything when the model could not even queue the call.
+        try:
+            d["admission"].check(model_name)
+        except AdmissionRejected as e:
+            interaction_logger.event(user, spec["action"], status="busy", model=model_name, reason=e.reason)
+            await update.message.reply_text(BUSY_TEXT, reply_markup=reply_markup)
             return
 
-        image_data = None
-        if image_url.startswith("data:image"):
-            image_data = openrouter.decode_base64_image(image_url)
-        elif image_url.startswith("http"):
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(image_url) as resp:
-                        if resp.status == 200:
-                            image_data = await resp.read()
-            except Exception as e:
-                logger.error(f"Error downloading image: {e}")
-
-        if not image_data:
-            await status_message.edit_text("❌ Не удалось обработать изображение. Попробуйте еще раз.")
+    async def reject(message):
+        rubies = await db.get_user_rubies(user.id)
+        interaction_logger.event(
+            user, spec["action"], status="insufficient_balance", model=model_name, cost=generation_cost, rubies=rubies
+        )
+        text = f"❌ Недостаточно рубинов!\n\nТекущий баланс: {rubies} 💎\nТребуется: {generation_cost} 💎\n\n"
+        if reply_markup is None:
+            await message.edit_text(text)
             return
+        # A reply keyboard cannot be attached by editing, so the refusal is a new message.
+        await message.delete()
+        await update.message.reply_text(text, reply_markup=reply_markup)
+
+    # Recent paying users get a bigger share of the upstream under load.
+    weight = 1.0
+    if GENERATION_PAYING_WEIGHT != 1 and await db.has_recent_payment(user.id, GENERATION_PAYING_WINDOW_DAYS * 86400):
+        weight = GENERATION_PAYING_WEIGHT
+
+    # No separate balance check: the reservation's conditional UPDATE fails on insufficient funds,
+    # and the status message then turns into the refusal.
+    status_message = await update.message.reply_text(spec["status_text"].format(count=count))
+    job_id = await db.enqueue_generation_job(
+        user.id,
+        update.effective_chat.id,
+        kind,
+        model_name,
+        prompt,
+        generation_cost,
+        input_images,
+        username=user.username,
+        status_message_id=status_message.message_id,
+        cache_key=cache_key,
+        weight=weight,
+        cache_hit=cache_hit,
+    )
+    if job_id is None:
+        await reject(status_message)
+        return
+    d["generation_workers"].notify()
 
-        success = await db.deduct_rubies(user.id, generation_cost)
-        if not success:
-            await status_message.edit_text("❌ Ошибка при списании рубинов")
-            return
 
-        await db.log_generation(user.id, f"[Multi-Image] {prompt}", generation_cost)
-        interaction_logger.info(
-            f"USER: @{user.username or 'не указан'} (ID: {user.id}) | "
-            f"ACTION: image_generated_from_photos | COST: {generation_cost} rubies | SUCCESS"
-        )
+async def _edit_status(bot: Bot, job: dict, text: str) -> None:
+    if not job.get("status_message_id"):
+        await bot.send_message(job["chat_id"], text)
+        return
+    try:
+        await bot.edit_message_text(text, chat_id=job["chat_id"], message_id=job["status_message_id"])
+    except Exception as e:
+        logger.warning(f"Не удалось обновить статус задачи {job.get('id')}: {e}")
 
-        await status_message.delete()
 
-        short_prompt = prompt[:150] + "..." if len(prompt) > 150 else prompt
-        await update.message.reply_photo(
-            photo=io.BytesIO(image_data),
-            caption=(
-                f"🎨 Сгенерировано на основе {len(input_images)} фото\n"
-                f"📝 Промпт: {short_prompt}\n\n"
-                f"💎 Потрачено: {generation_cost} рубин{'ов' if generation_cost > 1 else ''}"
-            ),
-            reply_markup=get_main_menu_keyboard(),
-        )
-
-        new_rubies = await db.get_user_rubies(user.id)
-        await update.message.reply_text(f"💎 Остаток рубинов: {new_rubies}", reply_markup=get_main_menu_keyboard())
+async def notify_refund(bot: Bot, refund: dict) -> None:
+    """Сообщить о возврате рубинов за задачу, которая не была выполнена (сбой процесса)"""
+    await _edit_status(
+        bot,
+        refund,
+        f"{GENERATION_ERROR_TEXT}\n💎 Рубины возвращены: {refund['cost']}. Баланс: {refund['balance']}",
+    )
 
-    except Exception as e:
-        logger.error(f"Error in process_images_generation: {e}")
-        await status_message.edit_text("❌ Произошла ошибка при генерации изображения. Попробуйте позже.")
 
+async def run_generation_job(d, bot: Bot, job: dict) -> None:
+    """Выполнить задачу генерации: модель (или кэш) -> отправка результата -> списание.
 
-async def process_image_generation(
-    update: Update,
-    context: ContextTypes.DEFAULT_TYPE,
-    prompt: str,
-    input_image: bytes,
-):
-    """Обработка генерации изображения на основе входного."""
-    d = deps_from_context(context)
+    Задача завершается (complete_generation_job) только после доставки результата;
+    при любой ошибке рубины возвращаются (refund_generation_job). Задача по цене кэша,
+    чей результат к запуску из кэша пропал, перед генерацией доплачивается до полной цены.
+    """
     db = d["db"]
     openrouter = d["openrouter"]
     interaction_logger = d["interaction_logger"]
-
-    user = update.effective_user
-    if not user:
-        return
-
-    selected_model = get_user_selected_model(context)
-    generation_cost = selected_model["price_rubies"] if selected_model else 2
-
-    interaction_logger.info(
-        f"USER: @{user.username or 'не указан'} (ID: {user.id}) | "
-        f"ACTION: generate_from_image | PROMPT: {prompt[:100]}..."
-    )
-
-    status_message = await update.message.reply_text(
-        "⏳ Генерирую изображение на основе вашего фото... Это может занять некоторое время."
-    )
-
+    result_cache = d["result_cache"]
+    file_registry = d["file_registry"]
+    admission = d["admission"]
+    models_manager = d["models_manager"]
+    single_flight = d["single_flight"]
+
+    spec = JOB_KINDS[job["kind"]]
+    input_count = len(job["inputs"])
+    prompt = job["prompt"]
+    model_name = job["model"]
+    cost = job["cost"]
+    chat_id = job["chat_id"]
+    reply_markup = get_main_menu_keyboard() if spec["main_menu"] else None
+    user = SimpleNamespace(id=job["user_id"], username=job["username"])
+
+    async def fail(text: str, error: str) -> None:
+        await db.refund_generation_job(job["id"], error, job["lease_owner"])
+        await _edit_status(bot, job, text)
+
+    image = None
+    completed = False
+    cached = False
+    loop = asyncio.get_running_loop()
+    started = loop.time()
     try:
-        image_url = await openrouter.generate_image(
-            prompt,
-            input_image=input_image,
-            model=selected_model["openrouter_name"],
-        )
-
-        if not image_url:
-            await status_message.edit_text("❌ Ошибка при генерации изображения. Попробуйте еще раз.")
-            return
-
-        image_data = None
-        if image_url.startswith("data:image"):
-            image_data = openrouter.decode_base64_image(image_url)
-        elif image_url.startswith("http"):
+        if job["cache_key"]:
+            data = await result_cache.get(job["cache_key"])
+            if data is not None:
+                image = io.BytesIO(data)
+                cached = True
+
+        if image is None and job["cache_hit"]:
+            # Priced as a hit, but the entry was evicted or unreadable: a real generation costs the full price.
+            full_cost = models_manager.get_model_price(model_name)
+            if full_cost > cost:
+                if await db.reprice_generation_job(job["id"], job["lease_owner"], job["user_id"], full_cost) is None:
+                    interaction_logger.event(
+                        user, spec["action"], status="insufficient_balance", model=model_name, cost=full_cost
+                    )
+                    await fail(CACHE_MISS_TEXT.format(cost=full_cost), "cache miss: insufficient balance")
+                    return
+                cost = job["cost"] = full_cost
+
+        if image is None:
+
+            async def generate():
+                # From here on the inputs travel as data URLs inside the request; dropping the
+                # raw bytes keeps them from sitting next to the request and response JSON.
+                inputs = job.pop("inputs")
+                content = openrouter.build_content(
+                    prompt,
+                    input_image=inputs[0] if job["kind"] == "image" else None,
+                    input_images=inputs if job["kind"] == "images" else None,
+                )
+                del inputs
+                async with admission.slot(model_name, job["user_id"], cost, job["weight"]):
+                    call_started = loop.time()
+                    try:
+                        image_url = await openrouter.generate_image(prompt, model=model_name, content=content)
+                    except UpstreamError:
+                        models_manager.record_call(model_name, None, ok=False)
+                        raise
+                models_manager.record_call(model_name, loop.time() - call_started, ok=bool(image_url))
+                return image_url
+
+            # Identical jobs running right now share one upstream call; each is still charged.
+            flight_key = None
+            if single_flight.enabled:
+                # The key covers the job kind, like the result cache key it may reuse.
+                flight_key = job["cache_key"] or await result_cache.key_for(
+                    model_name, prompt, job["inputs"], job["kind"]
+                )
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(image_url) as resp:
-                        if resp.status == 200:
-                            image_data = await resp.read()
-            except Exception as e:
-                logger.error(f"Error downloading image: {e}")
-
-        if not image_data:
-            await status_message.edit_text("❌ Не удалось обработать изображение. Попробуйте еще раз.")
-            return
+                image_url = await single_flight.run(flight_key, generate)
+            except AdmissionRejected as e:
+                if e.reason == "queue_full":
+                    # Claimed just as the gate filled up: back to the table until it has room.
+                    await db.requeue_generation_job(job["id"], job["lease_owner"])
+                    return
+                interaction_logger.event(user, spec["action"], status="busy", model=model_name, reason=e.reason)
+                await fail(BUSY_TEXT, f"busy: {e.reason}")
+                return
+            except UpstreamError as e:
+                interaction_logger.event(user, spec["action"], status="upstream_error", model=model_name, reason=e.kind)
+                await fail(UNAVAILABLE_TEXT if isinstance(e, CircuitOpen) else GENERATION_ERROR_TEXT, str(e))
+                return
+
+            if not image_url:
+                await fail("❌ Ошибка при генерации изображения. Попробуйте еще раз.", "empty result")
+                return
+
+            image = await _fetch_result_image(d, image_url)
+            if image is None:
+                await fail("❌ Не удалось обработать изображение. Попробуйте еще раз.", "bad result image")
+                return
+
+            if job["cache_key"]:
+                await result_cache.put(job["cache_key"], image)
 
-        success = await db.deduct_rubies(user.id, generation_cost)
-        if not success:
-            await status_message.edit_text("❌ Ошибка при списании рубинов")
+        short_prompt = prompt[:150] + "..." if len(prompt) > 150 else prompt
+        caption_title = spec["caption_title"].format(count=input_count)
+
+        async def deliver() -> Optional[int]:
+            await file_registry.send_photo(
+                bot,
+                chat_id,
+                image,
+                caption=(
+                    f"{caption_title}\n"
+                    f"📝 Промпт: {short_prompt}\n\n"
+                    f"💎 Потрачено: {cost} рубин{'ов' if cost > 1 else ''}"
+                ),
+                reply_markup=reply_markup,
+            )
+            if job.get("status_message_id"):
+                try:
+                    await bot.delete_message(chat_id, job["status_message_id"])
+                except Exception as e:
+                    logger.warning(f"Не удалось удалить статус задачи {job['id']}: {e}")
+
+            # Charge only once the result was actually delivered.
+            history_prompt = spec["history_prompt"].format(prompt=prompt)
+            return await db.complete_generation_job(job["id"], job["lease_owner"], history_prompt)
+
+        # Once sending starts the photo may reach the user even if the call is cancelled, so a
+        # shutdown waits for the job to be completed: a requeued job would be delivered twice.
+        delivery = asyncio.ensure_future(deliver())
+        try:
+            new_rubies = await asyncio.shield(delivery)
+        except asyncio.CancelledError:
+            await asyncio.wait([delivery])
+            raise
+        completed = True
+        if new_rubies is None:
+            logger.warning(f"Задача генерации {job['id']} доставлена, но аренда уже потеряна")
             return
+        if interaction_logger.enabled:
+            interaction_logger.event(
+                user,
+                spec["done_action"],
+                model=model_name,
+                cost=cost,
+                latency_ms=round((loop.time() - started) * 1000),
+                status="success",
+                cached=cached,
+                attempt=job["attempts"],
+            )
+
+        await bot.send_message(chat_id, f"💎 Остаток рубинов: {new_rubies}", reply_markup=reply_markup)
 
-        await db.log_generation(user.id, f"[Image-to-Image] {prompt}", generation_cost)
-        interaction_logger.info(
-            f"USER: @{user.username or 'не указан'} (ID: {user.id}) | "
-            f"ACTION: image_generated_from_photo | COST: {generation_cost} rubies | SUCCESS"
-        )
+    except Exception as e:
+        logger.error(f"Error in {spec['action']} (job {job['id']}): {e}")
+        if not completed:
+            await fail(GENERATION_ERROR_TEXT, str(e) or type(e).__name__)
+    finally:
+        if image is not None:
+            image.close()
 
-        await status_message.delete()
 
-        short_prompt = prompt[:150] + "..." if len(prompt) > 150 else prompt
-        await update.message.reply_photo(
-            photo=io.BytesIO(image_data),
-            caption=(
-                f"🎨 Сгенерировано на основе вашего фото\n"
-                f"📝 Промпт: {short_prompt}\n\n"
-                f"💎 Потрачено: {generation_cost} рубина"
-            ),
-        )
+async def process_text_generation(update: Update, context: ContextTypes.DEFAULT_TYPE, prompt: str):
+    """Генерация изображения по текстовому описанию (ставится в очередь)."""
+    await _enqueue_generation(update, context, prompt, "text")
 
-        new_rubies = await db.get_user_rubies(user.id)
-        await update.message.reply_text(f"💎 Остаток рубинов: {new_rubies}")
 
-    except Exception as e:
-        logger.error(f"Error in process_image_generation: {e}")
-        await status_message.edit_text("❌ Произошла ошибка при генерации изображения. Попробуйте позже.")
+async def process_images_generation(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    prompt: str,
+    input_images: list,
+):
+    """Генерация изображения на основе нескольких входных изображений (ставится в очередь)."""
+    await _enqueue_generation(update, context, prompt, "images", input_images)
+
 
+async def process_image_generation(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    prompt: str,
+    input_image: bytes,
+):
+    """Генерация изображения на основе входного (ставится в очередь)."""
+    await _enqueue_generation(update, context, prompt, "image", [input_image])
@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence
+
+from tg_bot.core.config import (
+    GENERATION_LEASE_SECONDS,
+    GENERATION_MAX_ATTEMPTS,
+    GENERATION_MAX_IN_FLIGHT_PER_USER,
+    GENERATION_POLL_INTERVAL,
+    GENERATION_WORKERS,
+)
+
+logger = logging.getLogger(__name__)
+
+ProcessJob = Callable[[dict], Awaitable[None]]
+OnRefund = Callable[[dict], Awaitable[None]]
+SkipModels = Callable[[], Sequence[str]]
+
+
+class GenerationWorkerPool:
+    """Пул исполнителей задач генерации из таблицы generation_jobs.
+
+    Исполнитель берёт задачу под аренду (lease) и продлевает её, пока задача выполняется.
+    Задача упавшего процесса снова становится доступной, когда аренда истекает, и
+    выполняется заново; если попытки кончились, рубины возвращаются (recover). При
+    остановке бота незавершённые задачи возвращаются в очередь. Задачи берутся по
+    очереди пользователей, не больше max_per_user одновременно на пользователя.
+    Задачи моделей из skip_models() (например, с заполненной очередью допуска) не
+    берутся и ждут в таблице, не занимая исполнителя.
+    """
+
+    def __init__(
+        self,
+        db,
+        workers: int = GENERATION_WORKERS,
+        lease_seconds: float = GENERATION_LEASE_SECONDS,
+        max_attempts: int = GENERATION_MAX_ATTEMPTS,
+        poll_interval: float = GENERATION_POLL_INTERVAL,
+        max_per_user: int = GENERATION_MAX_IN_FLIGHT_PER_USER,
+        skip_models: Optional[SkipModels] = None,
+    ):
+        self.db = db
+        self.workers = max(1, workers)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max(1, max_attempts)
+        self.poll_interval = poll_interval
+        self.max_per_user = max(0, max_per_user)
+        self.skip_models = skip_models
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._process: Optional[ProcessJob] = None
+        self._on_refund: Optional[OnRefund] = None
+        # One token per enqueued job wakes one idle worker; polling covers other processes.
+        self._wakeups: asyncio.Queue = asyncio.Queue(maxsize=self.workers)
+        self._tasks: List[asyncio.Task] = []
+        self.busy = 0
+        self.depth = {"queued": 0, "running": 0}
+        self.claimed = 0
+        self.resumed = 0
+        self.finished = 0
+        self.crashed = 0
+        self.requeued = 0
+        self.abandoned = 0
+        self._total_queue_wait = 0.0
+
+    def start(self, process: ProcessJob, on_refund: Optional[OnRefund] = None) -> None:
+        """Запустить исполнителей; process(job) выполняет задачу и сам завершает или возвращает её"""
+        if self._tasks:
+            return
+        self._process = process
+        self._on_refund = on_refund
+        self._tasks = [asyncio.create_task(self._worker(), name=f"generation-worker-{i}") for i in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._recovery_loop(), name="generation-recovery"))
+
+    async def stop(self) -> None:
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def notify(self) -> None:
+        """Разбудить исполнителя: в очереди новая задача"""
+        try:
+            self._wakeups.put_nowait(None)
+        except asyncio.QueueFull:
+            pass
+
+    async def run_once(self) -> bool:
+        """Взять и выполнить одну задачу. False — очередь пуста"""
+        skip = self.skip_models() if self.skip_models is not None else ()
+        job = await self.db.claim_generation_job(
+            self.owner, self.lease_seconds, self.max_attempts, self.max_per_user, skip
+        )
+        if job is None:
+            return False
+        self.claimed += 1
+        self.resumed += job["attempts"] > 1
+        self._total_queue_wait += max(0.0, time.time() - job["enqueued_at"])
+        await self._run(job)
+        return True
+
+    async def _run(self, job: dict) -> None:
+        self.busy += 1
+        heartbeat = asyncio.create_task(self._heartbeat(job["id"]))
+        try:
+            await self._process(job)
+            self.finished += 1
+        except asyncio.CancelledError:
+            # Shutdown mid-job: give it back so that the next start resumes it right away.
+            if await self.db.requeue_generation_job(job["id"], self.owner):
+                self.requeued += 1
+            raise
+        except Exception as e:
+            self.crashed += 1
+            logger.error(f"Задача генерации {job['id']} завершилась ошибкой: {e}", exc_info=True)
+            await self._refund(job["id"], f"crash: {e}", self.owner)
+        finally:
+            self.busy -= 1
+            heartbeat.cancel()
+
+    async def _heartbeat(self, job_id: int) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                if not await self.db.extend_generation_lease(job_id, self.owner, self.lease_seconds):
+                    logger.warning(f"Аренда задачи генерации {job_id} потеряна")
+                    return
+            except Exception as e:
+                logger.error(f"Не удалось продлить аренду задачи {job_id}: {e}")
+
+    async def _refund(self, job_id: int, error: str, owner: Optional[str]) -> None:
+        refund = await self.db.refund_generation_job(job_id, error, owner)
+        if refund is not None and self._on_refund is not None:
+            try:
+                await self._on_refund(refund)
+            except Exception as e:
+                logger.error(f"Не удалось уведомить о возврате за задачу {job_id}: {e}")
+
+    async def recover(self) -> int:
+        """Вернуть рубины за задачи с истёкшей арендой и без оставшихся попыток. Возвращает их число"""
+        job_ids = await self.db.get_abandoned_generation_jobs(self.max_attempts)
+        for job_id in job_ids:
+            logger.warning(f"Задача генерации {job_id} не завершилась за {self.max_attempts} попыток, возврат")
+            await self._refund(job_id, "abandoned", None)
+        self.abandoned += len(job_ids)
+        self.depth = await self.db.count_generation_jobs()
+        return len(job_ids)
+
+    async def _worker(self) -> None:
+        while True:
+            try:
+                if await self.run_once():
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка исполнителя генераций: {e}", exc_info=True)
+            try:
+                await asyncio.wait_for(self._wakeups.get(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _recovery_loop(self) -> None:
+        while True:
+            try:
+                await self.recover()
+            except Exception as e:
+                logger.error(f"Ошибка восстановления задач генерации: {e}", exc_info=True)
+            await asyncio.sleep(self.lease_seconds)
+
+    def stats(self) -> Dict:
+        return {
+            "workers": self.workers,
+            "busy": self.busy,
+            "queued": self.depth["queued"],
+            "running": self.depth["running"],
+            "claimed": self.claimed,
+            "resumed": self.resumed,
+            "finished": self.finished,
+            "crashed": self.crashed,
+            "requeued_on_stop": self.requeued,
+            "refunded_abandoned": self.abandoned,
+            "avg_queue_ms": round(self._total_queue_wait / self.claimed * 1000, 1) if self.claimed else 0.0,
+        }
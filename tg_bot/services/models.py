@@ -5,13 +5,18 @@ from tg_bot.state import SELECTED_MODEL
 
 
 def get_user_selected_model(context: ContextTypes.DEFAULT_TYPE):
-    """Получить выбранную пользователем модель или модель по умолчанию."""
+    """Получить выбранную пользователем модель или модель по умолчанию.
+
+    Для выбора «auto» возвращается модель, на которую сейчас направляется запрос.
+    """
     d = deps_from_context(context)
     models_manager = d["models_manager"]
 
     selected_model_name = context.user_data.get(SELECTED_MODEL)
     if selected_model_name:
         model = models_manager.get_model_by_name(selected_model_name)
+        if model and model.get("auto"):
+            return models_manager.route_auto(model)
         if model:
             return model
 
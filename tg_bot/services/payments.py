@@ -0,0 +1,54 @@
+import logging
+from typing import Optional
+
+from telegram import Bot
+
+logger = logging.getLogger(__name__)
+
+
+def payment_success_text(rubies: int, balance: int) -> str:
+    return f"✅ Платеж успешно обработан!\n\nНачислено: {rubies} 💎\nТекущий баланс: {balance} 💎"
+
+
+async def apply_provider_status(
+    d,
+    payment_id: str,
+    provider_status: Optional[dict],
+    *,
+    bot: Optional[Bot] = None,
+) -> dict:
+    """Применить проверенный у ЮКассы статус платежа к БД.
+
+    Начисление идёт через compare-and-set в `Database.credit_payment`, поэтому webhook,
+    кнопка «Проверить оплату» и повторные уведомления начисляют рубины ровно один раз.
+    Если передан `bot`, пользователь получает сообщение о зачислении.
+
+    Возвращает {"result": "credited" | "already_processed" | "canceled" | "pending", ...}.
+    """
+    db = d["db"]
+    interaction_logger = d["interaction_logger"]
+
+    if provider_status and provider_status.get("paid") and provider_status.get("status") == "succeeded":
+        credited = await db.credit_payment(payment_id)
+        if credited is None:
+            return {"result": "already_processed"}
+
+        interaction_logger.info(
+            f"PAYMENT: {payment_id} | USER_ID: {credited['user_id']} | RUBIES: {credited['rubies']} | ACTION: credited"
+        )
+        if bot is not None:
+            try:
+                await bot.send_message(
+                    chat_id=credited["user_id"],
+                    text=payment_success_text(credited["rubies"], credited["balance"]),
+                )
+            except Exception as e:
+                # The credit is already committed; a blocked bot must not turn it into a retry.
+                logger.warning(f"Не удалось уведомить пользователя {credited['user_id']} о платеже {payment_id}: {e}")
+        return {"result": "credited", **credited}
+
+    if provider_status and provider_status.get("status") == "canceled":
+        await db.update_payment_status(payment_id, "canceled", expected_status="pending")
+        return {"result": "canceled"}
+
+    return {"result": "pending"}
@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from telegram import Bot
+
+from tg_bot.core.config import (
+    PAYMENT_PENDING_TTL,
+    PAYMENT_RECONCILE_BATCH,
+    PAYMENT_RECONCILE_CONCURRENCY,
+    PAYMENT_RECONCILE_MIN_AGE,
+    PAYMENT_RECONCILE_RATE,
+)
+from tg_bot.services.payments import apply_provider_status
+
+logger = logging.getLogger(__name__)
+
+
+class _RateLimiter:
+    """Не чаще `rate` вызовов в секунду (равномерно, без всплесков)."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class PaymentReconciler:
+    """Фоновая сверка ожидающих платежей с ЮКассой.
+
+    Проходит по `pending`-платежам порциями (keyset по idx_payments_status_created),
+    запрашивает статусы параллельно с ограничением по числу и частоте запросов,
+    начисляет оплаченные через тот же compare-and-set, что и webhook, отменённые
+    помечает `canceled`, а неоплаченные дольше PAYMENT_PENDING_TTL — `expired`.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = PAYMENT_RECONCILE_BATCH,
+        concurrency: int = PAYMENT_RECONCILE_CONCURRENCY,
+        rate: float = PAYMENT_RECONCILE_RATE,
+        min_age_seconds: int = PAYMENT_RECONCILE_MIN_AGE,
+        pending_ttl_seconds: int = PAYMENT_PENDING_TTL,
+    ):
+        self.batch_size = batch_size
+        self.concurrency = max(1, concurrency)
+        self.min_age_seconds = min_age_seconds
+        self.pending_ttl_seconds = pending_ttl_seconds
+        self._limiter = _RateLimiter(rate)
+        self._lock = asyncio.Lock()
+        self._counters = {
+            "runs": 0,
+            "checked": 0,
+            "credited": 0,
+            "canceled": 0,
+            "expired": 0,
+            "still_pending": 0,
+            "errors": 0,
+        }
+        self._last_run_ms = 0
+        self._last_checks_per_sec = 0.0
+
+    async def run_once(self, d, bot: Optional[Bot] = None) -> dict:
+        """Один проход по всем ожидающим платежам. Возвращает счётчики этого прохода"""
+        async with self._lock:
+            started = time.monotonic()
+            run = dict.fromkeys(self._counters, 0)
+            run["runs"] = 1
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def reconcile(payment: dict) -> None:
+                async with semaphore:
+                    await self._limiter.wait()
+                    await self._reconcile_one(d, bot, payment, run)
+
+            after = None
+            while True:
+                batch = await d["db"].get_pending_payments(
+                    self.batch_size, self.min_age_seconds, self.pending_ttl_seconds, after=after
+                )
+                if not batch:
+                    break
+                await asyncio.gather(*(reconcile(payment) for payment in batch))
+                if len(batch) < self.batch_size:
+                    break
+                after = (batch[-1]["created_at"], batch[-1]["payment_id"])
+
+            elapsed = time.monotonic() - started
+            for key, value in run.items():
+                self._counters[key] += value
+            self._last_run_ms = round(elapsed * 1000)
+            self._last_checks_per_sec = round(run["checked"] / elapsed, 1) if elapsed > 0 else 0.0
+            if run["checked"]:
+                logger.info(
+                    f"Сверка платежей: проверено {run['checked']}, начислено {run['credited']}, "
+                    f"отменено {run['canceled']}, просрочено {run['expired']}, ошибок {run['errors']} "
+                    f"за {self._last_run_ms} мс"
+                )
+            return run
+
+    async def _reconcile_one(self, d, bot: Optional[Bot], payment: dict, run: dict) -> None:
+        payment_id = payment["payment_id"]
+        try:
+            provider_status = await d["yookassa"].check_payment_status(payment_id)
+            run["checked"] += 1
+            if provider_status is None:
+                run["errors"] += 1
+                return
+
+            result = await apply_provider_status(d, payment_id, provider_status, bot=bot)
+            if result["result"] == "credited":
+                run["credited"] += 1
+            elif result["result"] == "canceled":
+                run["canceled"] += 1
+            elif result["result"] == "pending":
+                if payment["stale"] and await d["db"].update_payment_status(
+                    payment_id, "expired", expected_status="pending"
+                ):
+                    run["expired"] += 1
+                else:
+                    run["still_pending"] += 1
+        except Exception as e:
+            run["errors"] += 1
+            logger.error(f"Ошибка сверки платежа {payment_id}: {e}", exc_info=True)
+
+    def stats(self) -> dict:
+        return {
+            **self._counters,
+            "last_run_ms": self._last_run_ms,
+            "last_checks_per_sec": self._last_checks_per_sec,
+        }
+
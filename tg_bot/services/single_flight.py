@@ -0,0 +1,72 @@
+"""Identical in-flight generations share one upstream call; each job is still charged."""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from tg_bot.core.config import GENERATION_SINGLE_FLIGHT
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Один вызов апстрима на одинаковые одновременные запросы.
+
+    Первый запрос с ключом запускает вызов отдельной задачей, остальные с тем же
+    ключом ждут её результат (или ошибку). Отмена одного ожидающего не отменяет вызов
+    для остальных; вызов отменяется, только когда ждать его больше некому.
+    """
+
+    def __init__(self, enabled: bool = GENERATION_SINGLE_FLIGHT):
+        self.enabled = enabled
+        self._flights: Dict[str, _Flight] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def run(self, key: Optional[str], call: Callable[[], Awaitable[Any]]) -> Any:
+        """Результат call() — своего или уже выполняющегося вызова с тем же ключом (None — без объединения)"""
+        if key is None or not self.enabled:
+            self.calls += 1
+            return await call()
+
+        flight = self._flights.get(key)
+        if flight is None:
+            self.calls += 1
+            flight = self._flights[key] = _Flight(asyncio.ensure_future(call()))
+            flight.task.add_done_callback(lambda _task: self._finish(key, flight))
+        else:
+            self.coalesced += 1
+            logger.info(f"Запрос {key[:12]} присоединён к уже выполняющемуся")
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if not flight.waiters and not flight.task.done():
+                # Nobody waits any more: later requests must start a fresh call.
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
+
+    def _finish(self, key: str, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not flight.task.cancelled():
+            # Retrieved here so an error nobody waits for any more is not reported as lost.
+            flight.task.exception()
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._flights),
+            "upstream_calls": self.calls,
+            "saved_calls": self.coalesced,
+        }
@@ -3,8 +3,5 @@ WAITING_FOR_FEEDBACK = "waiting_for_feedback"
 WAITING_FOR_IMAGE_PROMPT = "waiting_for_image_prompt"
 WAITING_FOR_IMAGES_PROMPT = "waiting_for_images_prompt"
 
-INPUT_IMAGE = "input_image"
-INPUT_IMAGES = "input_images"
-
 SELECTED_MODEL = "selected_model"
 
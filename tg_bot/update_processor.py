@@ -0,0 +1,60 @@
+"""Concurrent update processing with per-user ordering."""
+
+import asyncio
+from typing import Any, Awaitable, Dict, Optional
+
+from telegram.ext import BaseUpdateProcessor
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Обрабатывает апдейты разных пользователей параллельно, а апдейты одного пользователя — по порядку.
+
+    Сначала берётся лок пользователя и только потом слот из общего лимита, поэтому
+    очередь апдейтов одного пользователя не занимает слоты, пока ждёт своей очереди.
+    Базовый семафор PTB ограничивает общее число принятых (выполняемых + ожидающих) апдейтов.
+    """
+
+    def __init__(self, max_concurrent_updates: int, max_pending_updates: Optional[int] = None):
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        super().__init__(max(max_pending_updates or 0, max_concurrent_updates))
+        self.concurrency_limit = max_concurrent_updates
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        # user_id -> [lock, number of updates holding or waiting for it]
+        self._user_locks: Dict[int, list] = {}
+
+    @staticmethod
+    def _ordering_key(update: object) -> Optional[int]:
+        user = getattr(update, "effective_user", None)
+        if user:
+            return user.id
+        chat = getattr(update, "effective_chat", None)
+        if chat:
+            return chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self._ordering_key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        entry = self._user_locks.get(key)
+        if entry is None:
+            entry = self._user_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._slots:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._user_locks[key]
+
+    async def initialize(self) -> None:
+        """Nothing to allocate."""
+
+    async def shutdown(self) -> None:
+        """Nothing to free."""
@@ -0,0 +1,113 @@
+"""aiohttp server for Telegram webhook mode and YooKassa payment notifications."""
+
+import hmac
+import ipaddress
+import json
+import logging
+from typing import List, Optional
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+from tg_bot.services.payments import apply_provider_status
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+APPLICATION_KEY = web.AppKey("application", Application)
+SECRET_TOKEN_KEY = web.AppKey("secret_token", str)
+ALLOWED_NETWORKS_KEY = web.AppKey("yookassa_allowed_networks", list)
+
+YOOKASSA_EVENTS = {"payment.succeeded", "payment.canceled"}
+
+
+async def telegram_webhook(request: web.Request) -> web.Response:
+    """Принять апдейт от Telegram: проверить секрет, положить в очередь PTB и сразу ответить 200.
+
+    Обработка идёт дальше через update_queue -> PerUserUpdateProcessor, поэтому Telegram
+    не ждёт выполнения хендлеров.
+    """
+    application = request.app[APPLICATION_KEY]
+    secret_token = request.app[SECRET_TOKEN_KEY]
+    if secret_token and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret_token):
+        return web.Response(status=403)
+
+    try:
+        data = await request.json()
+        update = Update.de_json(data, application.bot)
+    except (json.JSONDecodeError, ValueError, TypeError, KeyError) as e:
+        logger.warning(f"Некорректный апдейт в webhook: {e}")
+        return web.Response(status=400)
+
+    await application.update_queue.put(update)
+    return web.Response()
+
+
+def _is_allowed(remote: Optional[str], networks: list) -> bool:
+    if not networks:
+        return True
+    try:
+        address = ipaddress.ip_address(remote or "")
+    except ValueError:
+        return False
+    return any(address in network for network in networks)
+
+
+async def yookassa_webhook(request: web.Request) -> web.Response:
+    """Принять уведомление ЮКассы о платеже.
+
+    Телу уведомления не доверяем: статус перечитывается у ЮКассы по payment_id, и
+    только после этого платеж подтверждается (начисление через compare-and-set) или
+    отменяется. 200 означает «обработано/не наше», 500 — попросить ЮКассу повторить.
+    """
+    if not _is_allowed(request.remote, request.app[ALLOWED_NETWORKS_KEY]):
+        logger.warning(f"Уведомление ЮКассы с неразрешённого адреса {request.remote}")
+        return web.Response(status=403)
+
+    try:
+        data = await request.json()
+        event = data["event"]
+        payment_id = str(data["object"]["id"])
+    except (json.JSONDecodeError, ValueError, TypeError, KeyError) as e:
+        logger.warning(f"Некорректное уведомление ЮКассы: {e}")
+        return web.Response(status=400)
+
+    if event not in YOOKASSA_EVENTS:
+        return web.Response()
+
+    application = request.app[APPLICATION_KEY]
+    d = application.bot_data
+    payment = await d["db"].get_payment(payment_id)
+    if payment is None:
+        logger.warning(f"Уведомление ЮКассы о неизвестном платеже {payment_id}")
+        return web.Response()
+    if payment["status"] == "succeeded":
+        return web.Response()
+
+    provider_status = await d["yookassa"].check_payment_status(payment_id)
+    if provider_status is None:
+        return web.Response(status=500)
+
+    result = await apply_provider_status(d, payment_id, provider_status, bot=application.bot)
+    logger.info(f"Уведомление ЮКассы {event} для {payment_id}: {result['result']}")
+    return web.Response()
+
+
+def create_web_app(
+    application: Application,
+    secret_token: str = "",
+    path: Optional[str] = None,
+    yookassa_path: Optional[str] = None,
+    yookassa_allowed_ips: Optional[List[str]] = None,
+) -> web.Application:
+    """Собрать aiohttp-приложение: webhook Telegram (`path`) и/или уведомления ЮКассы (`yookassa_path`)"""
+    app = web.Application()
+    app[APPLICATION_KEY] = application
+    app[SECRET_TOKEN_KEY] = secret_token
+    app[ALLOWED_NETWORKS_KEY] = [ipaddress.ip_network(x, strict=False) for x in (yookassa_allowed_ips or [])]
+    if path:
+        app.router.add_post(path, telegram_webhook)
+    if yookassa_path:
+        app.router.add_post(yookassa_path, yookassa_webhook)
+    return app